@@ -5,7 +5,15 @@ Aggregates frame data into 5-second windows and generates crowd state classifica
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Callable
 from pymongo import ASCENDING
-from db import db
+from db import db, expand_frame_runs
+
+# Thresholds of the classify_crowd_state rules (threshold_sweep.py evaluates alternatives)
+CROWD_STATE_RULES = {
+    "DENSE_DENSITY_SCORE": 18,
+    "DENSE_FAST_MOTION_RATIO": 0.8,
+    "SURGE_GROWTH_RATE": 0.25,
+    "SUSTAINED_ABNORMAL_SCORE": 0.7
+}
 
 # Global callback for broadcasting remarks (set by main.py)
 _remark_broadcast_callback: Optional[Callable] = None
@@ -45,12 +53,49 @@ def get_unprocessed_frames(session_id: str, last_window_end: Optional[datetime])
     query = {"session_id": session_id}
     
     if last_window_end:
-        query["timestamp"] = {"$gt": last_window_end}
+        # A run of unchanged frames (db.FrameRunEncoder) may start before the last window and end after it
+        query["$or"] = [{"timestamp": {"$gt": last_window_end}}, {"end_timestamp": {"$gt": last_window_end}}]
     
-    frames = list(db.yolov.find(query, {"_id": 0}).sort("timestamp", ASCENDING))
+    frames = expand_frame_runs(db.yolov.find(query, {"_id": 0}).sort("timestamp", ASCENDING))
+    if last_window_end:
+        frames = [f for f in frames if normalize_datetime(f.get("timestamp")) > last_window_end]
     return frames
 
 
+def frames_written_through(frames: List[Dict], window_end: datetime, from_first_frame: bool) -> bool:
+    """
+    Check that every frame of a session before `window_end` has been written.
+
+    Frames do not reach the collection in order: batches and spooled writes
+    land late, runs of unchanged frames once they end, and the segments of a
+    long video are written in parallel. Analyzed frames are evenly spaced, so
+    the frames before `window_end` are complete when the frame numbers run
+    without a gap to a frame at or after it.
+    
+    Args:
+        frames: Unaggregated frames sorted by timestamp
+        window_end: End timestamp of the window to close
+        from_first_frame: No window has been closed yet, so `frames` must
+            start at the first analyzed frame of the session
+    
+    Returns:
+        True if the window can be closed
+    """
+    numbers = [f.get("frame", 0) for f in frames]
+    steps = [b - a for a, b in zip(numbers, numbers[1:]) if b > a]
+    if not steps:
+        return False
+    step = min(steps)
+    if from_first_frame and numbers[0] != step:
+        return False
+    for previous, frame in zip(numbers, frames[1:]):
+        if frame.get("frame", 0) - previous > step:
+            return False
+        if normalize_datetime(frame.get("timestamp")) >= window_end:
+            return True
+    return False
+
+
 def aggregate_window(frames: List[Dict], window_start: datetime, window_end: datetime) -> Optional[Dict]:
     """
     Aggregate frames within a time window.
@@ -128,7 +173,8 @@ def classify_crowd_state(
     max_density_score: float,
     avg_fast_motion_ratio: float,
     crowd_growth_rate: float,
-    avg_abnormal_score: float
+    avg_abnormal_score: float,
+    rules: Dict = CROWD_STATE_RULES
 ) -> Tuple[str, str]:
     """
     Classify crowd state and severity based on rule-based logic.
@@ -138,20 +184,21 @@ def classify_crowd_state(
         avg_fast_motion_ratio: Average fast motion ratio
         crowd_growth_rate: Crowd growth rate
         avg_abnormal_score: Average abnormal score
+        rules: Rule thresholds (see CROWD_STATE_RULES)
     
     Returns:
         Tuple of (crowd_state, severity)
     """
     # Rule 1: DENSE_FAST_MOVING
-    if max_density_score > 18 and avg_fast_motion_ratio > 0.8:
+    if max_density_score > rules["DENSE_DENSITY_SCORE"] and avg_fast_motion_ratio > rules["DENSE_FAST_MOTION_RATIO"]:
         return "DENSE_FAST_MOVING", "CRITICAL"
     
     # Rule 2: SUDDEN_SURGE
-    if crowd_growth_rate > 0.25:
+    if crowd_growth_rate > rules["SURGE_GROWTH_RATE"]:
         return "SUDDEN_SURGE", "HIGH"
     
     # Rule 3: SUSTAINED_ABNORMAL
-    if avg_abnormal_score > 0.7:
+    if avg_abnormal_score > rules["SUSTAINED_ABNORMAL_SCORE"]:
         return "SUSTAINED_ABNORMAL", "MEDIUM"
     
     # Default: NORMAL
@@ -216,12 +263,14 @@ def update_last_window_end(session_id: str, window_end: datetime):
     )
 
 
-def process_session_window(session_id: str) -> bool:
+def process_session_window(session_id: str, flushed: bool = False) -> bool:
     """
     Process one 5-second window for a session.
     
     Args:
         session_id: Session identifier
+        flushed: Every frame of the session has been written (it is completed),
+            so windows are closed without checking frames_written_through
     
     Returns:
         True if a window was processed, False otherwise
@@ -244,6 +293,10 @@ def process_session_window(session_id: str) -> bool:
         window_start = first_frame_time
     
     window_end = window_start + timedelta(seconds=5)
+
+    # Only close a window once its frames have been written
+    if not flushed and not frames_written_through(frames, window_end, last_window_end is None):
+        return False
     
     # Filter frames within the window
     window_frames = []
@@ -283,7 +336,7 @@ def process_session_window(session_id: str) -> bool:
     aggregated["remark"] = generate_remark(crowd_state)
     
     # Save aggregated window
-    db.aggregate_frame_data.insert_one(aggregated)
+    db.insert_aggregate(aggregated)
     
     # Update last window end
     update_last_window_end(session_id, window_end)
@@ -377,12 +430,13 @@ def run_window_aggregator():
     return processed_count
 
 
-def run_window_aggregator_for_session(session_id: str) -> int:
+def run_window_aggregator_for_session(session_id: str, flushed: bool = False) -> int:
     """
     Process all available windows for a specific session.
     
     Args:
         session_id: Session identifier
+        flushed: Every frame of the session has been written (see process_session_window)
     
     Returns:
         Number of windows processed
@@ -391,7 +445,7 @@ def run_window_aggregator_for_session(session_id: str) -> int:
     
     while True:
         try:
-            if process_session_window(session_id):
+            if process_session_window(session_id, flushed):
                 processed_count += 1
             else:
                 break  # No more windows to process
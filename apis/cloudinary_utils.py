@@ -53,29 +53,45 @@ def upload_frame_to_cloudinary(frame, session_id, frame_number, folder="abnormal
         # Encode frame as JPEG
         _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
         
-        # Convert to bytes
-        frame_bytes = buffer.tobytes()
-        
-        # Create unique public_id for the image (without folder prefix, as folder is set separately)
-        public_id = f"{session_id}/frame_{frame_number}"
-        
-        # Upload to Cloudinary
-        upload_result = cloudinary.uploader.upload(
-            frame_bytes,
-            public_id=public_id,
-            folder=folder,
-            resource_type="image",
-            overwrite=True,
-            format="jpg"
-        )
-        
-        # Return the secure URL
-        return upload_result.get('secure_url') or upload_result.get('url')
+        # Convert to bytes and upload
+        return upload_jpeg_to_cloudinary(buffer.tobytes(), session_id, frame_number, folder=folder)
         
     except Exception as e:
         print(f"Error uploading frame to Cloudinary: {e}")
         return None
 
+def upload_jpeg_to_cloudinary(jpeg_bytes, session_id, frame_number, folder="abnormal_frames"):
+    """
+    Upload JPEG bytes to Cloudinary, raising on failure so callers can retry.
+    
+    Args:
+        jpeg_bytes: Encoded JPEG image
+        session_id: Session ID for organizing uploads
+        frame_number: Frame number for naming
+        folder: Cloudinary folder path (default: "abnormal_frames")
+    
+    Returns:
+        str: Cloudinary URL of the uploaded image
+    """
+    # Create unique public_id for the image (without folder prefix, as folder is set separately)
+    public_id = f"{session_id}/frame_{frame_number}"
+    
+    # Upload to Cloudinary
+    upload_result = cloudinary.uploader.upload(
+        jpeg_bytes,
+        public_id=public_id,
+        folder=folder,
+        resource_type="image",
+        overwrite=True,
+        format="jpg"
+    )
+    
+    # Return the secure URL
+    url = upload_result.get('secure_url') or upload_result.get('url')
+    if not url:
+        raise RuntimeError(f"Cloudinary returned no URL for {public_id}")
+    return url
+
 def upload_base64_to_cloudinary(base64_string, session_id, frame_number, folder="abnormal_frames"):
     """
     Upload a base64 encoded image to Cloudinary.
@@ -1,4 +1,5 @@
 from pymongo import MongoClient
+from pymongo.errors import CollectionInvalid
 from pymongo.server_api import ServerApi
 import os
 from datetime import datetime
@@ -6,6 +7,13 @@ from dotenv import load_dotenv
 from pathlib import Path
 import certifi
 import ssl
+import atexit
+import threading
+import time
+import base64
+import json
+from spool import WriteSpool
+from indexes import ensure_indexes
 
 # Load environment variables from .env file in project root
 env_path = Path(__file__).parent.parent / '.env'
@@ -17,6 +25,247 @@ DB_NAME = os.getenv("DB_NAME", "video_output")  # Default value if not set
 if not MONGO_URI:
     raise ValueError("MONGO_URI environment variable is not set. Please check your .env file.")
 
+# Frame write-behind buffer: flush every FRAME_BATCH_SIZE frames or FRAME_FLUSH_INTERVAL seconds,
+# block producers once FRAME_BUFFER_MAX_PENDING frames are waiting.
+# The flush interval must stay well below the aggregator's 5 second window.
+FRAME_BATCH_SIZE = int(os.getenv("FRAME_BATCH_SIZE", "50"))
+FRAME_FLUSH_INTERVAL = float(os.getenv("FRAME_FLUSH_INTERVAL", "1.0"))
+FRAME_BUFFER_MAX_PENDING = int(os.getenv("FRAME_BUFFER_MAX_PENDING", "1000"))
+# Spool writes to local disk while MongoDB is slow or unreachable (see spool.py)
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+# Run-length encoding of unchanged frames: consecutive frames with the same metrics (float metrics within
+# FRAME_RUN_TOLERANCE) are stored as one document with a run_length, at most FRAME_RUN_MAX_LENGTH frames
+# (0 stores every frame) and FRAME_RUN_MAX_SECONDS long. Abnormal frames are always stored on their own.
+FRAME_RUN_MAX_LENGTH = int(os.getenv("FRAME_RUN_MAX_LENGTH", "0"))
+FRAME_RUN_MAX_SECONDS = float(os.getenv("FRAME_RUN_MAX_SECONDS", "4.0"))
+FRAME_RUN_TOLERANCE = float(os.getenv("FRAME_RUN_TOLERANCE", "0"))
+# Number of frames a frame document stands for, in aggregation pipelines
+RUN_WEIGHT = {"$ifNull": ["$run_length", 1]}
+# Frame documents layout: "documents" stores one document per frame in `yolov`; "timeseries" stores them
+# in the MongoDB time-series collection FRAME_TIMESERIES_COLLECTION, which packs the frames of a session
+# into compressed columnar buckets (MongoDB 7.0+ for the frame patches and resume deletes).
+# migrate_frames.py copies existing frames to the time-series collection.
+FRAME_STORAGE = os.getenv("FRAME_STORAGE", "documents").lower()
+FRAME_DOCUMENT_COLLECTION = "yolov"
+FRAME_TIMESERIES_COLLECTION = os.getenv("FRAME_TIMESERIES_COLLECTION", "frame_metrics")
+# Session listing: page size and the fields returned unless others are asked for
+SESSION_PAGE_SIZE = 50
+SESSION_PAGE_MAX = 500
+SESSION_LIST_FIELDS = ("session_id", "filename", "status", "start_time", "end_time", "summary", "error",
+                       "source_session_id")
+
+
+class FrameWriteBuffer:
+    """
+    Write-behind buffer batching frame documents into unordered insert_many calls.
+
+    A background thread flushes when FRAME_BATCH_SIZE documents are waiting or
+    FRAME_FLUSH_INTERVAL seconds have passed. Once max_pending documents are
+    waiting or in flight, `add` spills the waiting documents to `spool` when
+    one is given and blocks otherwise, so memory stays bounded either way.
+    Failed batches also go to the spool and are replayed later.
+    """
+
+    def __init__(self, collection, batch_size=FRAME_BATCH_SIZE, flush_interval=FRAME_FLUSH_INTERVAL,
+                 max_pending=FRAME_BUFFER_MAX_PENDING, spool=None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spool = spool
+        self.stats = {"inserted": 0, "batches": 0, "spooled": 0, "failed": 0}
+
+        self._pending = []
+        self._in_flight = []
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="frame-write-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, doc):
+        with self._cond:
+            if self.spool is not None and len(self._pending) + len(self._in_flight) >= self.max_pending:
+                # The database is lagging: move the backlog to disk instead of stalling the producer
+                spill, self._pending = self._pending, []
+                self._spool(spill)
+            while len(self._pending) + len(self._in_flight) >= self.max_pending and not self._closed:
+                self._cond.wait()
+            self._pending.append(doc)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def patch(self, session_id, frame, fields):
+        """
+        Update a frame document that has not reached the database yet.
+
+        Returns:
+            True if the buffered document was updated; False if it is already
+            stored (callers then update it in the collection)
+        """
+        with self._cond:
+            for doc in reversed(self._pending):
+                if doc["session_id"] == session_id and doc.get("frame") == frame:
+                    doc.update(fields)
+                    return True
+            # The document is being written right now: wait so the caller's update finds it
+            while any(d["session_id"] == session_id and d.get("frame") == frame for d in self._in_flight):
+                self._cond.wait()
+        return False
+
+    def flush(self):
+        """Write every buffered document and wait until they are stored."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._pending) < self.batch_size and not self._flush_requested
+                       and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed and not self._pending:
+                    return
+                self._flush_requested = False
+                batch, self._pending = self._pending, []
+                self._in_flight = batch
+
+            if batch:
+                self._write(batch)
+
+            with self._cond:
+                self._in_flight = []
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        try:
+            # insert_many assigns each document an _id first, so a spooled retry cannot duplicate it
+            # (in a time-series collection the replay deletes the frames stored before the failure)
+            self.collection.insert_many(batch, ordered=False)
+            self.stats["inserted"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            print(f"Error inserting {len(batch)} frame documents: {e}")
+            if self.spool is not None:
+                self._spool(batch)
+            else:
+                self.stats["failed"] += len(batch)
+
+    def _spool(self, docs):
+        if docs:
+            spooled = self.spool.append_inserts(self.collection.name, docs)
+            self.stats["spooled"] += spooled
+            self.stats["failed"] += len(docs) - spooled
+
+class FrameRunEncoder:
+    """
+    Merges runs of consecutive frame documents with unchanged metrics.
+
+    A run is stored as the document of its first frame plus run_length,
+    end_frame and end_timestamp; a frame on its own is stored unchanged.
+    Frames of a run are evenly spaced, so `expand_frame_runs` restores every
+    frame number exactly and the timestamps approximately. Readers that do
+    not expand runs weight each document by its run_length.
+    """
+
+    # Never part of the compared metrics
+    IGNORED_FIELDS = ("session_id", "frame", "timestamp", "cloudinary_url")
+
+    def __init__(self, max_length=FRAME_RUN_MAX_LENGTH, max_seconds=FRAME_RUN_MAX_SECONDS,
+                 tolerance=FRAME_RUN_TOLERANCE):
+        self.max_length = max_length
+        self.max_seconds = max_seconds
+        self.tolerance = tolerance
+        self.stats = {"frames": 0, "documents": 0}
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def add(self, doc):
+        """Add the next frame document of a session; returns the documents (closed runs) ready to be written."""
+        with self._lock:
+            self.stats["frames"] += 1
+            session_id = doc["session_id"]
+            run = self._runs.get(session_id)
+            if run is not None and self._extends(run, doc):
+                run["end_frame"] = doc["frame"]
+                run["end_timestamp"] = doc["timestamp"]
+                run["run_length"] += 1
+                return []
+            ready = [self._close(self._runs.pop(session_id))] if run is not None else []
+            if self.max_length > 1 and not doc.get("abnormal_activity"):
+                self._runs[session_id] = {"doc": doc, "end_frame": doc["frame"], "end_timestamp": doc["timestamp"],
+                                          "run_length": 1}
+            else:
+                ready.append(doc)
+                self.stats["documents"] += 1
+            return ready
+
+    def close_all(self):
+        """Close every open run; returns their documents."""
+        with self._lock:
+            runs, self._runs = self._runs, {}
+            return [self._close(run) for run in runs.values()]
+
+    def _extends(self, run, doc):
+        first = run["doc"]
+        if (doc.get("abnormal_activity") or run["run_length"] >= self.max_length
+                or (doc["timestamp"] - first["timestamp"]).total_seconds() > self.max_seconds):
+            return False
+        # Frames of a run are evenly spaced
+        step = doc["frame"] - run["end_frame"]
+        if step <= 0 or (run["run_length"] > 1 and step * (run["run_length"] - 1) != run["end_frame"] - first["frame"]):
+            return False
+        keys = set(first) | set(doc)
+        for key in keys.difference(self.IGNORED_FIELDS):
+            a, b = first.get(key), doc.get(key)
+            if isinstance(a, float) or isinstance(b, float):
+                if a is None or b is None or abs(a - b) > self.tolerance:
+                    return False
+            elif a != b:
+                return False
+        return True
+
+    def _close(self, run):
+        self.stats["documents"] += 1
+        doc = run["doc"]
+        if run["run_length"] > 1:
+            doc.update(run_length=run["run_length"], end_frame=run["end_frame"], end_timestamp=run["end_timestamp"])
+        return doc
+
+
+def expand_frame_runs(docs):
+    """Frame documents with every run replaced by the documents of its frames (see FrameRunEncoder)."""
+    expanded = []
+    for doc in docs:
+        length = doc.get("run_length", 1)
+        if length <= 1:
+            expanded.append(doc)
+            continue
+        doc = dict(doc)
+        end_frame, end_timestamp = doc.pop("end_frame"), doc.pop("end_timestamp")
+        del doc["run_length"]
+        step = (end_frame - doc["frame"]) // (length - 1)
+        interval = (end_timestamp - doc["timestamp"]) / (length - 1)
+        for i in range(length):
+            expanded.append({**doc, "frame": doc["frame"] + i * step, "timestamp": doc["timestamp"] + i * interval})
+    return expanded
+
 class MongoDB:
     def __init__(self):
         # Use certifi CA bundle to ensure TLS handshake succeeds against Atlas
@@ -90,12 +339,19 @@ class MongoDB:
         
         self.db = self.client[DB_NAME]
         self.sessions = self.db["session"]
-        self.yolov = self.db["yolov"]
+        self.yolov = frame_collection(self.db)
         self.abnormal_stats = self.db["abnormal_statistics"]
         self.aggregate_frame_data = self.db["aggregate_frame_data"]
         self.last_aggregate_frame = self.db["last_aggregate_frame"]
-        self.aggregate_frame_data = self.db["aggregate_frame_data"]
-        self.last_aggregate_frame = self.db["last_aggregate_frame"]
+        self.tracks = self.db["tracks"]
+        timeseries = FRAME_STORAGE == "timeseries"
+        ensure_indexes(self.db, self.yolov.name, timeseries=timeseries)
+        # Each process (the API and every scheduler worker) spools into a directory of its own
+        self.spool = WriteSpool(timeseries=[self.yolov.name] if timeseries else ()) if SPOOL_ENABLED else None
+        self.frame_buffer = FrameWriteBuffer(self.yolov, spool=self.spool)
+        self.frame_runs = FrameRunEncoder()
+        if self.spool:
+            self.spool.start_replayer(self.db)
 
     def ping(self):
         try:
@@ -117,8 +373,7 @@ class MongoDB:
                 "peak_count": 0,
                 "total_abnormal_frames": 0,
                 "total_violations": 0
-            },
-            "movement_data": []
+            }
         }
         self.sessions.insert_one(session_doc)
 
@@ -128,17 +383,70 @@ class MongoDB:
             {"$set": {"video_meta": meta}}
         )
 
-    def complete_session(self, session_id, summary, movement_data):
+    def complete_session(self, session_id, summary):
+        # Every frame of the session must be stored before it is marked completed
+        self.flush_frames()
         self.sessions.update_one(
             {"session_id": session_id},
             {"$set": {
                 "status": "completed",
                 "end_time": datetime.now(),
-                "summary": summary,
-                "movement_data": movement_data
+                "summary": summary
             }}
         )
 
+    def replace_tracks(self, session_id, records):
+        """Store the track records of a processed session, replacing those of an earlier attempt."""
+        self.tracks.delete_many({"session_id": session_id})
+        self.insert_tracks(session_id, records)
+
+    def set_session_content(self, session_id, content_hash, config_fingerprint):
+        """Record what was processed, so identical uploads can reuse this session's results."""
+        self.sessions.update_one(
+            {"session_id": session_id},
+            {"$set": {"content_hash": content_hash, "config_fingerprint": config_fingerprint}}
+        )
+
+    def find_reusable_session(self, content_hash, config_fingerprint):
+        """Latest completed session that processed the same bytes with the same configuration."""
+        return self.sessions.find_one(
+            {
+                "content_hash": content_hash,
+                "config_fingerprint": config_fingerprint,
+                "status": "completed",
+                "source_session_id": {"$exists": False}
+            },
+            {"_id": 0, "movement_data": 0},
+            sort=[("end_time", -1)]
+        )
+
+    def create_reference_session(self, session_id, filename, source):
+        """
+        Create a completed session whose results are read from `source`.
+
+        Only the session document is copied; frame data, tracks, abnormal stats
+        and aggregated windows are read through `source_session_id`.
+        """
+        now = datetime.now()
+        # Replaces the placeholder document of a resumable upload, if there is one
+        self.sessions.replace_one({"session_id": session_id}, {
+            "session_id": session_id,
+            "filename": filename,
+            "status": "completed",
+            "start_time": now,
+            "end_time": now,
+            "video_meta": source.get("video_meta", {}),
+            "summary": source.get("summary", {}),
+            "content_hash": source["content_hash"],
+            "config_fingerprint": source["config_fingerprint"],
+            "source_session_id": source["session_id"]
+        }, upsert=True)
+
+    def data_session_id(self, session_id):
+        """Session whose documents hold the results of `session_id` (itself unless it is a reference)."""
+        session = self.sessions.find_one({"session_id": session_id}, {"_id": 0, "source_session_id": 1})
+        return (session or {}).get("source_session_id") or session_id
+
     def fail_session(self, session_id, error):
         self.sessions.update_one(
             {"session_id": session_id},
@@ -146,42 +454,372 @@ class MongoDB:
         )
 
     # Frame data methods
-    def insert_frame_data(self, session_id, frame_data):
+    def insert_frame_data(self, session_id, frame_data, timestamp=None):
+        """
+        Queue a frame document; it is written in a batch within FRAME_FLUSH_INTERVAL seconds.
+
+        `timestamp` is the frame's time in the video (see get_session_start); camera frames are stamped now.
+        """
         frame_doc = {
             "session_id": session_id,
             **frame_data,
-            "timestamp": datetime.now()
+            "timestamp": timestamp or datetime.now()
+        }
+        for doc in self.frame_runs.add(frame_doc):
+            self.frame_buffer.add(doc)
+
+    def flush_frames(self):
+        """Block until every queued frame document (and open run of unchanged frames) is stored."""
+        for doc in self.frame_runs.close_all():
+            self.frame_buffer.add(doc)
+        self.frame_buffer.flush()
+
+    def commit_frames(self):
+        """Flush queued frame documents and replay the spool; True once every frame is stored in MongoDB."""
+        self.flush_frames()
+        return self.spool is None or self.spool.drain(self.db)
+
+    def release_frames(self):
+        """
+        Flush queued frame documents and hand the spooled writes to whichever process replays them next.
+
+        Called when a job fails: its rerun may run in another worker, which
+        replays them before deleting the frames it recomputes.
+        """
+        self.flush_frames()
+        if self.spool:
+            self.spool.release()
+
+    def delete_frames(self, session_id, after_frame, up_to_frame=None):
+        """
+        Delete the stored frames of a session after `after_frame` (through `up_to_frame`), before recomputing them.
+
+        Spooled writes (including those released by a failed run) are replayed
+        first, so none of the deleted frames reappear when the spool drains.
+
+        Raises:
+            RuntimeError: If spooled writes cannot be replayed yet
+        """
+        if self.spool and not self.spool.drain(self.db):
+            raise RuntimeError("Spooled writes could not be replayed to MongoDB; retry once it accepts writes")
+        frame_range = {"$gt": after_frame}
+        if up_to_frame is not None:
+            frame_range["$lte"] = up_to_frame
+        self.yolov.delete_many({"session_id": session_id, "frame": frame_range})
+
+    def set_frame_cloudinary_url(self, session_id, frame, url):
+        """Attach the uploaded image URL to a frame (uploads finish after the insert)."""
+        if self.frame_buffer.patch(session_id, frame, {"cloudinary_url": url}):
+            return
+        query = {"session_id": session_id, "frame": frame}
+        update = {"$set": {"cloudinary_url": url}}
+        if self.spool and self.spool.has_pending():
+            # The frame may still be in the spool; replay applies the patch after it
+            self.spool.append_update(self.yolov.name, query, update)
+            return
+        try:
+            self.yolov.update_one(query, update)
+        except Exception as e:
+            if not self.spool:
+                raise
+            print(f"Spooling cloudinary_url of frame {frame}: {e}")
+            self.spool.append_update(self.yolov.name, query, update)
+
+    def insert_aggregate(self, aggregated):
+        """Store an aggregated window, spooling it when MongoDB is unreachable."""
+        try:
+            self.aggregate_frame_data.insert_one(aggregated)
+        except Exception as e:
+            if not self.spool:
+                raise
+            print(f"Spooling aggregated window of session {aggregated.get('session_id')}: {e}")
+            self.spool.append_inserts(self.aggregate_frame_data.name, [aggregated])
+
+    def insert_tracks(self, session_id, records):
+        """Store a batch of track records of a continuous session (see track_sink.py), spooling on failure."""
+        if not records:
+            return
+        docs = [{**record, "session_id": session_id} for record in records]
+        try:
+            self.tracks.insert_many(docs, ordered=False)
+        except Exception as e:
+            if not self.spool:
+                raise
+            print(f"Spooling {len(docs)} track records of session {session_id}: {e}")
+            self.spool.append_inserts(self.tracks.name, docs)
+
+    def storage_stats(self):
+        """Write buffer, frame run and spool counters."""
+        return {
+            "frame_buffer": dict(self.frame_buffer.stats),
+            "frame_runs": dict(self.frame_runs.stats),
+            "spool": self.spool.stats() if self.spool else None
         }
-        self.yolov.insert_one(frame_doc)
 
     # Abnormal stats methods
-    def insert_abnormal_stats(self, session_id, original_stats, cleaned_stats):
+    def insert_abnormal_stats(self, session_id, original_stats, cleaned_stats, trajectory_tolerance=None):
+        """Store a session's abnormal stats; `trajectory_tolerance` is set when they come from simplified tracks."""
         doc = {
             "session_id": session_id,
             "original": original_stats,
             "cleaned": cleaned_stats,
             "created_at": datetime.now()
         }
+        if trajectory_tolerance is not None:
+            doc["trajectory_simplify_tolerance"] = trajectory_tolerance
         self.abnormal_stats.insert_one(doc)
 
     # Retrieval methods
-    def get_all_sessions(self):
-        return list(self.sessions.find({}, {"_id": 0}).sort("start_time", -1))
+    def list_sessions(self, limit=SESSION_PAGE_SIZE, cursor=None, status=None, since=None, until=None, fields=None):
+        """
+        A page of sessions, newest first.
+
+        Pages are read by keyset on (start_time, session_id), so a page costs the same however
+        deep into the listing it is and sessions created meanwhile do not shift the next page.
+
+        Args:
+            limit: Sessions per page (at most SESSION_PAGE_MAX)
+            cursor: Cursor returned with the previous page, None for the first page
+            status: Only sessions with this status
+            since, until: Only sessions started within this time range
+            fields: Fields to return (SESSION_LIST_FIELDS by default); session_id and
+                start_time are always returned
+
+        Returns:
+            (sessions, cursor of the next page or None on the last page)
+
+        Raises:
+            ValueError: The cursor is not one returned by list_sessions
+        """
+        conditions = []
+        if status is not None:
+            conditions.append({"status": status})
+        if since is not None or until is not None:
+            started = {}
+            if since is not None:
+                started["$gte"] = since
+            if until is not None:
+                started["$lte"] = until
+            conditions.append({"start_time": started})
+        if cursor is not None:
+            start_time, session_id = _decode_session_cursor(cursor)
+            conditions.append({"$or": [
+                {"start_time": {"$lt": start_time}},
+                {"start_time": start_time, "session_id": {"$lt": session_id}}
+            ]})
+        query = {"$and": conditions} if conditions else {}
+
+        projection = {"_id": 0, "session_id": 1, "start_time": 1}
+        projection.update({field: 1 for field in (fields or SESSION_LIST_FIELDS) if field != "movement_data"})
+        limit = max(1, min(limit, SESSION_PAGE_MAX))
+        sessions = list(self.sessions.find(query, projection)
+                        .sort([("start_time", -1), ("session_id", -1)])
+                        .limit(limit + 1))
+        if len(sessions) <= limit:
+            return sessions, None
+        sessions = sessions[:limit]
+        return sessions, _encode_session_cursor(sessions[-1])
+
+    def get_sessions_by_status(self, status):
+        return list(self.sessions.find({"status": status}, {"_id": 0, "movement_data": 0}))
+
+    def get_session_start(self, session_id):
+        """Start time of a session, which frames of a video file are stamped relative to."""
+        session = self.sessions.find_one({"session_id": session_id}, {"_id": 0, "start_time": 1})
+        return (session or {}).get("start_time")
 
     def get_session(self, session_id):
-        return self.sessions.find_one({"session_id": session_id}, {"_id": 0})
+        # Sessions stored before the tracks collection embed their movement data; it is never returned
+        return self.sessions.find_one({"session_id": session_id}, {"_id": 0, "movement_data": 0})
+
+    def get_tracks(self, session_id, start_frame=None, end_frame=None, region=None, limit=0):
+        """
+        Track records of a session ordered by start frame (trajectories encoded, see deep_sort.trajectory).
+
+        Args:
+            start_frame, end_frame: Only tracks seen within this frame range
+            region: (x_min, y_min, x_max, y_max); only tracks whose bounding box overlaps it
+            limit: Maximum number of records, 0 for all
+        """
+        query = {"session_id": self.data_session_id(session_id)}
+        if start_frame is not None:
+            query["end_frame"] = {"$gte": start_frame}
+        if end_frame is not None:
+            query["start_frame"] = {"$lte": end_frame}
+        if region is not None:
+            x_min, y_min, x_max, y_max = region
+            query.update({
+                "x_min": {"$lte": x_max}, "x_max": {"$gte": x_min},
+                "y_min": {"$lte": y_max}, "y_max": {"$gte": y_min}
+            })
+        cursor = self.tracks.find(query, {"_id": 0, "session_id": 0}).sort([("start_frame", 1), ("track_id", 1)])
+        return list(cursor.limit(limit))
 
-    def get_session_trends(self, session_id):
-        return list(self.yolov.find({"session_id": session_id}, {"_id": 0}).sort("frame", 1))
+    def get_session_trends(self, session_id, chart_keys=False):
+        """
+        Frame documents of a session in frame order.
+
+        Args:
+            chart_keys: Also return each frame's human_count, violate_count and abnormal_activity
+                as the count, violations and abnormal keys the UI charts read
+        """
+        pipeline = [
+            {"$match": {"session_id": self.data_session_id(session_id)}},
+            {"$sort": {"frame": 1}},
+            {"$project": {"_id": 0}}
+        ]
+        if chart_keys:
+            pipeline.append({"$addFields": {
+                "count": {"$ifNull": ["$human_count", 0]},
+                "violations": {"$ifNull": ["$violate_count", 0]},
+                "abnormal": {"$ifNull": ["$abnormal_activity", False]}
+            }})
+        return expand_frame_runs(self.yolov.aggregate(pipeline))
+
+    def get_trend_points(self, session_id, start_frame=None, end_frame=None):
+        """The chart fields (frame, count, violations, abnormal) of every frame of a session in a frame range."""
+        query = self._frame_range_query(session_id, None, end_frame)
+        if start_frame is not None:
+            # Runs of unchanged frames starting before the range may reach into it
+            query["$or"] = [{"frame": {"$gte": start_frame}}, {"end_frame": {"$gte": start_frame}}]
+        docs = list(self.yolov.aggregate([
+            {"$match": query},
+            {"$sort": {"frame": 1}},
+            {"$project": {
+                "_id": 0,
+                "frame": 1,
+                "count": {"$ifNull": ["$human_count", 0]},
+                "violations": {"$ifNull": ["$violate_count", 0]},
+                "abnormal": {"$ifNull": ["$abnormal_activity", False]},
+                "timestamp": 1,
+                "run_length": 1,
+                "end_frame": 1,
+                "end_timestamp": 1
+            }}
+        ]))
+        return [
+            {key: doc[key] for key in ("frame", "count", "violations", "abnormal")} for doc in expand_frame_runs(docs)
+            if (start_frame is None or doc["frame"] >= start_frame) and (end_frame is None or doc["frame"] <= end_frame)
+        ]
+
+    def get_trend_buckets(self, session_id, buckets, start_frame=None, end_frame=None):
+        """
+        The frames of a session in a frame range grouped into at most `buckets` equal frame ranges.
+
+        Every bucket has its first frame, the peak ("count"), lowest and average people count,
+        the peak violations, whether any frame was abnormal and the number of frames. A run of
+        unchanged frames counts in every bucket it covers, with the number of its frames in the
+        bucket and the range.
+        """
+        query = self._frame_range_query(session_id, None, end_frame)
+        if start_frame is not None:
+            # Runs of unchanged frames starting before the range may reach into it
+            query["$or"] = [{"frame": {"$gte": start_frame}}, {"end_frame": {"$gte": start_frame}}]
+        if start_frame is None or end_frame is None:
+            first = self.yolov.find_one(query, {"_id": 0, "frame": 1}, sort=[("frame", 1)])
+            last = self.yolov.find_one(query, {"_id": 0, "frame": 1, "end_frame": 1}, sort=[("frame", -1)])
+            if not first:
+                return []
+            start_frame = first["frame"] if start_frame is None else start_frame
+            end_frame = last.get("end_frame", last["frame"]) if end_frame is None else end_frame
+        width = max(-(-(end_frame - start_frame + 1) // max(buckets, 1)), 1)
+
+        def nth_frame(index):
+            return {"$add": ["$frame", {"$multiply": [index, "$step"]}]}
+
+        def frame_index(frame, rounding):
+            # Index within its run of the first (ceil) or last (floor) frame on either side of `frame`
+            return {rounding: {"$divide": [{"$subtract": [frame, "$frame"]}, "$step"]}}
+
+        def bucket_of(frame):
+            return {"$toInt": {"$floor": {"$divide": [{"$subtract": [frame, start_frame]}, width]}}}
+
+        bucket_start = {"$add": [start_frame, {"$multiply": ["$bucket", width]}]}
+        buckets = list(self.yolov.aggregate([
+            {"$match": query},
+            # Frames of a run are evenly spaced from frame to end_frame
+            {"$addFields": {
+                "length": RUN_WEIGHT,
+                "step": {"$cond": [
+                    {"$gt": [RUN_WEIGHT, 1]},
+                    {"$divide": [{"$subtract": ["$end_frame", "$frame"]}, {"$subtract": [RUN_WEIGHT, 1]}]},
+                    1
+                ]}
+            }},
+            # First and last frame of the document within the range
+            {"$addFields": {
+                "first_index": {"$max": [0, frame_index(start_frame, "$ceil")]},
+                "last_index": {"$min": [{"$subtract": ["$length", 1]}, frame_index(end_frame, "$floor")]}
+            }},
+            {"$addFields": {"first_frame": nth_frame("$first_index"), "last_frame": nth_frame("$last_index")}},
+            {"$addFields": {"bucket": {"$range": [bucket_of("$first_frame"), {"$add": [bucket_of("$last_frame"), 1]}]}}},
+            {"$unwind": "$bucket"},
+            # Frames of the document in each bucket it covers
+            {"$addFields": {
+                "bucket_first": frame_index({"$max": ["$first_frame", bucket_start]}, "$ceil"),
+                "bucket_last": frame_index({"$min": ["$last_frame", {"$add": [bucket_start, width - 1]}]}, "$floor")
+            }},
+            {"$addFields": {"weight": {"$add": [{"$subtract": ["$bucket_last", "$bucket_first"]}, 1]}}},
+            {"$match": {"weight": {"$gt": 0}}},
+            {"$group": {
+                "_id": "$bucket",
+                "frame": {"$min": {"$toLong": nth_frame("$bucket_first")}},
+                "count": {"$max": {"$ifNull": ["$human_count", 0]}},
+                "min_count": {"$min": {"$ifNull": ["$human_count", 0]}},
+                "count_total": {"$sum": {"$multiply": [{"$ifNull": ["$human_count", 0]}, "$weight"]}},
+                "violations": {"$max": {"$ifNull": ["$violate_count", 0]}},
+                "abnormal": {"$max": {"$cond": ["$abnormal_activity", True, False]}},
+                "frames": {"$sum": "$weight"}
+            }},
+            {"$sort": {"frame": 1}},
+            {"$project": {"_id": 0}}
+        ]))
+        for bucket in buckets:
+            bucket["frames"] = int(bucket["frames"])
+            bucket["avg_count"] = bucket.pop("count_total") / bucket["frames"]
+        return buckets
+
+    def _frame_range_query(self, session_id, start_frame=None, end_frame=None):
+        query = {"session_id": self.data_session_id(session_id)}
+        if start_frame is not None or end_frame is not None:
+            query["frame"] = {}
+            if start_frame is not None:
+                query["frame"]["$gte"] = start_frame
+            if end_frame is not None:
+                query["frame"]["$lte"] = end_frame
+        return query
+
+    def get_session_summary(self, session_id):
+        """
+        Peak and average people count, abnormal frames, violations and number of frames of a session,
+        computed by MongoDB (None when the session has no frames).
+        """
+        pipeline = [
+            {"$match": {"session_id": self.data_session_id(session_id)}},
+            {"$group": {
+                "_id": None,
+                "peak_count": {"$max": {"$ifNull": ["$human_count", 0]}},
+                "count_total": {"$sum": {"$multiply": [{"$ifNull": ["$human_count", 0]}, RUN_WEIGHT]}},
+                "total_abnormal_frames": {"$sum": {"$cond": ["$abnormal_activity", RUN_WEIGHT, 0]}},
+                "total_violations": {"$sum": {"$multiply": [{"$ifNull": ["$violate_count", 0]}, RUN_WEIGHT]}},
+                "frame_count": {"$sum": RUN_WEIGHT}
+            }},
+            {"$project": {"_id": 0}}
+        ]
+        summary = next(self.yolov.aggregate(pipeline), None)
+        if summary:
+            summary["avg_count"] = round(summary.pop("count_total") / summary["frame_count"], 1)
+        return summary
 
     def get_abnormal_stats(self, session_id):
+        session_id = self.data_session_id(session_id)
         return self.abnormal_stats.find_one({"session_id": session_id}, {"_id": 0})
 
     def get_abnormal_frames(self, session_id):
         """Get all frames with abnormal activity and cloudinary_url for a session."""
         return list(self.yolov.find(
             {
-                "session_id": session_id,
+                "session_id": self.data_session_id(session_id),
                 "abnormal_activity": True,
                 "cloudinary_url": {"$exists": True, "$ne": None}
             },
@@ -191,21 +829,68 @@ class MongoDB:
     def get_aggregated_windows(self, session_id):
         """Get all aggregated windows for a session."""
         return list(self.aggregate_frame_data.find(
-            {"session_id": session_id},
+            {"session_id": self.data_session_id(session_id)},
             {"_id": 0}
         ).sort("window_start", 1))
 
     def delete_session(self, session_id):
-        """Deletes all data associated with a session_id across all collections."""
+        """
+        Deletes all data associated with a session_id across all collections.
+
+        Returns:
+            (deleted, heir_id): heir_id is the session reusing this one's results that
+            inherited its documents, or None
+        """
+        heir_id = None
         try:
+            # Sessions reusing this one's results inherit its documents instead of losing them
+            heir = self.sessions.find_one({"source_session_id": session_id}, {"session_id": 1}, sort=[("start_time", 1)])
+            if heir:
+                heir_id = heir["session_id"]
+                for collection in (self.yolov, self.abnormal_stats, self.aggregate_frame_data, self.last_aggregate_frame,
+                                   self.tracks):
+                    collection.update_many({"session_id": session_id}, {"$set": {"session_id": heir_id}})
+                self.sessions.update_one({"session_id": heir_id}, {"$unset": {"source_session_id": ""}})
+                self.sessions.update_many({"source_session_id": session_id}, {"$set": {"source_session_id": heir_id}})
             self.sessions.delete_one({"session_id": session_id})
             self.yolov.delete_many({"session_id": session_id})
             self.abnormal_stats.delete_many({"session_id": session_id})
             self.aggregate_frame_data.delete_many({"session_id": session_id})
             self.last_aggregate_frame.delete_one({"session_id": session_id})
-            return True
+            self.tracks.delete_many({"session_id": session_id})
+            return True, heir_id
         except Exception as e:
             print(f"Error deleting session {session_id}: {e}")
-            return False
+            return False, heir_id
+
+
+def frame_collection(database, layout=FRAME_STORAGE):
+    """The collection frame documents are stored in, creating the time-series collection on first use."""
+    if layout != "timeseries":
+        return database[FRAME_DOCUMENT_COLLECTION]
+    if FRAME_TIMESERIES_COLLECTION not in database.list_collection_names():
+        try:
+            database.create_collection(FRAME_TIMESERIES_COLLECTION, timeseries={
+                "timeField": "timestamp",
+                "metaField": "session_id",
+                "granularity": "seconds"
+            })
+        except CollectionInvalid:
+            pass  # Created meanwhile by another process
+    return database[FRAME_TIMESERIES_COLLECTION]
+
+
+def _encode_session_cursor(session):
+    """Opaque cursor pointing after `session` in the session listing."""
+    key = {"start_time": session["start_time"].isoformat(), "session_id": session["session_id"]}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_session_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(key["start_time"]), key["session_id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
 db = MongoDB()
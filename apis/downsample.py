@@ -0,0 +1,72 @@
+"""
+Downsampling of session trends for charts.
+
+A chart is a few hundred to a few thousand pixels wide, so a multi-hour
+session (hundreds of thousands of frame documents) is reduced to about as
+many points as the chart can show:
+
+- "minmax": frames are grouped into equal frame ranges by MongoDB and each
+  range returns its peak and lowest people count, its peak violations and
+  whether any frame in it was abnormal (see db.get_trend_buckets). Only the
+  buckets leave the database, so the response size does not depend on the
+  session length; spikes are never lost.
+- "lttb": Largest-Triangle-Three-Buckets picks the actual frames that keep
+  the visual shape of the people count curve. It reads the chart fields of
+  every frame in the range, so it suits zoomed-in ranges.
+"""
+from typing import Dict, List
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("minmax", "lttb")
+# Points returned by GET /sessions/{id} when none are requested
+DEFAULT_TREND_POINTS = 1000
+MAX_TREND_POINTS = 20000
+
+
+def lttb(x, y, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points are always kept; the others are split into
+    `threshold - 2` buckets and from each the point forming the largest
+    triangle with the previously kept point and the average of the next
+    bucket is kept.
+
+    Args:
+        x: Ascending x values (frames)
+        y: Values
+        threshold: Number of points to keep
+
+    Returns:
+        Ascending indices into x and y
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    bounds = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    bounds[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        next_end = bounds[i + 2] if i + 2 < len(bounds) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def lttb_trends(trends: List[Dict], points: int) -> List[Dict]:
+    """The frames of `trends` (chart documents in frame order) LTTB keeps for the people count curve."""
+    if len(trends) <= points:
+        return trends
+    frames = [t.get("frame", i) for i, t in enumerate(trends)]
+    counts = [t.get("count", 0) for t in trends]
+    return [trends[i] for i in lttb(frames, counts, points)]
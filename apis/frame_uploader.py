@@ -0,0 +1,194 @@
+"""
+Background upload queue for abnormal frames.
+
+Frames are JPEG-encoded and uploaded by a small worker pool so the analysis
+loop never waits on the network. Memory is bounded by FRAME_UPLOAD_MAX_PENDING
+queued frames; failed uploads are retried with exponential backoff.
+"""
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+import cv2
+from dotenv import load_dotenv
+
+env_path = Path(__file__).parent.parent / '.env'
+load_dotenv(dotenv_path=env_path)
+
+FRAME_UPLOAD_BACKEND = os.getenv("FRAME_UPLOAD_BACKEND", "cloudinary")  # "cloudinary" or "local"
+FRAME_UPLOAD_DIR = os.getenv("FRAME_UPLOAD_DIR", str(Path(__file__).parent / "frames"))
+FRAME_UPLOAD_BASE_URL = os.getenv("FRAME_UPLOAD_BASE_URL")  # Public URL the local directory is served under
+FRAME_UPLOAD_WORKERS = int(os.getenv("FRAME_UPLOAD_WORKERS", "2"))
+FRAME_UPLOAD_MAX_PENDING = int(os.getenv("FRAME_UPLOAD_MAX_PENDING", "32"))
+FRAME_UPLOAD_MAX_RETRIES = int(os.getenv("FRAME_UPLOAD_MAX_RETRIES", "3"))
+FRAME_UPLOAD_BACKOFF = float(os.getenv("FRAME_UPLOAD_BACKOFF", "1.0"))  # Seconds before the first retry
+JPEG_QUALITY = 90
+
+
+class CloudinaryBackend:
+    """Uploads frames to Cloudinary."""
+    name = "cloudinary"
+
+    def __init__(self):
+        from cloudinary_utils import CLOUDINARY_CLOUD_NAME, upload_jpeg_to_cloudinary
+        self.enabled = bool(CLOUDINARY_CLOUD_NAME)
+        self._upload = upload_jpeg_to_cloudinary
+
+    def upload(self, jpeg_bytes: bytes, session_id: str, frame_number: int, folder: str) -> str:
+        return self._upload(jpeg_bytes, session_id, frame_number, folder=folder)
+
+
+class LocalBackend:
+    """Writes frames to a local directory; stand-in for Cloudinary in tests and offline runs."""
+    name = "local"
+
+    def __init__(self, root: str = FRAME_UPLOAD_DIR, base_url: Optional[str] = FRAME_UPLOAD_BASE_URL):
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.enabled = True
+
+    def upload(self, jpeg_bytes: bytes, session_id: str, frame_number: int, folder: str) -> str:
+        relative = Path(folder) / session_id / f"frame_{frame_number}.jpg"
+        path = self.root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(jpeg_bytes)
+        os.replace(tmp_path, path)
+        if self.base_url:
+            return f"{self.base_url}/{relative.as_posix()}"
+        return path.resolve().as_uri()
+
+
+class FrameUploadQueue:
+    """
+    Bounded background queue uploading frames through a backend.
+
+    Args:
+        backend: Object with `upload(jpeg_bytes, session_id, frame_number, folder) -> url`
+        workers: Number of upload threads
+        max_pending: Maximum frames held in memory; further frames are dropped
+        max_retries: Retries per frame after the first failed attempt
+        backoff: Delay before the first retry, doubled on every further retry
+    """
+
+    def __init__(self, backend, workers: int = FRAME_UPLOAD_WORKERS, max_pending: int = FRAME_UPLOAD_MAX_PENDING,
+                 max_retries: int = FRAME_UPLOAD_MAX_RETRIES, backoff: float = FRAME_UPLOAD_BACKOFF):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._stats = {"submitted": 0, "uploaded": 0, "retried": 0, "failed": 0, "dropped": 0}
+        self._workers = [
+            threading.Thread(target=self._run, name=f"frame-upload-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend.enabled
+
+    def submit(self, frame, session_id: str, frame_number: int,
+               on_complete: Optional[Callable[[str], None]] = None, folder: str = "abnormal_frames") -> bool:
+        """
+        Queue a frame for upload without blocking.
+
+        The frame is not copied; callers must not draw on it afterwards.
+        `on_complete(url)` runs on an upload thread once the upload succeeded.
+
+        Returns:
+            False if the queue is full and the frame was dropped
+        """
+        item = (frame, session_id, frame_number, on_complete, folder)
+        with self._cond:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._stats["dropped"] += 1
+                print(f"Upload queue full, dropped abnormal frame {frame_number} of session {session_id}")
+                return False
+            self._stats["submitted"] += 1
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        return True
+
+    def drain(self, session_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued upload (of one session, or all) has finished.
+
+        Returns:
+            False if the timeout expired first
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._pending.get(session_id, 0) if session_id else sum(self._pending.values()):
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {**self._stats, "pending": sum(self._pending.values()), "backend": self.backend.name}
+
+    def _run(self):
+        while True:
+            frame, session_id, frame_number, on_complete, folder = self._queue.get()
+            try:
+                url = self._upload(frame, session_id, frame_number, folder)
+                if url and on_complete:
+                    try:
+                        on_complete(url)
+                    except Exception as e:
+                        print(f"Error in upload callback for frame {frame_number}: {e}")
+            finally:
+                with self._cond:
+                    self._pending[session_id] -= 1
+                    if not self._pending[session_id]:
+                        del self._pending[session_id]
+                    self._cond.notify_all()
+
+    def _upload(self, frame, session_id: str, frame_number: int, folder: str) -> Optional[str]:
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            with self._cond:
+                self._stats["failed"] += 1
+            print(f"Error encoding abnormal frame {frame_number} of session {session_id}")
+            return None
+        jpeg_bytes = buffer.tobytes()
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                url = self.backend.upload(jpeg_bytes, session_id, frame_number, folder)
+                with self._cond:
+                    self._stats["uploaded"] += 1
+                return url
+            except Exception as e:
+                if attempt == self.max_retries:
+                    with self._cond:
+                        self._stats["failed"] += 1
+                    print(f"Giving up uploading frame {frame_number} of session {session_id}: {e}")
+                    return None
+                delay = self.backoff * (2 ** attempt)
+                with self._cond:
+                    self._stats["retried"] += 1
+                print(f"Upload of frame {frame_number} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+def create_backend(name: str = FRAME_UPLOAD_BACKEND):
+    if name == "local":
+        return LocalBackend()
+    if name == "cloudinary":
+        return CloudinaryBackend()
+    raise ValueError(f"Unknown FRAME_UPLOAD_BACKEND: {name}")
+
+
+frame_uploader = FrameUploadQueue(create_backend())
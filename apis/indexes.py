@@ -0,0 +1,131 @@
+"""
+Index definitions of the MongoDB collections, created at startup.
+
+Every hot query filters by session and sorts by frame, time or window, so
+each has a compound index starting with session_id. Abnormal frames with an
+uploaded image (the frames GET /sessions/{id} shows) have a partial index
+holding only those frames.
+
+HOT_QUERIES lists the queries the indexes are for; test_mongo_indexes.py
+explains them against a live database and reports any that scan a whole
+collection.
+"""
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+INDEXES = {
+    "session": [
+        IndexModel([("session_id", ASCENDING)]),
+        # Listing, newest first (db.list_sessions)
+        IndexModel([("start_time", DESCENDING), ("session_id", DESCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("source_session_id", ASCENDING)]),
+        IndexModel([("content_hash", ASCENDING), ("config_fingerprint", ASCENDING), ("end_time", DESCENDING)])
+    ],
+    # Frame documents, in whichever layout (see db.FRAME_STORAGE)
+    "yolov": [
+        # Trends, summaries, frame range deletes and image URL patches
+        IndexModel([("session_id", ASCENDING), ("frame", ASCENDING)]),
+        # Aggregator: unprocessed frames of a session by time, and runs of unchanged frames ending after a time
+        IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING)]),
+        IndexModel([("session_id", ASCENDING), ("end_timestamp", ASCENDING)]),
+        # Aggregator: sessions with recent frames (distinct session_id)
+        IndexModel([("timestamp", ASCENDING), ("session_id", ASCENDING)]),
+        IndexModel([("session_id", ASCENDING), ("frame", ASCENDING), ("cloudinary_url", ASCENDING)],
+                   partialFilterExpression={"abnormal_activity": True, "cloudinary_url": {"$exists": True}})
+    ],
+    "aggregate_frame_data": [
+        IndexModel([("session_id", ASCENDING), ("window_end", DESCENDING)]),
+        IndexModel([("session_id", ASCENDING), ("window_start", ASCENDING)])
+    ],
+    "last_aggregate_frame": [
+        IndexModel([("session_id", ASCENDING)])
+    ],
+    "abnormal_statistics": [
+        IndexModel([("session_id", ASCENDING)])
+    ],
+    "tracks": [
+        # Tracks by session and frame range (GET /sessions/{id}/tracks)
+        IndexModel([("session_id", ASCENDING), ("start_frame", ASCENDING), ("end_frame", ASCENDING)])
+    ]
+}
+
+# (description, collection, filter, sort) of the queries the indexes serve; "<session>" stands for a session id
+HOT_QUERIES = [
+    ("session by id", "session", {"session_id": "<session>"}, None),
+    ("session listing", "session", {}, [("start_time", -1), ("session_id", -1)]),
+    ("sessions by status", "session", {"status": "processing"}, None),
+    ("reusable session", "session",
+     {"content_hash": "", "config_fingerprint": "", "status": "completed", "source_session_id": {"$exists": False}},
+     [("end_time", -1)]),
+    ("session trends", "yolov", {"session_id": "<session>"}, [("frame", 1)]),
+    ("trend range", "yolov", {"session_id": "<session>", "frame": {"$gte": 0, "$lte": 1000}}, [("frame", 1)]),
+    ("abnormal frames with images", "yolov",
+     {"session_id": "<session>", "abnormal_activity": True, "cloudinary_url": {"$exists": True, "$ne": None}},
+     [("frame", 1)]),
+    ("unaggregated frames", "yolov",
+     {"session_id": "<session>", "$or": [{"timestamp": {"$gt": 0}}, {"end_timestamp": {"$gt": 0}}]},
+     [("timestamp", 1)]),
+    ("recent frames", "yolov", {"timestamp": {"$gte": 0}}, None),
+    ("last aggregated window", "aggregate_frame_data", {"session_id": "<session>"}, [("window_end", -1)]),
+    ("aggregated windows", "aggregate_frame_data", {"session_id": "<session>"}, [("window_start", 1)]),
+    ("aggregator state", "last_aggregate_frame", {"session_id": "<session>"}, None),
+    ("abnormal stats", "abnormal_statistics", {"session_id": "<session>"}, None),
+    ("tracks in range", "tracks", {"session_id": "<session>", "end_frame": {"$gte": 0}, "start_frame": {"$lte": 1000}},
+     [("start_frame", 1), ("track_id", 1)])
+]
+
+
+def ensure_indexes(database, frame_collection="yolov", timeseries=False) -> Dict[str, List[str]]:
+    """
+    Create the indexes of INDEXES that do not exist yet (creating an existing index is a no-op).
+    Indexes keep MongoDB's default names (keys and directions), so indexes created by hand
+    or by earlier versions on the same keys are recognized.
+
+    A collection whose indexes cannot be created (e.g. an index on the same keys with other
+    options) is reported and skipped, so the API still starts.
+
+    Args:
+        frame_collection: Name of the collection holding the frame documents
+        timeseries: The frame collection is a time-series collection; its partial index
+            is left out (time-series partial indexes may only filter on the meta and time fields)
+
+    Returns:
+        Index names per collection
+    """
+    created = {}
+    for collection, indexes in INDEXES.items():
+        if collection == "yolov":
+            collection = frame_collection
+            if timeseries:
+                indexes = [index for index in indexes if "partialFilterExpression" not in index.document]
+        try:
+            created[collection] = database[collection].create_indexes(indexes)
+        except PyMongoError as e:
+            print(f"Could not create the indexes of {collection}: {e}")
+    return created
+
+
+def plan_stages(plan) -> List[str]:
+    """Stage names of an explained query plan, outermost first."""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("queryPlan", "inputStage"):  # queryPlan: slot-based execution engine
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def explain_query(database, collection, query, sort=None, session_id="<session>", frame_collection="yolov"):
+    """Stage names of the winning plan of a HOT_QUERIES query run for `session_id`."""
+    query = {key: session_id if value == "<session>" else value for key, value in query.items()}
+    cursor = database[frame_collection if collection == "yolov" else collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    explained = cursor.explain()
+    if "queryPlanner" not in explained:
+        # Time-series collections explain the aggregation that unpacks their buckets
+        explained = explained["stages"][0]["$cursor"]
+    return plan_stages(explained["queryPlanner"]["winningPlan"])
@@ -1,15 +1,17 @@
 import os
-import shutil
 import uuid
 import json
 import asyncio
+import hashlib
 import datetime
+import shutil
 from concurrent.futures import ThreadPoolExecutor
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, BackgroundTasks, WebSocket, WebSocketDisconnect, Request, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from contextlib import asynccontextmanager
 
 def json_serial(obj):
@@ -26,9 +28,21 @@ PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 CROWD_ANALYSIS_PATH = os.path.join(PROJECT_ROOT, "crowd_analysis")
 sys.path.append(CROWD_ANALYSIS_PATH)
 
-from main_api import run_processing, get_analysis_results
-from db import db
+from main_api import get_analysis_results, run_replay
+from video_process import DEFAULT_THRESHOLDS
+from detection_cache import cache_path
+from video_probe import probe_video
+from fingerprint import processing_fingerprint
+from db import db, SESSION_PAGE_SIZE
 from aggregator import run_window_aggregator, set_remark_broadcast_callback
+from preview_hub import preview_hub, mjpeg_part, MJPEG_BOUNDARY
+from frame_uploader import frame_uploader, FRAME_UPLOAD_DIR
+from scheduler import JobScheduler, JobError, INTERRUPTED
+from checkpoint import remove_checkpoint
+from streaming_capture import is_uploading
+from deep_sort.trajectory import stored_rows
+from downsample import DOWNSAMPLE_METHODS, DEFAULT_TREND_POINTS, MAX_TREND_POINTS, lttb_trends
+from upload_stream import UploadStore, container_is_streamable, UPLOAD_CHUNK_SIZE, STREAM_START_BYTES
 from contextlib import asynccontextmanager
 
 # Background task control
@@ -43,9 +57,15 @@ async def lifespan(app: FastAPI):
     # Start background aggregation task
     aggregation_running = True
     aggregation_task = asyncio.create_task(background_aggregation_loop())
+
+    # Start the video processing worker pool
+    scheduler.start()
+    await resume_interrupted_sessions()
     
     yield
     
+    scheduler.shutdown()
+
     # Stop background aggregation task
     aggregation_running = False
     if aggregation_task:
@@ -64,10 +84,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 UPLOAD_DIR = os.path.join(SCRIPT_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+upload_store = UploadStore(UPLOAD_DIR)
+
+# Serve abnormal frames stored by the local upload backend (set FRAME_UPLOAD_BASE_URL to <api>/frames)
+if frame_uploader.backend.name == "local":
+    os.makedirs(FRAME_UPLOAD_DIR, exist_ok=True)
+    app.mount("/frames", StaticFiles(directory=FRAME_UPLOAD_DIR), name="frames")
 
 # Shared state for real-time updates
 active_processing: Dict[str, Dict] = {}
@@ -94,13 +121,28 @@ class ConnectionManager:
                 pass
 
 manager = ConnectionManager()
-executor = ThreadPoolExecutor(max_workers=4)
+# Video processing runs in the scheduler's worker processes; this executor only runs aggregation
+executor = ThreadPoolExecutor(max_workers=1)
 loop = asyncio.get_event_loop()
+preview_hub.bind_loop(loop)
 
 def sync_broadcast(message: str):
     """Thread-safe wrapper to broadcast from a synchronous context."""
     asyncio.run_coroutine_threadsafe(manager.broadcast(message), loop)
 
+def on_job_progress(file_id: str, data: Dict):
+    # Upload events (frame_uploaded) refer to an earlier frame; they are broadcast but not the job's progress
+    if file_id in active_processing and "event" not in data:
+        active_processing[file_id]["status"] = "processing"
+        active_processing[file_id].update(data)
+    sync_broadcast(json.dumps({"file_id": file_id, "type": "realtime", "data": data}, default=json_serial))
+
+scheduler = JobScheduler(
+    on_progress=on_job_progress,
+    on_preview=preview_hub.publish,
+    has_preview_subscribers=preview_hub.has_subscribers
+)
+
 # Set the broadcast callback for aggregator
 set_remark_broadcast_callback(sync_broadcast)
 
@@ -124,68 +166,280 @@ async def background_aggregation_loop():
             await asyncio.sleep(5)  # Wait before retrying
 
 @app.post("/upload")
-async def upload_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_video(background_tasks: BackgroundTasks, file: UploadFile = File(...), priority: int = 0):
     file_id = str(uuid.uuid4())
     file_path = os.path.abspath(os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}"))
     
     os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # Copy in chunks with the disk writes off the event loop, hashing the content on the way
+    digest = hashlib.sha256()
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            await loop.run_in_executor(None, buffer.write, chunk)
+    content_hash = digest.hexdigest()
+    
+    # The same video was already processed with the same configuration: reuse its results
+    reused = await reuse_existing_results(file_id, file.filename, content_hash, file_path)
+    if reused:
+        return {"file_id": file_id, "filename": file.filename, **reused}
+    
+    # Pre-flight probe (container metadata only) so the scheduler can run short clips first
+    probe = await loop.run_in_executor(None, probe_video, file_path)
     
-    active_processing[file_id] = {"status": "queued", "progress": 0, "count": 0}
+    active_processing[file_id] = {"status": "queued", "progress": 0, "count": 0, "video": probe}
     
     # Initialize session in MongoDB
     db.create_session(file_id, file.filename)
+    db.set_session_content(file_id, content_hash, processing_fingerprint())
     
     # Start background processing
-    background_tasks.add_task(process_video_task, file_id, file_path)
+    background_tasks.add_task(process_video_task, file_id, file_path, priority, probe)
     
-    return {"file_id": file_id, "filename": file.filename}
+    return {"file_id": file_id, "filename": file.filename, "video": probe}
 
-async def process_video_task(file_id: str, file_path: str):
-    active_processing[file_id]["status"] = "processing"
-    
-    def on_progress(data):
-        active_processing[file_id].update(data)
-        sync_broadcast(json.dumps({"file_id": file_id, "type": "realtime", "data": data}, default=json_serial))
+async def reuse_existing_results(file_id: str, filename: str, content_hash: str, file_path: str) -> Optional[Dict]:
+    """
+    Complete an upload from an earlier session with identical content and processing configuration.
+
+    Returns:
+        Response fields for the upload, or None when there is nothing to reuse
+    """
+    source = db.find_reusable_session(content_hash, processing_fingerprint())
+    if not source:
+        return None
+
+    db.create_reference_session(file_id, filename, source)
+    # Clients load the (downsampled) trends from /sessions/{id}
+    analysis = get_analysis_results(file_id, include_trends=False)
+    active_processing[file_id] = {"status": "completed", "progress": 100, "count": 0, "analysis": analysis,
+                                  "reused_from": source["session_id"]}
+    sync_broadcast(json.dumps({
+        "file_id": file_id,
+        "status": "completed",
+        "analysis": analysis
+    }, default=json_serial))
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    return {"status": "completed", "analysis": analysis, "reused_from": source["session_id"]}
+
+class CreateUploadRequest(BaseModel):
+    filename: str
+    size: Optional[int] = None
+    priority: int = 0
 
+@app.post("/uploads")
+async def create_upload(request: CreateUploadRequest):
+    """Start a resumable upload; append the file with PATCH /uploads/{file_id}."""
+    upload = upload_store.create(request.filename, request.size, request.priority)
+    active_processing[upload.file_id] = {"status": "uploading", "progress": 0, "count": 0}
+    db.create_session(upload.file_id, upload.filename)
+    return upload.to_dict()
+
+@app.get("/uploads/{file_id}")
+async def get_upload(file_id: str):
+    """Current offset of a resumable upload (where to continue after a dropped connection)."""
+    upload = upload_store.get(file_id)
+    if not upload:
+        return {"error": "Upload not found"}
+    return upload.to_dict()
+
+@app.patch("/uploads/{file_id}")
+async def append_upload(file_id: str, request: Request, background_tasks: BackgroundTasks,
+                        upload_offset: int = Header(...)):
+    """Append the request body at the `Upload-Offset` header; processing starts once enough has arrived."""
+    upload = upload_store.get(file_id)
+    if not upload or upload.complete:
+        return {"error": "Upload not found or already complete"}
     try:
-        # Run in executor to avoid blocking
-        await loop.run_in_executor(executor, run_processing, file_path, file_id, on_progress)
-        
-        # Get final analysis results from MongoDB
-        analysis = get_analysis_results(file_id)
-        
-        active_processing[file_id]["status"] = "completed"
-        active_processing[file_id]["analysis"] = analysis
-        
-        # Update session in MongoDB with final analysis
-        db.complete_session(file_id, analysis["summary"], analysis.get("movement_data", []))
-        
-        # Run aggregation for completed session
-        try:
-            from aggregator import run_window_aggregator_for_session
-            run_window_aggregator_for_session(file_id)
-        except Exception as e:
-            print(f"Error running aggregation for session {file_id}: {e}")
+        await upload_store.append(upload, upload_offset, request.stream())
+    except ValueError as e:
+        return {"error": str(e), "offset": upload.offset}
+    if upload.size is not None and upload.offset >= upload.size:
+        return await finish_upload(upload, background_tasks)
+    await start_upload_processing(upload, background_tasks)
+    return upload.to_dict()
+
+@app.post("/uploads/{file_id}/complete")
+async def complete_upload(file_id: str, background_tasks: BackgroundTasks):
+    """Mark a resumable upload as fully transferred."""
+    upload = upload_store.get(file_id)
+    if not upload:
+        return {"error": "Upload not found"}
+    if upload.complete:
+        return upload.to_dict()
+    return await finish_upload(upload, background_tasks)
+
+async def finish_upload(upload, background_tasks: BackgroundTasks):
+    """Complete a resumable upload: reuse earlier results for identical content, otherwise make sure it is processed."""
+    await loop.run_in_executor(None, upload_store.complete, upload)
+    if upload.processing_started:
+        # Already streaming into the pipeline; record the content so later uploads can reuse the results
+        db.set_session_content(upload.file_id, upload.content_hash, processing_fingerprint())
+        return upload.to_dict()
+
+    reused = await reuse_existing_results(upload.file_id, upload.filename, upload.content_hash, upload.path)
+    if reused:
+        upload_store.discard(upload.file_id)
+        return {**upload.to_dict(), **reused}
+
+    db.set_session_content(upload.file_id, upload.content_hash, processing_fingerprint())
+    await start_upload_processing(upload, background_tasks)
+    return upload.to_dict()
+
+async def start_upload_processing(upload, background_tasks: BackgroundTasks):
+    """Queue processing of a resumable upload once it is complete, or streamable with enough data on disk."""
+    if upload.processing_started:
+        return
+    if not upload.complete:
+        if upload.offset < STREAM_START_BYTES:
+            return
+        if await loop.run_in_executor(None, container_is_streamable, upload.path) is not True:
+            return
+    probe = await loop.run_in_executor(None, probe_video, upload.path)
+    if probe is None and not upload.complete:
+        return  # Not decodable yet, try again after the next chunk
+    upload.processing_started = True
+    active_processing.setdefault(upload.file_id, {"progress": 0, "count": 0})
+    active_processing[upload.file_id].update({"status": "queued", "video": probe})
+    # A partial upload is read front to back as it grows, so it is not split into segments
+    background_tasks.add_task(process_video_task, upload.file_id, upload.path, upload.priority, probe,
+                              upload.complete)
+
+async def process_video_task(file_id: str, file_path: str, priority: int = 0, probe: Dict = None,
+                             segmentable: bool = True, continuous: bool = False):
+    future = scheduler.submit(file_id, file_path, priority, probe, segmentable, continuous)
+    active_processing[file_id]["status"] = "processing" if scheduler.status(file_id)["state"] == "running" else "queued"
+
+    try:
+        # Wait for a worker process to finish the job
+        await asyncio.wrap_future(future)
         
-        sync_broadcast(json.dumps({
-            "file_id": file_id, 
-            "status": "completed", 
-            "analysis": analysis
-        }, default=json_serial))
+        complete_processing(file_id)
         
         # Cleanup uploaded video file
         if os.path.exists(file_path):
             os.remove(file_path)
             
+    except JobError as e:
+        if e.state == INTERRUPTED:
+            # API shutting down: keep the video and the checkpoint, the job is resumed on the next start
+            active_processing[file_id]["status"] = e.state
+            return
+        remove_checkpoint(file_id)
+        active_processing[file_id]["status"] = e.state
+        active_processing[file_id]["error"] = str(e)
+        db.fail_session(file_id, f"{e.state}: {e}")
+        sync_broadcast(json.dumps({"file_id": file_id, "status": e.state, "error": str(e)}))
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        active_processing[file_id]["status"] = "failed"
+        active_processing[file_id]["error"] = str(e)
+        sync_broadcast(json.dumps({"file_id": file_id, "status": "failed", "error": str(e)}))
+    finally:
+        preview_hub.close(file_id)
+        if active_processing[file_id]["status"] != INTERRUPTED:
+            upload_store.discard(file_id)
+
+async def resume_interrupted_sessions():
+    """Queue the sessions a previous run of the API left processing; they continue from their checkpoints."""
+    for session in db.get_sessions_by_status("processing"):
+        file_id = session["session_id"]
+        file_path = os.path.abspath(os.path.join(UPLOAD_DIR, f"{file_id}_{session['filename']}"))
+        # Uploads still in progress start processing again as their chunks arrive
+        if file_id in active_processing or not os.path.exists(file_path) or is_uploading(file_path):
+            continue
+        probe = await loop.run_in_executor(None, probe_video, file_path)
+        active_processing[file_id] = {"status": "queued", "progress": 0, "count": 0, "video": probe}
+        print(f"Resuming interrupted session {file_id}")
+        asyncio.create_task(process_video_task(file_id, file_path, 0, probe))
+
+def complete_processing(file_id: str):
+    """Store the final analysis of a processed session, aggregate it and notify clients."""
+    # Get final analysis results from MongoDB; clients load the (downsampled) trends from /sessions/{id}
+    analysis = get_analysis_results(file_id, include_trends=False)
+    
+    active_processing[file_id]["status"] = "completed"
+    active_processing[file_id]["analysis"] = analysis
+    
+    # Update session in MongoDB with final analysis
+    db.complete_session(file_id, analysis["summary"])
+    
+    # Run aggregation for completed session; its frames were flushed, so the last windows close now
+    try:
+        from aggregator import run_window_aggregator_for_session
+        run_window_aggregator_for_session(file_id, flushed=True)
+    except Exception as e:
+        print(f"Error running aggregation for session {file_id}: {e}")
+    
+    sync_broadcast(json.dumps({
+        "file_id": file_id, 
+        "status": "completed", 
+        "analysis": analysis
+    }, default=json_serial))
+
+class ReplayRequest(BaseModel):
+    # Overrides of the analytics thresholds (see video_process.DEFAULT_THRESHOLDS) and MAX_COSINE_DISTANCE
+    thresholds: Dict[str, float] = {}
+
+@app.post("/sessions/{session_id}/replay")
+async def replay_session(session_id: str, request: ReplayRequest, background_tasks: BackgroundTasks):
+    """Re-analyze a session from its detection cache with other thresholds, into a new session."""
+    unknown = set(request.thresholds) - set(DEFAULT_THRESHOLDS) - {"MAX_COSINE_DISTANCE"}
+    if unknown:
+        return {"error": f"Unknown thresholds: {', '.join(sorted(unknown))}"}
+    session = db.get_session(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    source_id = db.data_session_id(session_id)
+    path = cache_path(source_id)
+    if path is None or not os.path.isdir(path):
+        return {"error": "No detection cache for this session"}
+
+    file_id = str(uuid.uuid4())
+    filename = f"{session.get('filename', session_id)} (replay)"
+    active_processing[file_id] = {"status": "processing", "progress": 0, "count": 0}
+    db.create_session(file_id, filename)
+    background_tasks.add_task(replay_session_task, file_id, source_id, request.thresholds)
+    return {"file_id": file_id, "filename": filename, "source_session_id": source_id, "thresholds": request.thresholds}
+
+async def replay_session_task(file_id: str, source_id: str, thresholds: Dict[str, float]):
+    try:
+        await loop.run_in_executor(None, run_replay, source_id, file_id, thresholds,
+                                   lambda data: on_job_progress(file_id, data))
+        complete_processing(file_id)
     except Exception as e:
         import traceback
         traceback.print_exc()
         active_processing[file_id]["status"] = "failed"
         active_processing[file_id]["error"] = str(e)
+        db.fail_session(file_id, str(e))
         sync_broadcast(json.dumps({"file_id": file_id, "status": "failed", "error": str(e)}))
 
+class StreamRequest(BaseModel):
+    # Camera or stream URL readable by OpenCV (rtsp://, http://, ...)
+    source: str
+    name: Optional[str] = None
+    priority: int = 0
+
+@app.post("/streams")
+async def start_stream(request: StreamRequest, background_tasks: BackgroundTasks):
+    """
+    Process a live stream in continuous mode (24/7 cameras) until POST /jobs/{file_id}/cancel.
+
+    Tracks are stored in batches as they expire and in-memory trails are capped,
+    so memory stays bounded; the memory counters are reported with the progress.
+    """
+    file_id = str(uuid.uuid4())
+    name = request.name or request.source
+    active_processing[file_id] = {"status": "queued", "progress": 0, "count": 0, "continuous": True}
+    db.create_session(file_id, name)
+    background_tasks.add_task(process_video_task, file_id, request.source, request.priority, None, False, True)
+    return {"file_id": file_id, "filename": name, "source": request.source}
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
@@ -195,19 +449,110 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.websocket("/ws/preview/{file_id}")
+async def preview_websocket(websocket: WebSocket, file_id: str):
+    """Live preview as binary JPEG messages, throttled to the preview FPS."""
+    await websocket.accept()
+    queue = preview_hub.subscribe(file_id)
+    try:
+        while True:
+            jpeg = await queue.get()
+            if jpeg is None:
+                break
+            await websocket.send_bytes(jpeg)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        preview_hub.unsubscribe(file_id, queue)
+    try:
+        await websocket.close()
+    except Exception:
+        pass
+
+@app.get("/preview/{file_id}")
+async def preview_mjpeg(file_id: str):
+    """Live preview as an MJPEG stream (usable directly as an <img> source)."""
+    queue = preview_hub.subscribe(file_id)
+
+    async def stream():
+        try:
+            while True:
+                jpeg = await queue.get()
+                if jpeg is None:
+                    break
+                yield mjpeg_part(jpeg)
+        finally:
+            preview_hub.unsubscribe(file_id, queue)
+
+    return StreamingResponse(stream(), media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}")
+
 @app.get("/status/{file_id}")
 async def get_status(file_id: str):
-    return active_processing.get(file_id, {"status": "not_found"})
+    status = active_processing.get(file_id, {"status": "not_found"})
+    job = scheduler.status(file_id)
+    if job:
+        status = {**status, "job": job, "eta_seconds": job.get("eta_seconds")}
+    return status
+
+@app.post("/jobs/{file_id}/cancel")
+async def cancel_job(file_id: str):
+    """Cancel a queued or running processing job."""
+    if scheduler.cancel(file_id):
+        return {"message": f"Cancellation requested for {file_id}"}
+    return {"error": "Job not found or already finished"}
+
+@app.get("/jobs/stats")
+async def get_job_stats():
+    """Worker pool occupancy and job counts by state."""
+    return scheduler.stats()
+
+@app.get("/uploads/stats")
+async def get_upload_stats():
+    """Counters of the background abnormal frame uploader."""
+    return frame_uploader.stats()
+
+@app.get("/storage/stats")
+async def get_storage_stats():
+    """Counters of the frame write buffer and the local write spool."""
+    return db.storage_stats()
 
 @app.get("/sessions")
-async def get_sessions():
-    return db.get_all_sessions()
+async def get_sessions(response: Response, limit: int = SESSION_PAGE_SIZE, cursor: Optional[str] = None,
+                       status: Optional[str] = None, since: Optional[datetime.datetime] = None,
+                       until: Optional[datetime.datetime] = None, fields: Optional[str] = None):
+    """
+    A page of sessions, newest first. When there are more, the X-Next-Cursor
+    header holds the cursor of the next page. `fields` is a comma-separated
+    list of session fields to return instead of the listing fields.
+    """
+    try:
+        sessions, next_cursor = await loop.run_in_executor(
+            None, db.list_sessions, limit, cursor, status, since, until,
+            [f.strip() for f in fields.split(",") if f.strip()] if fields else None)
+    except ValueError as e:
+        return {"error": str(e)}
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return sessions
+
+def load_trends(session_id: str, points: int, start_frame: Optional[int] = None, end_frame: Optional[int] = None,
+                method: str = "minmax") -> List[Dict]:
+    """Chart points of a session's frames in a frame range, downsampled to about `points` (see downsample.py)."""
+    if method == "lttb":
+        return lttb_trends(db.get_trend_points(session_id, start_frame, end_frame), points)
+    return db.get_trend_buckets(session_id, points, start_frame, end_frame)
 
 @app.get("/sessions/{session_id}")
-async def get_session_details(session_id: str):
-    analysis = get_analysis_results(session_id)
+async def get_session_details(session_id: str, points: int = DEFAULT_TREND_POINTS):
+    """
+    Session summary, trends and abnormal data. The trends are downsampled to
+    about `points` min/max buckets; points=0 returns every frame document.
+    """
+    analysis = await loop.run_in_executor(None, get_analysis_results, session_id, points <= 0)
     if "error" in analysis:
         return analysis
+    if points > 0:
+        analysis["trends"] = await loop.run_in_executor(None, load_trends, session_id, min(points, MAX_TREND_POINTS))
     
     abnormal_stats = db.get_abnormal_stats(session_id)
     abnormal_frames = db.get_abnormal_frames(session_id)
@@ -225,10 +570,70 @@ async def get_session_details(session_id: str):
         "aggregated_windows": aggregated_windows
     }
 
+@app.get("/sessions/{session_id}/tracks")
+async def get_session_tracks(session_id: str, start_frame: Optional[int] = None, end_frame: Optional[int] = None,
+                             x_min: Optional[int] = None, y_min: Optional[int] = None,
+                             x_max: Optional[int] = None, y_max: Optional[int] = None, limit: int = 1000):
+    """
+    Tracks of a session, optionally only those seen within a frame range or passing through a region.
+
+    Every track's trajectory is returned as [x, y, frame] points. Simplified
+    tracks also have "dwell": the number of sampled points each point stands for.
+    """
+    region = (x_min, y_min, x_max, y_max)
+    if any(v is None for v in region):
+        if any(v is not None for v in region):
+            return {"error": "A region needs x_min, y_min, x_max and y_max"}
+        region = None
+    if not db.get_session(session_id):
+        return {"error": "Session not found"}
+
+    records = await loop.run_in_executor(None, db.get_tracks, session_id, start_frame, end_frame, region, limit)
+    tracks = []
+    for record in records:
+        rows, dwell = stored_rows(record)
+        record.pop("trajectory")
+        if region is not None:
+            # The query matched bounding boxes; keep tracks with a point inside the region
+            inside = ((rows[:, 0] >= x_min) & (rows[:, 0] <= x_max) & (rows[:, 1] >= y_min) & (rows[:, 1] <= y_max))
+            if not inside.any():
+                continue
+        if dwell is not None:
+            record["dwell"] = dwell.tolist()
+        tracks.append({**record, "trajectory": rows.tolist()})
+    return {"session_id": session_id, "count": len(tracks), "tracks": tracks}
+
+@app.get("/sessions/{session_id}/trends")
+async def get_session_trend_points(session_id: str, points: int = DEFAULT_TREND_POINTS, start_frame: Optional[int] = None,
+                                   end_frame: Optional[int] = None, method: str = "minmax"):
+    """
+    Trends of a session in a frame range, downsampled to at most `points` chart points
+    with min/max buckets (computed by MongoDB) or Largest-Triangle-Three-Buckets.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        return {"error": f"Unknown method {method}, expected one of {', '.join(DOWNSAMPLE_METHODS)}"}
+    if not 0 < points <= MAX_TREND_POINTS:
+        return {"error": f"points must be between 1 and {MAX_TREND_POINTS}"}
+    if not db.get_session(session_id):
+        return {"error": "Session not found"}
+
+    trends = await loop.run_in_executor(None, load_trends, session_id, points, start_frame, end_frame, method)
+    return {"session_id": session_id, "method": method, "count": len(trends), "trends": trends}
+
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     # Delete from MongoDB
-    success = db.delete_session(session_id)
+    success, heir_id = db.delete_session(session_id)
+    
+    path = cache_path(session_id)
+    if success and path and os.path.isdir(path):
+        if heir_id:
+            # The heir inherited the session's results, its detection cache included (for replays)
+            os.replace(path, cache_path(heir_id))
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+    if success:
+        remove_checkpoint(session_id)
     
     if success:
         return {"message": f"Session {session_id} deleted successfully"}
@@ -253,7 +658,9 @@ async def run_aggregation_for_session(session_id: str):
     """Run window aggregation for a specific session."""
     from aggregator import run_window_aggregator_for_session
     try:
-        processed_count = run_window_aggregator_for_session(session_id)
+        session = db.get_session(session_id)
+        completed = bool(session) and session.get("status") == "completed"
+        processed_count = run_window_aggregator_for_session(session_id, flushed=completed)
         return {
             "message": f"Aggregation completed for session {session_id}",
             "windows_processed": processed_count
@@ -0,0 +1,84 @@
+"""
+Copy frame documents between the storage layouts (see db.FRAME_STORAGE).
+
+Sessions are copied one at a time, in batches, from the one-document-per-frame
+collection `yolov` to the time-series collection (or back with --to documents).
+A session whose frames are all in the target already is skipped; one copied
+partly by an interrupted run is copied again, so the migration can be rerun
+until it reports nothing left to do. Run it while the API is stopped, then
+start the API with FRAME_STORAGE=timeseries.
+
+Usage:
+    python migrate_frames.py [--to timeseries|documents] [--session ID ...] [--batch-size 1000] [--drop-source]
+"""
+import argparse
+from db import db, frame_collection
+
+MIGRATION_BATCH_SIZE = 1000
+
+
+def migrate_session(source, target, session_id, batch_size=MIGRATION_BATCH_SIZE, drop_source=False):
+    """
+    Copy the frames of one session from `source` to `target`.
+
+    Returns:
+        Number of frames copied (0 when the target already had them all)
+    """
+    expected = source.count_documents({"session_id": session_id})
+    present = target.count_documents({"session_id": session_id})
+    if present != expected:
+        if present:
+            target.delete_many({"session_id": session_id})
+        batch = []
+        for doc in source.find({"session_id": session_id}).sort("frame", 1):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                target.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            target.insert_many(batch, ordered=False)
+        copied = target.count_documents({"session_id": session_id})
+        if copied != expected:
+            raise RuntimeError(f"Session {session_id}: {copied} of {expected} frames copied")
+    else:
+        expected = 0
+    if drop_source:
+        source.delete_many({"session_id": session_id})
+    return expected
+
+
+def storage_size(collection):
+    """(data, index) storage of a collection in MB."""
+    stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+    return stats.get("storageSize", 0) / 1e6, stats.get("totalIndexSize", 0) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy frame documents between the storage layouts")
+    parser.add_argument("--to", choices=("timeseries", "documents"), default="timeseries",
+                        help="Target layout (default: timeseries)")
+    parser.add_argument("--session", action="append", default=[], metavar="ID",
+                        help="Only migrate these sessions (default: all)")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--drop-source", action="store_true",
+                        help="Delete the frames of a session from the source once they are copied")
+    args = parser.parse_args()
+
+    target = frame_collection(db.db, args.to)
+    source = frame_collection(db.db, "documents" if args.to == "timeseries" else "timeseries")
+    sessions = args.session or sorted(source.distinct("session_id"))
+    print(f"Migrating {len(sessions)} sessions from {source.name} to {target.name}")
+
+    total = 0
+    for session_id in sessions:
+        copied = migrate_session(source, target, session_id, args.batch_size, args.drop_source)
+        total += copied
+        print(f"{session_id}: {'copied ' + str(copied) + ' frames' if copied else 'already migrated'}")
+    print(f"Done: {total} frames copied")
+    for collection in (source, target):
+        data, indexes = storage_size(collection)
+        print(f"{collection.name}: {data:.1f} MB data, {indexes:.1f} MB indexes")
+
+
+if __name__ == "__main__":
+    main()
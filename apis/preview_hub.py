@@ -0,0 +1,75 @@
+"""
+Live preview fan-out for binary WebSocket and MJPEG viewers.
+Processing threads publish JPEG bytes; each viewer only ever holds the latest frame.
+"""
+import asyncio
+import threading
+from typing import Dict, Optional, Set
+
+MJPEG_BOUNDARY = "frame"
+
+
+class PreviewHub:
+    """Per-session registry of preview viewers."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Set the event loop viewer queues live on (publishers run on other threads)."""
+        self._loop = loop
+
+    def subscribe(self, file_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.setdefault(file_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, file_id: str, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(file_id)
+            if queues:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[file_id]
+
+    def has_subscribers(self, file_id: str) -> bool:
+        """Cheap check used by the analysis loop to skip annotation and encoding."""
+        return bool(self._subscribers.get(file_id))
+
+    def publish(self, file_id: str, jpeg: Optional[bytes]):
+        """Thread-safe: deliver a JPEG (or None to end the stream) to every viewer of a session."""
+        if self._loop is None or not self.has_subscribers(file_id):
+            return
+        self._loop.call_soon_threadsafe(self._deliver, file_id, jpeg)
+
+    def close(self, file_id: str):
+        """End every viewer stream of a finished session."""
+        self.publish(file_id, None)
+
+    def _deliver(self, file_id: str, jpeg: Optional[bytes]):
+        with self._lock:
+            queues = list(self._subscribers.get(file_id, ()))
+        for queue in queues:
+            # Drop the frame the viewer has not picked up yet, keep the newest one
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(jpeg)
+
+
+def mjpeg_part(jpeg: bytes) -> bytes:
+    """Wrap a JPEG as one part of a multipart/x-mixed-replace stream."""
+    header = (
+        f"--{MJPEG_BOUNDARY}\r\n"
+        f"Content-Type: image/jpeg\r\n"
+        f"Content-Length: {len(jpeg)}\r\n\r\n"
+    ).encode("ascii")
+    return header + jpeg + b"\r\n"
+
+
+preview_hub = PreviewHub()
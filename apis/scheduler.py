@@ -0,0 +1,611 @@
+"""
+Process-pool job scheduler for video processing.
+
+Each worker process loads the YOLO network and the ReID encoder once and then
+processes one task at a time, so several uploads use several cores instead
+of contending for the GIL of the API process. Jobs wait in a priority queue
+(FIFO within one priority), can be cancelled while queued or running, and are
+killed when they exceed JOB_TIMEOUT_SECONDS. Progress, preview frames and job
+results are reported back to the API process through an event queue.
+
+Within one priority, jobs run shortest-first: each upload is probed for frame
+count, FPS and resolution, and its processing time is estimated from the
+decode and analysis throughput measured on earlier jobs (CostModel). Waiting
+jobs age, so a long archive job is delayed but never starved.
+
+Videos longer than SEGMENT_MIN_SECONDS are split into segments that run on
+several workers in parallel (see crowd_analysis/segments.py); once every
+segment is done a merge task stitches their tracks and finalizes the session.
+
+A task whose worker crashed or raised is retried up to JOB_RETRIES times; a
+whole-video task resumes from its last checkpoint (crowd_analysis/checkpoint.py).
+"""
+import heapq
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from segments import plan_segments
+
+env_path = Path(__file__).parent.parent / '.env'
+load_dotenv(dotenv_path=env_path)
+
+PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", "2"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "0"))  # 0 disables the timeout
+JOB_RETRIES = int(os.getenv("JOB_RETRIES", "1"))  # Reruns of a task whose worker crashed or raised
+JOB_SCHEDULING = os.getenv("JOB_SCHEDULING", "sjf")  # "sjf" (shortest job first) or "fifo"
+SJF_AGING = float(os.getenv("SJF_AGING", "1.0"))  # Estimated seconds forgiven per second waited
+SEGMENT_MIN_SECONDS = float(os.getenv("SEGMENT_MIN_SECONDS", "600"))  # Video seconds per segment (0 disables)
+CANCEL_GRACE_SECONDS = 10.0  # Time a cancelled job gets to stop before its worker is killed
+MONITOR_INTERVAL = 0.5
+
+# Cost model starting point (CPU, YOLOv4-tiny), refined from every completed job
+DEFAULT_DECODE_SECONDS_PER_MPX = 0.004  # Per decoded frame and megapixel of source resolution
+DEFAULT_ANALYZE_SECONDS = 0.15  # Per analyzed frame: resize, detection, tracking, analytics
+COST_MODEL_SMOOTHING = 0.3  # Weight of the newest measurement
+UNKNOWN_JOB_SECONDS = 600.0  # Assumed cost of a video the probe could not read
+ETA_MIN_PROGRESS = 0.05  # Progress after which a running task's ETA uses its own speed
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED, TIMED_OUT, INTERRUPTED = (
+    "queued", "running", "completed", "failed", "cancelled", "timed_out", "interrupted"
+)
+# Interrupted: stopped by a scheduler shutdown, to be resumed when the API starts again
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED, TIMED_OUT, INTERRUPTED)
+
+# Task kinds: a whole video, one segment of a video, stitching the segments of a video
+VIDEO, SEGMENT, MERGE = "video", "segment", "merge"
+
+
+class JobError(Exception):
+    """A job did not complete; `state` tells whether it failed, was cancelled or timed out."""
+
+    def __init__(self, state: str, message: str):
+        super().__init__(message)
+        self.state = state
+
+
+class CostModel:
+    """
+    Estimates processing seconds of a probed video from measured stage throughput.
+
+    cost = frames * megapixels * decode_per_mpx + analyzed_frames * analyze_seconds
+    """
+
+    def __init__(self, decode_per_mpx: float = DEFAULT_DECODE_SECONDS_PER_MPX,
+                 analyze_seconds: float = DEFAULT_ANALYZE_SECONDS, smoothing: float = COST_MODEL_SMOOTHING):
+        self.decode_per_mpx = decode_per_mpx
+        self.analyze_seconds = analyze_seconds
+        self.smoothing = smoothing
+        self.observations = 0
+
+    def estimate(self, probe: Optional[Dict]) -> float:
+        if not probe:
+            return UNKNOWN_JOB_SECONDS
+        megapixels = probe["width"] * probe["height"] / 1e6
+        return (probe["frame_count"] * megapixels * self.decode_per_mpx
+                + probe["analyzed_frames"] * self.analyze_seconds)
+
+    def observe(self, probe: Optional[Dict], timings: Optional[Dict]):
+        """Fold the stage timings of a completed task into the throughput estimates."""
+        if not probe or not timings or not timings.get("frames_read"):
+            return
+        megapixels = probe["width"] * probe["height"] / 1e6
+        decode_per_mpx = timings["decode_seconds"] / (timings["frames_read"] * megapixels)
+        self.decode_per_mpx += self.smoothing * (decode_per_mpx - self.decode_per_mpx)
+        if timings.get("frames_analyzed"):
+            analyze_seconds = (timings["total_seconds"] - timings["decode_seconds"]) / timings["frames_analyzed"]
+            self.analyze_seconds += self.smoothing * (analyze_seconds - self.analyze_seconds)
+        self.observations += 1
+
+    def to_dict(self) -> Dict:
+        return {
+            "decode_seconds_per_mpx": self.decode_per_mpx,
+            "analyze_seconds_per_frame": self.analyze_seconds,
+            "observations": self.observations
+        }
+
+
+class Job:
+    def __init__(self, job_id: str, video_path: str, priority: int, seq: int, probe: Optional[Dict] = None,
+                 continuous: bool = False):
+        self.job_id = job_id
+        self.video_path = video_path
+        self.continuous = continuous
+        self.priority = priority
+        self.seq = seq
+        self.probe = probe
+        self.estimated_seconds = None
+        self.tasks: List["Task"] = []
+        self.segment_results: Dict[int, Dict] = {}
+        self.state = QUEUED
+        self.error = None
+        self.submitted_at = datetime.now()
+        self.submitted_monotonic = time.monotonic()
+        self.started_at = None
+        self.started_monotonic = None
+        self.finished_at = None
+        self.cancel_requested_at = None
+        self.future = Future()
+
+    @property
+    def segments(self) -> int:
+        return sum(1 for task in self.tasks if task.kind == SEGMENT)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "priority": self.priority,
+            "workers": sorted(task.worker for task in self.tasks if task.running),
+            "segments": self.segments,
+            "segments_done": len(self.segment_results),
+            "continuous": self.continuous,
+            "error": self.error,
+            "probe": self.probe,
+            "estimated_seconds": self.estimated_seconds,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class Task:
+    """One unit of work for a worker process."""
+
+    def __init__(self, job: Job, kind: str, seq: int, estimated_seconds: float, segment: Optional[Dict] = None):
+        self.job = job
+        self.kind = kind
+        self.seq = seq
+        self.estimated_seconds = estimated_seconds
+        self.segment = segment
+        self.index = segment["index"] if segment else 0
+        self.worker = None
+        self.started_monotonic = None
+        self.frames_done = 0
+        self.finished = False
+        self.attempts = 1
+
+    @property
+    def queued(self) -> bool:
+        return self.worker is None and not self.finished
+
+    @property
+    def running(self) -> bool:
+        return self.worker is not None and not self.finished
+
+    def payload(self):
+        job = self.job
+        if self.kind == MERGE:
+            args = [job.segment_results[i] for i in sorted(job.segment_results)]
+        elif self.kind == VIDEO:
+            args = {"continuous": True} if job.continuous else None
+        else:
+            args = self.segment
+        return self.kind, job.job_id, job.video_path, args
+
+    def progress(self) -> float:
+        if self.segment:
+            start, end = self.segment["start"], self.segment["end"]
+        elif self.job.probe:
+            start, end = 1, self.job.probe["frame_count"] + 1
+        else:
+            return 0.0
+        if end <= start:
+            return 0.0
+        return min(max((self.frames_done - start + 1) / (end - start), 0.0), 1.0)
+
+
+def _worker_main(index, tasks, events, preview_wanted, cancel_flag):
+    """Entry point of a worker process: load models once, then run tasks until told to stop."""
+    from main_api import load_models, run_processing, run_segment, finalize_segments
+
+    models = load_models()
+    events.put(("ready", index, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        kind, job_id, video_path, args = task
+
+        def on_progress(data):
+            events.put(("progress", index, job_id, data))
+
+        def on_preview(jpeg):
+            events.put(("preview", index, job_id, jpeg))
+
+        options = dict(
+            preview_sink=on_preview,
+            has_preview_subscribers=lambda: bool(preview_wanted.value),
+            models=models,
+            should_stop=lambda: bool(cancel_flag.value)
+        )
+        continuous = kind == VIDEO and bool(args and args.get("continuous"))
+        try:
+            if kind == VIDEO:
+                result = run_processing(video_path, job_id, on_progress, continuous=continuous, **options)
+            elif kind == SEGMENT:
+                result = run_segment(video_path, job_id, args, on_progress, **options)
+            else:
+                result = finalize_segments(video_path, job_id, args)
+            # A continuous stream runs until it is stopped, which completes it
+            stopped = cancel_flag.value and not continuous
+            events.put(("cancelled" if stopped else "done", index, job_id, result))
+        except Exception as e:
+            traceback.print_exc()
+            events.put(("failed", index, job_id, str(e)))
+
+
+class _Worker:
+    def __init__(self, ctx, index: int, events):
+        self.index = index
+        self.tasks = ctx.Queue()
+        self.preview_wanted = ctx.Value("b", 0, lock=False)
+        self.cancel_flag = ctx.Value("b", 0, lock=False)
+        self.task: Optional[Task] = None
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(index, self.tasks, events, self.preview_wanted, self.cancel_flag),
+            name=f"video-worker-{index}",
+            daemon=True
+        )
+        self.process.start()
+
+    def assign(self, task: Task):
+        self.task = task
+        self.cancel_flag.value = 0
+        self.tasks.put(task.payload())
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(5)
+
+
+class JobScheduler:
+    """
+    Runs processing jobs on a pool of warm worker processes.
+
+    Args:
+        workers: Number of worker processes (concurrency limit)
+        timeout: Seconds a job may run before it is killed (0 disables)
+        retries: Reruns of a failed task before its job fails
+        policy: "sjf" runs the shortest estimated task of a priority first, "fifo" the oldest
+        aging: Estimated seconds forgiven per second a job has waited (sjf only)
+        segment_seconds: Minimum video seconds per parallel segment (0 disables segmenting)
+        on_progress: Called with (job_id, data) for every processed frame
+        on_preview: Called with (job_id, jpeg_bytes) for live preview frames
+        has_preview_subscribers: Called with job_id; True while the preview is watched
+    """
+
+    def __init__(self, workers: int = PROCESSING_WORKERS, timeout: float = JOB_TIMEOUT_SECONDS,
+                 retries: int = JOB_RETRIES, policy: str = JOB_SCHEDULING, aging: float = SJF_AGING,
+                 segment_seconds: float = SEGMENT_MIN_SECONDS,
+                 on_progress: Optional[Callable] = None, on_preview: Optional[Callable] = None,
+                 has_preview_subscribers: Optional[Callable] = None):
+        if policy not in ("sjf", "fifo"):
+            raise ValueError(f"Unknown JOB_SCHEDULING: {policy}")
+        self.num_workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = retries
+        self.policy = policy
+        self.aging = aging
+        self.segment_seconds = segment_seconds
+        self.cost_model = CostModel()
+        self.on_progress = on_progress
+        self.on_preview = on_preview
+        self.has_preview_subscribers = has_preview_subscribers
+
+        # Spawned workers get their own MongoDB client (pymongo is not fork-safe)
+        self._ctx = mp.get_context("spawn")
+        self._events = self._ctx.Queue()
+        self._workers: List[_Worker] = []
+        self._queue: List[Task] = []
+        self._seq = itertools.count()
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._workers = [_Worker(self._ctx, i, self._events) for i in range(self.num_workers)]
+        threading.Thread(target=self._event_loop, name="scheduler-events", daemon=True).start()
+        threading.Thread(target=self._monitor_loop, name="scheduler-monitor", daemon=True).start()
+
+    def shutdown(self):
+        self._running = False
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if job.state in (QUEUED, RUNNING):
+                    self._finish(job, INTERRUPTED, "scheduler shut down")
+            for worker in self._workers:
+                worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join(2)
+            if worker.process.is_alive():
+                worker.kill()
+
+    def submit(self, job_id: str, video_path: str, priority: int = 0, probe: Optional[Dict] = None,
+               segmentable: bool = True, continuous: bool = False) -> Future:
+        """
+        Queue a video for processing. Lower priority values run first.
+
+        Args:
+            probe: Result of video_probe.probe_video(), used to estimate the job's
+                cost and to split long videos into parallel segments
+            segmentable: False for videos still being uploaded, which are read front to back
+            continuous: Process a live stream with bounded memory until the job is
+                cancelled, which completes it (never segmented, no timeout)
+
+        Returns:
+            Future resolved when the job completes, raising JobError otherwise
+        """
+        with self._lock:
+            job = Job(job_id, video_path, priority, next(self._seq), probe, continuous)
+            job.estimated_seconds = self.cost_model.estimate(probe)
+            segments = self._segment_count(probe) if segmentable and not continuous else 1
+            if segments > 1:
+                for segment in plan_segments(probe, segments):
+                    frames = segment["end"] - segment["warmup"]
+                    estimate = job.estimated_seconds * frames / probe["frame_count"]
+                    job.tasks.append(Task(job, SEGMENT, next(self._seq), estimate, segment))
+            else:
+                job.tasks.append(Task(job, VIDEO, next(self._seq), job.estimated_seconds))
+            self._jobs[job_id] = job
+            self._queue.extend(job.tasks)
+            self._dispatch()
+        return job.future
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job immediately, or ask a running job to stop."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job.state in FINISHED_STATES:
+                return False
+            if job.state == QUEUED:
+                self._finish(job, CANCELLED, "cancelled")
+            elif job.cancel_requested_at is None:
+                self._request_stop(job)
+            return True
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            status = job.to_dict()
+            if job.state in (QUEUED, RUNNING):
+                now = time.monotonic()
+                order = self._queue_order(now)
+                if job.state == QUEUED:
+                    ahead = order[:order.index(job.tasks[0])]
+                    status["queue_position"] = len({task.job.job_id for task in ahead})
+                status["eta_seconds"] = round(self._etas(now, order)[job_id], 1)
+            return status
+
+    def stats(self) -> Dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+            return {
+                "workers": self.num_workers,
+                "busy": sum(1 for w in self._workers if w.task is not None),
+                "policy": self.policy,
+                "cost_model": self.cost_model.to_dict(),
+                **{state: states.count(state) for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            }
+
+    # Internals (called with self._lock held unless noted)
+    def _segment_count(self, probe: Optional[Dict]) -> int:
+        if not probe or self.segment_seconds <= 0 or self.num_workers < 2:
+            return 1
+        return max(1, min(self.num_workers, int(probe["duration"] // self.segment_seconds)))
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if worker.task is not None or not worker.process.is_alive():
+                continue
+            task = self._pop_next()
+            if task is None:
+                return
+            job = task.job
+            if job.state == QUEUED:
+                job.state = RUNNING
+                job.started_at = datetime.now()
+                job.started_monotonic = time.monotonic()
+            task.worker = worker.index
+            task.started_monotonic = time.monotonic()
+            worker.preview_wanted.value = int(self._wants_preview(task))
+            worker.assign(task)
+
+    def _pop_next(self) -> Optional[Task]:
+        self._queue = self._queue_order(time.monotonic())
+        return self._queue.pop(0) if self._queue else None
+
+    def _sort_key(self, task: Task, now: float):
+        job = task.job
+        if self.policy == "fifo":
+            return job.priority, job.seq, task.index
+        waited = now - job.submitted_monotonic
+        return job.priority, task.estimated_seconds - self.aging * waited, job.seq, task.index
+
+    def _queue_order(self, now: float) -> List[Task]:
+        queued = [task for task in self._queue if task.queued and task.job.state not in FINISHED_STATES]
+        return sorted(queued, key=lambda t: self._sort_key(t, now))
+
+    def _remaining(self, task: Task, now: float) -> float:
+        elapsed = now - task.started_monotonic
+        progress = task.progress()
+        if progress >= ETA_MIN_PROGRESS:
+            # Extrapolate from the task's own speed once it has made some progress
+            return elapsed * (1 - progress) / progress
+        return max(task.estimated_seconds - elapsed, 0.0)
+
+    def _etas(self, now: float, order: List[Task]) -> Dict[str, float]:
+        """Seconds until each running or queued job finishes, simulating dispatch in queue order."""
+        etas = {}
+        free_at = []
+        for worker in self._workers:
+            remaining = 0.0
+            if worker.task is not None:
+                remaining = self._remaining(worker.task, now)
+                job_id = worker.task.job.job_id
+                etas[job_id] = max(etas.get(job_id, 0.0), remaining)
+            heapq.heappush(free_at, remaining)
+        for task in order:
+            finish = heapq.heappop(free_at) + task.estimated_seconds
+            etas[task.job.job_id] = max(etas.get(task.job.job_id, 0.0), finish)
+            heapq.heappush(free_at, finish)
+        return etas
+
+    def _leading_task(self, job: Job) -> Optional[Task]:
+        # Only the earliest running segment feeds the live chart and the preview
+        running = [task for task in job.tasks if task.running and task.kind != MERGE]
+        return min(running, key=lambda t: t.index) if running else None
+
+    def _wants_preview(self, task: Task) -> bool:
+        if not self.has_preview_subscribers or task.kind == MERGE:
+            return False
+        if self._leading_task(task.job) not in (None, task):
+            return False
+        return bool(self.has_preview_subscribers(task.job.job_id))
+
+    def _request_stop(self, job: Job):
+        job.cancel_requested_at = time.monotonic()
+        for task in job.tasks:
+            if task.running:
+                self._workers[task.worker].cancel_flag.value = 1
+
+    def _finish(self, job: Job, state: str, error: Optional[str] = None):
+        job.state = state
+        job.error = error
+        job.finished_at = datetime.now()
+        # Segments still running on other workers are stopped; their workers are freed when they report back
+        if any(task.running for task in job.tasks) and job.cancel_requested_at is None:
+            self._request_stop(job)
+        if state == COMPLETED:
+            job.future.set_result(job.job_id)
+        else:
+            job.future.set_exception(JobError(state, error or state))
+
+    def _task_done(self, task: Task, kind: str, payload):
+        job = task.job
+        if job.state in FINISHED_STATES:
+            return
+        if kind == "failed":
+            if not self._retry(task, payload):
+                self._finish(job, FAILED, payload)
+        elif kind == "cancelled":
+            self._finish(job, CANCELLED, "cancelled")
+        elif task.kind == VIDEO:
+            self.cost_model.observe(job.probe, payload)
+            self._finish(job, COMPLETED)
+        elif task.kind == SEGMENT:
+            self.cost_model.observe(job.probe, payload["timings"])
+            job.segment_results[task.index] = payload
+            if len(job.segment_results) == job.segments:
+                merge = Task(job, MERGE, next(self._seq), 0.0)
+                job.tasks.append(merge)
+                self._queue.append(merge)
+        else:
+            print(f"Job {job.job_id}: stitched {payload} tracks across {job.segments} segments")
+            job.segment_results.clear()
+            self._finish(job, COMPLETED)
+
+    def _retry(self, task: Task, reason: str) -> bool:
+        """Queue a failed task again unless it is out of attempts or its job was stopped."""
+        if task.attempts > self.retries or task.job.cancel_requested_at is not None:
+            return False
+        print(f"Job {task.job.job_id}: {task.kind} task failed ({reason}), retrying (attempt {task.attempts + 1})")
+        task.attempts += 1
+        task.worker = None
+        task.finished = False
+        self._queue.append(task)
+        return True
+
+    def _event_loop(self):
+        # Runs on its own thread; callbacks are invoked without the lock held
+        while self._running:
+            try:
+                kind, index, job_id, payload = self._events.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+
+            with self._lock:
+                worker = self._workers[index]
+                task = worker.task
+                if task is None or task.job.job_id != job_id:
+                    # "ready", or a late event of a worker that has been replaced
+                    task = None
+
+                if kind in ("done", "failed", "cancelled"):
+                    if task is not None:
+                        task.finished = True
+                        worker.task = None
+                        self._task_done(task, kind, payload)
+                    self._dispatch()
+                    continue
+
+                forward = task is not None and task.job.state == RUNNING
+                if forward and kind == "progress":
+                    # Upload events carry the number of an earlier abnormal frame, not the task's progress
+                    if "event" not in payload:
+                        task.frames_done = payload.get("frame", task.frames_done)
+                    # Abnormal frame uploads are always forwarded, frame metrics of the leading segment only
+                    forward = "event" in payload or self._leading_task(task.job) is task
+
+            if not forward:
+                continue
+            if kind == "progress" and self.on_progress:
+                self.on_progress(job_id, payload)
+            elif kind == "preview" and self.on_preview:
+                self.on_preview(job_id, payload)
+
+    def _monitor_loop(self):
+        # Enforces timeouts and cancellation grace, replaces dead workers, refreshes preview flags
+        while self._running:
+            time.sleep(MONITOR_INTERVAL)
+            with self._lock:
+                now = time.monotonic()
+                for worker in list(self._workers):
+                    if self._workers[worker.index] is not worker:
+                        continue  # Replaced earlier in this pass
+                    task = worker.task
+                    if not worker.process.is_alive():
+                        error = f"worker exited with code {worker.process.exitcode}"
+                        self._replace(worker)
+                        if task is not None and task.job.state not in FINISHED_STATES and not self._retry(task, error):
+                            self._finish(task.job, FAILED, error)
+                        continue
+                    if task is None:
+                        continue
+                    job = task.job
+                    if job.state == RUNNING and self.timeout and not job.continuous and now - job.started_monotonic > self.timeout:
+                        self._finish(job, TIMED_OUT, f"exceeded {self.timeout:.0f}s")
+                        for other in list(self._workers):
+                            if other.task is not None and other.task.job is job:
+                                self._replace(other, kill=True)
+                    elif job.cancel_requested_at and now - job.cancel_requested_at > CANCEL_GRACE_SECONDS:
+                        if job.state not in FINISHED_STATES:
+                            self._finish(job, CANCELLED, "cancelled")
+                        self._replace(worker, kill=True)
+                    else:
+                        worker.preview_wanted.value = int(self._wants_preview(task))
+                self._dispatch()
+
+    def _replace(self, worker: _Worker, kill: bool = False):
+        if kill:
+            worker.kill()
+        if worker.task is not None:
+            worker.task.finished = True
+        self._workers[worker.index] = _Worker(self._ctx, worker.index, self._events)
@@ -0,0 +1,368 @@
+"""
+Local append-only spool for MongoDB writes.
+
+When the database is slow or unreachable, frame batches, aggregate windows and
+frame patches are appended to segment files on disk instead of blocking or
+failing the processing session. A replayer thread drains the segments in bulk,
+oldest first, once the database accepts writes again.
+
+Every process that spools (the API process and each worker of the job
+scheduler) owns a subdirectory of SPOOL_DIR, held with an exclusive lock for
+as long as the process lives. Only the owner appends to and replays its
+segments. Directories whose lock can be taken belong to a process that has
+exited; their segments are adopted by the next process that looks. A process
+whose job failed releases its segments the same way, so the job's rerun can
+replay them first.
+
+Inserts into a time-series collection (FRAME_STORAGE=timeseries) are
+replayed after deleting the copies of the same frames that an interrupted
+replay already stored, since such collections do not enforce unique `_id`s.
+
+Record format: 4-byte big-endian length followed by a BSON document
+`{"c": collection, "op": "insert" | "update", "d": payload}`. A torn record
+at the end of a segment (crash while appending) is ignored on replay.
+"""
+import itertools
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import bson
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+env_path = Path(__file__).parent.parent / '.env'
+load_dotenv(dotenv_path=env_path)
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", str(Path(__file__).parent / "spool"))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(512 * 1024 * 1024)))
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "5"))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))
+
+_LENGTH = struct.Struct(">I")
+_LOCK_NAME = "owner.lock"
+DUPLICATE_KEY = 11000
+
+
+class WriteSpool:
+    """
+    Bounded on-disk spool of pending MongoDB writes, private to this process.
+
+    Args:
+        directory: Root directory; this process's segments are kept in a
+            subdirectory named after its pid
+        max_bytes: Disk budget; records beyond it are dropped and counted
+        segment_bytes: Size at which the current segment is sealed
+        timeseries: Names of the time-series collections among the
+            collections written to (frame documents with `session_id` and `frame`)
+    """
+
+    def __init__(self, directory: str = SPOOL_DIR, max_bytes: int = SPOOL_MAX_BYTES,
+                 segment_bytes: int = SPOOL_SEGMENT_BYTES, timeseries: Iterable[str] = ()):
+        self.root = Path(directory)
+        self.timeseries = frozenset(timeseries)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+
+        self.directory, self._owner_lock = _claim_directory(self.root / f"proc-{os.getpid()}")
+        self._lock = threading.Lock()
+        # Serializes replay(), release() and adoption, which move or remove whole segments
+        self._replay_lock = threading.Lock()
+        self._current = None
+        self._current_path: Optional[Path] = None
+        # A pid can be reused: segments left by an earlier process of the same pid are kept and replayed
+        segments = self._segments()
+        self._next_seq = _segment_seq(segments[-1]) + 1 if segments else 1
+        self._bytes = sum(p.stat().st_size for p in segments)
+        self._stats = {"spooled": 0, "replayed": 0, "dropped": 0, "replay_failures": 0, "adopted": 0,
+                       "last_error": None}
+        self._released = itertools.count(1)
+        self._replayer = None
+        self.adopt_orphans()
+
+    # Writing
+    def append_inserts(self, collection: str, docs: List[Dict]) -> int:
+        return self._append([{"c": collection, "op": "insert", "d": doc} for doc in docs])
+
+    def append_update(self, collection: str, query: Dict, update: Dict) -> int:
+        return self._append([{"c": collection, "op": "update", "d": {"q": query, "u": update}}])
+
+    def _append(self, records: List[Dict]) -> int:
+        payload = b"".join(_encode(record) for record in records)
+        with self._lock:
+            if self._bytes + len(payload) > self.max_bytes:
+                self._stats["dropped"] += len(records)
+                print(f"Spool full ({self._bytes} bytes), dropped {len(records)} records")
+                return 0
+            if self._current is None or self._current.tell() >= self.segment_bytes:
+                self._open_segment()
+            self._current.write(payload)
+            self._current.flush()
+            os.fsync(self._current.fileno())
+            self._bytes += len(payload)
+            self._stats["spooled"] += len(records)
+        return len(records)
+
+    def _open_segment(self):
+        if self._current is not None:
+            self._current.close()
+        self._current_path = self._next_segment_path()
+        self._current = open(self._current_path, "ab")
+
+    def _next_segment_path(self) -> Path:
+        path = self.directory / f"spool-{self._next_seq:012d}.log"
+        self._next_seq += 1
+        return path
+
+    def _seal_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+            self._current_path = None
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.directory.glob("spool-*.log"))
+
+    # Replaying
+    def has_pending(self) -> bool:
+        return self._bytes > 0
+
+    def replay(self, database) -> int:
+        """
+        Write this process's spooled records to `database` in bulk, oldest segment first.
+
+        Stops at the first segment that cannot be written; it is retried on
+        the next call. Duplicate key errors are ignored because every spooled
+        insert keeps its `_id`, which makes replaying a segment twice harmless.
+        Time-series collections do not enforce unique `_id`s, so the frames of
+        an insert into one are deleted first instead.
+
+        Returns:
+            Number of records replayed
+        """
+        replayed = 0
+        with self._replay_lock:
+            with self._lock:
+                # Seal the segment being appended to so it can be replayed and removed
+                self._seal_current()
+                segments = self._segments()
+
+            for path in segments:
+                records = list(_read_records(path))
+                try:
+                    for batch_start in range(0, len(records), SPOOL_REPLAY_BATCH):
+                        _write_records(database, records[batch_start:batch_start + SPOOL_REPLAY_BATCH],
+                                       self.timeseries)
+                except Exception as e:
+                    with self._lock:
+                        self._stats["replay_failures"] += 1
+                        self._stats["last_error"] = str(e)[:200]
+                    break
+                size = path.stat().st_size
+                path.unlink()
+                replayed += len(records)
+                with self._lock:
+                    self._bytes -= size
+                    self._stats["replayed"] += len(records)
+        return replayed
+
+    def drain(self, database) -> bool:
+        """Adopt orphaned segments and replay everything now; True if nothing is left in the spool."""
+        self.adopt_orphans()
+        if self.has_pending():
+            self.replay(database)
+        return not self.has_pending()
+
+    def adopt_orphans(self) -> int:
+        """
+        Move the segments of spool directories whose process has exited into this process's directory.
+
+        Segments left directly in the root (by an earlier, shared layout) are adopted as well.
+
+        Returns:
+            Number of segments adopted
+        """
+        adopted = 0
+        with self._replay_lock:
+            adopted += self._take_segments(sorted(self.root.glob("spool-*.log")))
+            for directory in sorted(self.root.iterdir()):
+                if not directory.is_dir() or directory == self.directory:
+                    continue
+                try:
+                    lock_file = open(directory / _LOCK_NAME, "ab")
+                except OSError:
+                    continue
+                try:
+                    if not _try_lock(lock_file):
+                        continue  # Its process is alive
+                    adopted += self._take_segments(sorted(directory.glob("spool-*.log")))
+                    os.remove(directory / _LOCK_NAME)
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+                finally:
+                    lock_file.close()
+        if adopted:
+            print(f"Spool: adopted {adopted} orphaned segments")
+        return adopted
+
+    def _take_segments(self, paths: List[Path]) -> int:
+        taken = 0
+        for path in paths:
+            with self._lock:
+                target = self._next_segment_path()
+                try:
+                    size = path.stat().st_size
+                    os.replace(path, target)
+                except OSError:
+                    continue  # Taken by another process first
+                self._bytes += size
+                self._stats["adopted"] += 1
+            taken += 1
+        return taken
+
+    def release(self) -> int:
+        """
+        Hand every pending segment over to the next process that adopts orphans.
+
+        Used when a job fails while this process lives on: the job's rerun may
+        run in another worker, which must be able to replay the failed run's
+        writes before it deletes and recomputes them.
+
+        Returns:
+            Number of segments released
+        """
+        with self._replay_lock:
+            with self._lock:
+                self._seal_current()
+                segments = self._segments()
+                if not segments:
+                    return 0
+                # Locked while the segments move in, so no one adopts the directory half-filled
+                target, lock_file = _claim_directory(self.root / f"released-{os.getpid()}-{next(self._released)}")
+                try:
+                    for path in segments:
+                        self._bytes -= path.stat().st_size
+                        os.replace(path, target / path.name)
+                finally:
+                    lock_file.close()
+        return len(segments)
+
+    def start_replayer(self, database, interval: float = SPOOL_REPLAY_INTERVAL):
+        """Replay the spool in the background every `interval` seconds while it is not empty."""
+        if self._replayer is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.adopt_orphans()
+                if self.has_pending():
+                    count = self.replay(database)
+                    if count:
+                        print(f"Spool replay: wrote {count} records to MongoDB")
+
+        self._replayer = threading.Thread(target=run, name="spool-replayer", daemon=True)
+        self._replayer.start()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "bytes": self._bytes, "segments": len(self._segments()),
+                    "max_bytes": self.max_bytes}
+
+
+def _claim_directory(directory: Path):
+    """Create `directory` and take its owner lock; returns the directory and the open lock file."""
+    directory.mkdir(parents=True, exist_ok=True)
+    lock_file = open(directory / _LOCK_NAME, "ab")
+    if not _try_lock(lock_file):
+        lock_file.close()
+        raise RuntimeError(f"Spool directory {directory} is locked by another process")
+    return directory, lock_file
+
+
+def _try_lock(lock_file) -> bool:
+    """Take an exclusive, non-blocking lock on an open file; released when the file is closed."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _segment_seq(path: Path) -> int:
+    return int(path.stem.split("-")[1])
+
+
+def _encode(record: Dict) -> bytes:
+    data = bson.encode(record)
+    return _LENGTH.pack(len(data)) + data
+
+
+def _read_records(path: Path):
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                print(f"Ignoring torn record at the end of {path.name}")
+                return
+            yield bson.decode(data)
+
+
+def _write_records(database, records: List[Dict], timeseries=frozenset()):
+    # Keep the original order between collections: consecutive records of one
+    # collection and operation type are sent as one bulk write
+    group, key = [], None
+    for record in records:
+        record_key = (record["c"], record["op"])
+        if group and record_key != key:
+            _write_group(database, key, group, timeseries)
+            group = []
+        key = record_key
+        group.append(record["d"])
+    if group:
+        _write_group(database, key, group, timeseries)
+
+
+def _write_group(database, key, payloads: List[Dict], timeseries=frozenset()):
+    collection, op = key
+    try:
+        if op == "insert":
+            if collection in timeseries:
+                _delete_stored_frames(database[collection], payloads)
+            database[collection].insert_many(payloads, ordered=False)
+        else:
+            database[collection].bulk_write([UpdateOne(p["q"], p["u"]) for p in payloads], ordered=True)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY for err in errors) or e.details.get("writeConcernErrors"):
+            raise
+
+
+def _delete_stored_frames(collection, docs: List[Dict]):
+    # Only the listed frames: frames between them may have been inserted directly while these were spooled
+    frames = defaultdict(list)
+    for doc in docs:
+        frames[doc["session_id"]].append(doc["frame"])
+    for session_id, session_frames in frames.items():
+        collection.delete_many({"session_id": session_id, "frame": {"$in": session_frames}})
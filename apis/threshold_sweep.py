@@ -0,0 +1,307 @@
+"""
+Threshold sweep over a processed session.
+
+Loads a session's movement tracks and frame metrics from MongoDB once and
+evaluates a grid of analytics thresholds without rerunning the detector:
+
+- ABNORMAL_ENERGY, ABNORMAL_THRESH and ABNORMAL_MIN_PEOPLE decide which frames
+  are abnormal (reported as abnormal frame counts)
+- SPEED_THRESHOLD and the classify_crowd_state rules (aggregator.CROWD_STATE_RULES)
+  decide the crowd state of every 5 second window (reported as timelines)
+
+Per-person speeds are reconstructed from the stored tracks at the frames
+their points were observed. The live analysis only counts some tracks (e.g.
+confirmed ones), so results are approximate; for exact results replay the
+session's detection cache (POST /sessions/{id}/replay).
+
+Every parameter combination is evaluated with vectorized NumPy kernels; the
+grid is split over worker processes by ABNORMAL_ENERGY and SPEED_THRESHOLD.
+
+Usage:
+    python threshold_sweep.py <session_id> --grid ABNORMAL_ENERGY=1000,1866,3000 \\
+        --grid SPEED_THRESHOLD=5,10,20 --grid SURGE_GROWTH_RATE=0.25,0.5 [--workers 4] [--output sweep.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SCRIPT_DIR), "crowd_analysis"))
+
+from config import ABNORMAL_ENERGY, ABNORMAL_THRESH, ABNORMAL_MIN_PEOPLE, SPEED_THRESHOLD
+from db import db
+from aggregator import CROWD_STATE_RULES, normalize_datetime
+from deep_sort.trajectory import record_rows
+
+WINDOW_SECONDS = 5
+MIN_WINDOW_FRAMES = 3
+# Crowd state codes used by the kernels, in order of rule precedence (lowest first)
+CROWD_STATES = ("NORMAL", "SUSTAINED_ABNORMAL", "SUDDEN_SURGE", "DENSE_FAST_MOVING")
+
+FRAME_THRESHOLDS = {
+    "ABNORMAL_ENERGY": ABNORMAL_ENERGY,
+    "ABNORMAL_THRESH": ABNORMAL_THRESH,
+    "ABNORMAL_MIN_PEOPLE": ABNORMAL_MIN_PEOPLE,
+    "SPEED_THRESHOLD": SPEED_THRESHOLD
+}
+SWEEP_PARAMETERS = {**FRAME_THRESHOLDS, **CROWD_STATE_RULES}
+
+
+def build_sweep_data(frames, movement_data, vid_fps, data_record_frame):
+    """
+    Turn stored frame documents and movement tracks into the arrays the kernels use.
+
+    Args:
+        frames: Frame documents of the session sorted by frame number
+        movement_data: Track records {track_id, entry, exit, trajectory}
+        vid_fps: FPS of the video
+        data_record_frame: Frames between two analyzed frames
+
+    Returns:
+        Dict of NumPy arrays: per frame (frame, human_count, window), per track
+        step (step_frame: index into the frames, speed, energy) and per window
+        (window_start, max_density, avg_abnormal_score, growth_rate, frame_count)
+    """
+    time_step = data_record_frame / vid_fps
+    frame_numbers = np.array([f["frame"] for f in frames], dtype=np.int64)
+    human_count = np.array([f.get("human_count", 0) for f in frames], dtype=np.float64)
+
+    # Speed between consecutive positions of a track, attributed to the later frame
+    step_frames, speeds = [], []
+    for record in movement_data:
+        rows = record_rows(record)
+        if len(rows) < 2:
+            continue
+        step_frames.append(rows[1:, 2].astype(np.int64))
+        speeds.append(np.linalg.norm(np.diff(rows[:, :2].astype(np.float64), axis=0), axis=1) / time_step)
+    step_frames = np.concatenate(step_frames) if step_frames else np.empty(0, dtype=np.int64)
+    speeds = np.concatenate(speeds) if speeds else np.empty(0)
+
+    # Keep the steps that fall on a stored frame
+    index = np.searchsorted(frame_numbers, step_frames)
+    index = np.minimum(index, max(len(frame_numbers) - 1, 0))
+    on_frame = (frame_numbers[index] == step_frames) if len(frame_numbers) else np.zeros(len(step_frames), bool)
+    step_frame, speeds = index[on_frame], speeds[on_frame]
+
+    # Tumbling windows from the first frame timestamp, as the aggregator builds them. Frames are stamped
+    # with their video time; sessions stored before that may have frames stamped out of frame order
+    timestamps = [normalize_datetime(f.get("timestamp")) for f in frames]
+    start = min(timestamps) if timestamps else None
+    window = np.array([int((t - start).total_seconds() // WINDOW_SECONDS) for t in timestamps], dtype=np.int64)
+    frame_count = np.bincount(window, minlength=window.max() + 1 if len(window) else 0)
+    kept = np.flatnonzero(frame_count >= MIN_WINDOW_FRAMES)
+    window_id = np.full(len(frame_count), -1)
+    window_id[kept] = np.arange(len(kept))
+    window = window_id[window] if len(window) else window
+
+    density = np.array([f.get("crowd_density_score", 0.0) for f in frames])
+    abnormal_score = np.array([f.get("frame_abnormal_score", 0.0) for f in frames])
+    in_window = window >= 0
+    max_density = np.full(len(kept), -np.inf)
+    np.maximum.at(max_density, window[in_window], density[in_window])
+    avg_abnormal_score = _window_mean(window, abnormal_score, len(kept))
+    avg_human_count = np.round(_window_mean(window, human_count, len(kept)), 2)
+
+    # Growth rate compared with the previous aggregated window
+    growth_rate = np.zeros(len(kept))
+    previous = avg_human_count[:-1]
+    growth_rate[1:] = np.divide(avg_human_count[1:] - previous, previous,
+                                out=np.zeros(len(previous)), where=previous != 0)
+
+    return {
+        "frame": frame_numbers,
+        "human_count": human_count,
+        "window": window,
+        "step_frame": step_frame,
+        "speed": speeds,
+        "energy": (0.5 * speeds ** 2).astype(np.int64),
+        "window_start": np.array([WINDOW_SECONDS * w for w in kept], dtype=np.int64),
+        "start_time": start,
+        "max_density": max_density,
+        "avg_abnormal_score": avg_abnormal_score,
+        "growth_rate": np.round(growth_rate, 4),
+        "frame_count": frame_count[kept]
+    }
+
+
+def _window_mean(window, values, windows):
+    in_window = window >= 0
+    sums = np.bincount(window[in_window], weights=values[in_window], minlength=windows)
+    counts = np.bincount(window[in_window], minlength=windows)
+    return np.divide(sums, counts, out=np.zeros(windows), where=counts > 0)
+
+
+def abnormal_frame_counts(data, energy, thresholds, min_people):
+    """
+    Abnormal frames for one ABNORMAL_ENERGY and every ABNORMAL_THRESH x ABNORMAL_MIN_PEOPLE.
+
+    Returns:
+        Array of shape (len(thresholds), len(min_people)) with abnormal frame counts
+    """
+    abnormal_people = np.bincount(data["step_frame"][data["energy"] > energy], minlength=len(data["frame"]))
+    people = data["human_count"]
+    ratio = np.divide(abnormal_people, people, out=np.zeros(len(people)), where=people > 0)
+    abnormal = (people[None, None, :] > np.asarray(min_people)[None, :, None]) & \
+        (ratio[None, None, :] > np.asarray(thresholds)[:, None, None])
+    return abnormal.sum(axis=2)
+
+
+def crowd_state_timelines(data, speed_threshold, rules):
+    """
+    Window crowd states for one SPEED_THRESHOLD and every combination of rule thresholds.
+
+    Args:
+        rules: Dict of rule name -> array of values (one entry per combination)
+
+    Returns:
+        Array of shape (combinations, windows) with indexes into CROWD_STATES
+    """
+    fast_people = np.bincount(data["step_frame"][data["speed"] > speed_threshold], minlength=len(data["frame"]))
+    people = data["human_count"]
+    fast_ratio = np.divide(fast_people, people, out=np.zeros(len(people)), where=people > 0)
+    avg_fast_ratio = _window_mean(data["window"], fast_ratio, len(data["window_start"]))
+
+    column = lambda name: np.asarray(rules[name], dtype=np.float64)[:, None]
+    dense = (data["max_density"][None, :] > column("DENSE_DENSITY_SCORE")) & \
+        (avg_fast_ratio[None, :] > column("DENSE_FAST_MOTION_RATIO"))
+    surge = data["growth_rate"][None, :] > column("SURGE_GROWTH_RATE")
+    sustained = data["avg_abnormal_score"][None, :] > column("SUSTAINED_ABNORMAL_SCORE")
+    return np.select([dense, surge, sustained], [3, 2, 1], default=0)
+
+
+_worker_data = None
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _abnormal_task(args):
+    energy, thresholds, min_people = args
+    return abnormal_frame_counts(_worker_data, energy, thresholds, min_people)
+
+
+def _crowd_state_task(args):
+    speed_threshold, rules = args
+    return crowd_state_timelines(_worker_data, speed_threshold, rules)
+
+
+def run_sweep(data, grid, workers=None):
+    """
+    Evaluate every combination of a parameter grid.
+
+    Args:
+        data: Output of build_sweep_data()
+        grid: Dict of parameter name (see SWEEP_PARAMETERS) -> list of values;
+            missing parameters keep their configured value
+        workers: Worker processes (default: one per CPU)
+
+    Returns:
+        One result per combination with thresholds, abnormal_frames,
+        abnormal_ratio, state_counts and timeline ([window start offset in
+        seconds, crowd state] at every state change)
+    """
+    grid = {name: list(grid.get(name, [default])) for name, default in SWEEP_PARAMETERS.items()}
+    rule_names = list(CROWD_STATE_RULES)
+    rule_combinations = list(itertools.product(*(grid[name] for name in rule_names)))
+    rules = {name: [combination[i] for combination in rule_combinations] for i, name in enumerate(rule_names)}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as executor:
+        abnormal = list(executor.map(_abnormal_task, [
+            (energy, grid["ABNORMAL_THRESH"], grid["ABNORMAL_MIN_PEOPLE"]) for energy in grid["ABNORMAL_ENERGY"]
+        ]))
+        states = list(executor.map(_crowd_state_task, [(speed, rules) for speed in grid["SPEED_THRESHOLD"]]))
+
+    total_frames = len(data["frame"])
+    timelines = {}
+    results = []
+    for (e, energy), (t, thresh), (m, min_people), (s, speed), (r, rule_values) in itertools.product(
+            enumerate(grid["ABNORMAL_ENERGY"]), enumerate(grid["ABNORMAL_THRESH"]),
+            enumerate(grid["ABNORMAL_MIN_PEOPLE"]), enumerate(grid["SPEED_THRESHOLD"]), enumerate(rule_combinations)):
+        if (s, r) not in timelines:
+            timelines[(s, r)] = _summarize_states(data["window_start"], states[s][r])
+        abnormal_frames = int(abnormal[e][t, m])
+        results.append({
+            "thresholds": {
+                "ABNORMAL_ENERGY": energy,
+                "ABNORMAL_THRESH": thresh,
+                "ABNORMAL_MIN_PEOPLE": min_people,
+                "SPEED_THRESHOLD": speed,
+                **dict(zip(rule_names, rule_values))
+            },
+            "abnormal_frames": abnormal_frames,
+            "abnormal_ratio": round(abnormal_frames / total_frames, 4) if total_frames else 0.0,
+            **timelines[(s, r)]
+        })
+    return results
+
+
+def _summarize_states(window_start, codes):
+    counts = np.bincount(codes, minlength=len(CROWD_STATES))
+    changes = np.flatnonzero(np.diff(codes, prepend=-1))
+    return {
+        "state_counts": {state: int(counts[i]) for i, state in enumerate(CROWD_STATES)},
+        "timeline": [[int(window_start[i]), CROWD_STATES[codes[i]]] for i in changes]
+    }
+
+
+def load_session(session_id):
+    """Load a session's frame metrics and movement tracks into sweep arrays (None if the session is missing)."""
+    session = db.get_session(session_id)
+    if not session:
+        return None
+    meta = session.get("video_meta", {})
+    if meta.get("IS_CAM") or not meta.get("VID_FPS"):
+        raise ValueError("Threshold sweeps need a processed video session")
+    return build_sweep_data(
+        db.get_session_trends(session_id),
+        db.get_tracks(session_id),
+        meta["VID_FPS"],
+        meta["DATA_RECORD_FRAME"]
+    )
+
+
+def _parse_grid(values):
+    grid = {}
+    for value in values:
+        name, _, numbers = value.partition("=")
+        if name not in SWEEP_PARAMETERS:
+            raise argparse.ArgumentTypeError(f"Unknown parameter {name}, expected one of {', '.join(SWEEP_PARAMETERS)}")
+        grid[name] = [float(n) for n in numbers.split(",") if n]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a grid of analytics thresholds on a processed session")
+    parser.add_argument("session_id")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="Values of one parameter: " + ", ".join(SWEEP_PARAMETERS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="Write all results as JSON to this file")
+    args = parser.parse_args()
+
+    data = load_session(args.session_id)
+    if data is None:
+        print(f"Session {args.session_id} not found")
+        sys.exit(1)
+    results = run_sweep(data, _parse_grid(args.grid), args.workers)
+
+    print(f"{len(data['frame'])} frames, {len(data['window_start'])} windows, {len(results)} combinations")
+    for result in results:
+        params = ", ".join(f"{k}={v:g}" for k, v in result["thresholds"].items())
+        states = ", ".join(f"{k}={v}" for k, v in result["state_counts"].items() if v)
+        print(f"{params}\n    abnormal frames: {result['abnormal_frames']} ({result['abnormal_ratio']:.1%})  windows: {states}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"session_id": args.session_id, "start_time": data["start_time"], "results": results}, f,
+                      default=str)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
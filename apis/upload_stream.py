@@ -0,0 +1,219 @@
+"""
+Resumable chunked uploads.
+
+A client creates an upload, then appends chunks with PATCH requests carrying
+the byte offset they start at; after a dropped connection it asks for the
+current offset and continues from there. Chunks are written from a thread
+pool so the event loop never blocks on disk I/O.
+
+While an upload is in progress a marker file (`<video>.uploading`, holding the
+upload metadata as JSON) sits next to the video. Processing can start before
+the upload completes when the container is streamable: the video is then read
+with streaming_capture.GrowingFileCapture, which follows the file until the
+marker disappears.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+from dotenv import load_dotenv
+from fingerprint import hash_file
+from streaming_capture import upload_marker, UPLOAD_MARKER_SUFFIX
+
+env_path = Path(__file__).parent.parent / '.env'
+load_dotenv(dotenv_path=env_path)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Bytes that must have arrived before processing may start on a partial upload
+STREAM_START_BYTES = int(os.getenv("STREAM_START_BYTES", str(4 * 1024 * 1024)))
+
+MATROSKA_MAGIC = b"\x1a\x45\xdf\xa3"
+TS_SYNC_BYTE = 0x47
+TS_PACKET_SIZE = 188
+
+
+def container_is_streamable(path: str) -> Optional[bool]:
+    """
+    Whether a video can be decoded from a prefix of the file.
+
+    Returns:
+        True for MP4/MOV with the moov box before the media data ("faststart"),
+        Matroska/WebM and MPEG-TS; False when the whole file is needed (e.g. MP4
+        with moov at the end); None when not enough has arrived to tell
+    """
+    with open(path, "rb") as f:
+        head = f.read(TS_PACKET_SIZE + 1)
+    if len(head) < 12:
+        return None
+    if head[4:8] == b"ftyp":
+        return _mp4_moov_first(path)
+    if head[:4] == MATROSKA_MAGIC:
+        return True
+    if head[0] == TS_SYNC_BYTE:
+        if len(head) <= TS_PACKET_SIZE:
+            return None
+        return head[TS_PACKET_SIZE] == TS_SYNC_BYTE
+    return False
+
+
+def _mp4_moov_first(path: str) -> Optional[bool]:
+    # Walk the top-level boxes: [size:4][type:4] with size 1 meaning a 64-bit size follows
+    size = os.path.getsize(path)
+    offset = 0
+    with open(path, "rb") as f:
+        while offset + 8 <= size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8]
+            if box_size == 1:
+                if len(header) < 16:
+                    return None
+                box_size = int.from_bytes(header[8:16], "big")
+            elif box_size == 0:
+                box_size = size - offset
+            if box_type == b"moov":
+                # The whole moov box (sample tables) has to be on disk before decoding
+                return True if offset + box_size <= size else None
+            if box_type == b"mdat" or box_size < 8:
+                return False
+            offset += box_size
+    return None
+
+
+class ResumableUpload:
+    def __init__(self, file_id: str, filename: str, path: str, size: Optional[int] = None, priority: int = 0,
+                 created_at: Optional[str] = None):
+        self.file_id = file_id
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.priority = priority
+        self.created_at = created_at or datetime.now().isoformat()
+        self.complete = False
+        self.processing_started = False
+        self.lock = asyncio.Lock()
+        # Content hash updated as chunks arrive; None once it can no longer be
+        # maintained incrementally (upload reloaded after a restart)
+        self.hasher = hashlib.sha256()
+        self.content_hash: Optional[str] = None
+
+    @property
+    def offset(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def meta(self) -> Dict:
+        return {
+            "file_id": self.file_id,
+            "filename": self.filename,
+            "size": self.size,
+            "priority": self.priority,
+            "created_at": self.created_at
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            **self.meta(),
+            "offset": self.offset,
+            "complete": self.complete,
+            "processing_started": self.processing_started
+        }
+
+
+class UploadStore:
+    """
+    Registry of resumable uploads in one directory.
+
+    Uploads survive an API restart: their metadata is kept in the marker file
+    and reloaded on first access.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._uploads: Dict[str, ResumableUpload] = {}
+
+    def create(self, filename: str, size: Optional[int] = None, priority: int = 0) -> ResumableUpload:
+        file_id = str(uuid.uuid4())
+        safe_name = os.path.basename(filename)
+        path = os.path.abspath(os.path.join(self.directory, f"{file_id}_{safe_name}"))
+        upload = ResumableUpload(file_id, safe_name, path, size, priority)
+        os.makedirs(self.directory, exist_ok=True)
+        open(path, "wb").close()
+        with open(upload_marker(path), "w") as f:
+            json.dump(upload.meta(), f)
+        self._uploads[file_id] = upload
+        return upload
+
+    def get(self, file_id: str) -> Optional[ResumableUpload]:
+        upload = self._uploads.get(file_id)
+        if upload is None:
+            upload = self._load(file_id)
+        return upload
+
+    def _load(self, file_id: str) -> Optional[ResumableUpload]:
+        for marker in Path(self.directory).glob(f"{file_id}_*{UPLOAD_MARKER_SUFFIX}"):
+            try:
+                with open(marker) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            path = str(marker)[:-len(UPLOAD_MARKER_SUFFIX)]
+            upload = ResumableUpload(meta["file_id"], meta["filename"], path, meta.get("size"),
+                                     meta.get("priority", 0), meta.get("created_at"))
+            upload.hasher = None
+            self._uploads[file_id] = upload
+            return upload
+        return None
+
+    async def append(self, upload: ResumableUpload, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """
+        Append a request body at `offset`.
+
+        Raises:
+            ValueError: If `offset` is not the current end of the upload
+        """
+        loop = asyncio.get_running_loop()
+        async with upload.lock:
+            if offset != upload.offset:
+                raise ValueError(f"Offset {offset} does not match the uploaded size {upload.offset}")
+            with open(upload.path, "ab") as f:
+                async for chunk in chunks:
+                    if chunk:
+                        await loop.run_in_executor(None, self._write, upload, f, chunk)
+                await loop.run_in_executor(None, f.flush)
+        return upload.offset
+
+    @staticmethod
+    def _write(upload: ResumableUpload, f, chunk: bytes):
+        f.write(chunk)
+        if upload.hasher is not None:
+            upload.hasher.update(chunk)
+
+    def complete(self, upload: ResumableUpload):
+        """Mark an upload complete and compute its content hash (call from a worker thread)."""
+        upload.complete = True
+        if upload.hasher is not None:
+            upload.content_hash = upload.hasher.hexdigest()
+        else:
+            upload.content_hash = hash_file(upload.path)
+        try:
+            os.remove(upload_marker(upload.path))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, file_id: str):
+        """Forget an upload once its job has ended (the video file itself is removed by the caller)."""
+        upload = self._uploads.pop(file_id, None)
+        if upload is not None and not upload.complete:
+            upload.complete = True
+            try:
+                os.remove(upload_marker(upload.path))
+            except FileNotFoundError:
+                pass
@@ -6,7 +6,7 @@ import json
 import numpy as np
 import pandas as pd
 from math import ceil
-from scipy.spatial.distance import euclidean
+from analysis_utils import ragged_points, track_set_energies
 import sys
 import os
 
@@ -46,30 +46,7 @@ with open('processed_data/movement_data.csv', 'r') as file:
 
 print("Tracks recorded: " + str(len(tracks)))
 
-useful_tracks = []
-for movement in tracks:
-    check_index = stationary_time
-    start_point = 0
-    track = movement[:check_index]
-    while check_index < len(movement):
-        for i in movement[check_index:]:
-            if euclidean(movement[start_point], i) > stationary_distance:
-                track.append(i)
-                start_point += 1
-                check_index += 1
-            else:
-                start_point += 1
-                check_index += 1
-                break
-        useful_tracks.append(track)
-        track = movement[start_point:check_index]
-
-energies = []
-for movement in useful_tracks:
-    for i in range(len(movement) - 1):
-        speed = round(euclidean(movement[i], movement[i+1]) / time_steps , 2)
-        energy = int(0.5 * speed ** 2)
-        energies.append(energy)
+energies = track_set_energies(*ragged_points(tracks), time_steps, stationary_time, stationary_distance).tolist()
 
 c = len(energies)
 print()
@@ -1,98 +1,443 @@
 import numpy as np
 import pandas as pd
-from math import ceil
-from scipy.spatial.distance import euclidean
+from fractions import Fraction
+from math import ceil, log, exp
+from deep_sort.trajectory import record_rows
 
-def calculate_abnormal_stats(movement_data, vid_fps, data_record_frame, frame_size, track_max_age=3):
+# Energies below this are counted exactly; larger ones go to log buckets of ENERGY_BUCKET_ACCURACY relative width
+EXACT_ENERGY_LIMIT = 1 << 16
+ENERGY_BUCKET_ACCURACY = 0.01
+# A log bucket keeps its distinct energies while it has at most this many, so trimming can split it exactly
+BUCKET_MAX_VALUES = 64
+# Outlier trimming of the cleaned stats: drop energies 3 std from the mean while the skew stays above 7.5
+CLEAN_MAX_SKEW = 7.5
+CLEAN_MAX_ITERATIONS = 10
+# np.round(x, 2) can differ from round(x, 2) only this close to a tie of x * 100
+ROUND_TIE_MARGIN = 1e-6
+
+
+# Energy kernels. Tracks are passed as a ragged array: the (x, y) points of all
+# tracks concatenated, and `offsets` where offsets[t]:offsets[t + 1] are the
+# points of track t. Per-point arrays describe the step from a point to the
+# next one, so the entry of the last point of a track is unused.
+
+def ragged_points(tracks):
+    """(points, offsets) of a list of (N, 2) point arrays."""
+    offsets = np.zeros(len(tracks) + 1, dtype=np.int64)
+    np.cumsum([len(track) for track in tracks], out=offsets[1:])
+    if not offsets[-1]:
+        return np.empty((0, 2), dtype=np.float64), offsets
+    points = np.concatenate([np.asarray(track, dtype=np.float64).reshape(-1, 2) for track in tracks])
+    return points, offsets
+
+
+def _distances(a, b):
+    # sqrt of the summed squares, as scipy's euclidean computes it (exact sums for pixel coordinates)
+    d = a - b
+    return np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+
+
+def _round2(values):
+    """round(value, 2) of every value, bit for bit."""
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < ROUND_TIE_MARGIN
+    if near_tie.any():
+        rounded[near_tie] = [round(float(v), 2) for v in values[near_tie]]
+    return rounded
+
+
+def step_speeds(points, offsets, time_steps):
+    """Speed (pixels per second, rounded to 2 decimals) of the step from every point to the next."""
+    speeds = np.zeros(len(points), dtype=np.float64)
+    if len(points) > 1:
+        speeds[:-1] = _round2(_distances(points[1:], points[:-1]) / time_steps)
+    speeds[offsets[1:][offsets[1:] > offsets[:-1]] - 1] = 0
+    return speeds
+
+
+def speed_energies(speeds):
+    """Kinetic energy int(0.5 * speed ** 2) of every speed."""
+    return (0.5 * speeds * speeds).astype(np.int64)
+
+
+def stationary_mask(points, offsets, stationary_time, stationary_distance):
     """
-    Computes abnormal activity statistics from movement data in memory.
-    Replicates logic from abnormal_data_process.py without writing to disk.
+    True at the points that lie within `stationary_distance` of the point
+    `stationary_time` steps earlier in the same track (the first
+    `stationary_time` points of a track are never stationary).
     """
-    if not movement_data or vid_fps <= 0:
-        return None, None
-        
-    time_steps = data_record_frame / vid_fps
-    stationary_time = ceil(track_max_age / time_steps)
-    stationary_distance = frame_size * 0.01
-    
-    tracks = []
-    for row in movement_data:
-        # row format: [track_id, entry, exit, x1, y1, x2, y2, ...]
-        if len(row[3:]) > stationary_time * 2:
-            temp = []
-            data_pts = row[3:]
-            for i in range(0, len(data_pts), 2):
-                temp.append([int(data_pts[i]), int(data_pts[i+1])])
-            tracks.append(temp)
-            
-    if not tracks:
-        return None, None
-        
-    useful_tracks = []
-    for movement in tracks:
-        check_index = stationary_time
-        start_point = 0
-        track = movement[:check_index]
-        while check_index < len(movement):
-            for i in movement[check_index:]:
-                if euclidean(movement[start_point], i) > stationary_distance:
-                    track.append(i)
-                    start_point += 1
-                    check_index += 1
-                else:
-                    start_point += 1
-                    check_index += 1
-                    break
-            useful_tracks.append(track)
-            track = movement[start_point:check_index]
-            
-    energies = []
-    for movement in useful_tracks:
-        for i in range(len(movement) - 1):
-            speed = round(euclidean(movement[i], movement[i+1]) / time_steps , 2)
-            energy = int(0.5 * speed ** 2)
-            energies.append(energy)
-            
-    if not energies:
-        return None, None
-        
-    energies_ser = pd.Series(energies)
-    df = pd.DataFrame({'Energy': energies_ser})
-    
-    original_stats = {
-        "kurtosis": float(df.kurtosis().iloc[0]),
-        "skew": float(df.skew().iloc[0]),
-        "mean": float(df.Energy.mean()),
-        "std": float(df.Energy.std()),
-        "min": float(df.Energy.min()),
-        "max": float(df.Energy.max()),
-        "q1": float(df.Energy.quantile(0.25)),
-        "q2": float(df.Energy.quantile(0.50)),
-        "q3": float(df.Energy.quantile(0.75)),
-        "acceptable_energy": int(df.Energy.mean() ** 1.05) if not df.empty else 0
+    stationary = np.zeros(len(points), dtype=bool)
+    if len(points) > stationary_time:
+        lengths = np.diff(offsets)
+        local = np.arange(len(points)) - np.repeat(offsets[:-1], lengths)
+        far = _distances(points[stationary_time:], points[:-stationary_time]) > stationary_distance
+        stationary[stationary_time:] = ~far & (local[stationary_time:] >= stationary_time)
+    return stationary
+
+
+def useful_steps(stationary, offsets, stationary_time):
+    """
+    Indices of the steps the energies are computed from, in the order of the
+    per-track loop of abnormal_data_process.py.
+
+    A track is cut into overlapping segments: the first starts at its first
+    point and every stationary point (except the last point of a track)
+    starts a new one at the `stationary_time` points before it. A segment
+    ends before the next stationary point. Steps within the segments count
+    once per segment, and tracks of at most `stationary_time` points not at
+    all.
+    """
+    n = len(stationary)
+    lengths = np.diff(offsets)
+    track_end = np.repeat(offsets[1:], lengths)
+    index = np.arange(n)
+    # Last point of every segment seed, in track and point order
+    seeds = np.sort(np.concatenate([
+        offsets[:-1][lengths > stationary_time] + stationary_time - 1,
+        index[stationary & (index < track_end - 1)]
+    ]))
+    # First stationary point after each seed, or the end of the track
+    following = np.append(np.minimum.accumulate(np.where(stationary, index, n)[::-1])[::-1], n)
+    stops = np.minimum(following[seeds + 1], track_end[seeds])
+    starts = seeds - stationary_time + 1
+    steps = np.maximum(stops - 1 - starts, 0)
+    return np.repeat(starts, steps) + np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+
+
+def track_set_energies(points, offsets, time_steps, stationary_time, stationary_distance):
+    """
+    Kinetic energies of the steps of all tracks, leaving out the stretches
+    where a person stood still. Same energies in the same order as the
+    per-track loop of abnormal_data_process.py.
+    """
+    if not len(points):
+        return np.empty(0, dtype=np.int64)
+    steps = useful_steps(stationary_mask(points, offsets, stationary_time, stationary_distance),
+                         offsets, stationary_time)
+    return speed_energies(step_speeds(points, offsets, time_steps))[steps]
+
+
+class AbnormalEnergyStats:
+    """
+    Abnormal energy statistics maintained online as tracks expire.
+
+    Mean, std, skew and kurtosis come from exact integer power sums of the
+    energies, so they are the same whatever order (and batches) the energies
+    arrive in; min and max are kept exactly. Quantiles come from a histogram
+    sketch: exact counts for energies below EXACT_ENERGY_LIMIT and log
+    buckets (ENERGY_BUCKET_ACCURACY relative error) above, so memory stays
+    bounded however long the session runs.
+
+    Every log bucket also keeps the power sums, min and max of its energies
+    (and the energies themselves while it holds at most BUCKET_MAX_VALUES
+    distinct ones), so the outlier-trimmed "cleaned" moments, min and max are
+    exact as well. Only a bucket that no longer holds its energies and
+    straddles a trimming cutoff is kept or dropped as a whole, by its mean.
+
+    `stats()` returns the (original, cleaned) dicts of describe_energies.
+    Std, skew and kurtosis are the exact values rounded once, while pandas
+    accumulates floating point sums in the energies' order, which is not
+    kept here, so those three can differ from it in the last digits (about
+    1e-15 relative); energy_benchmark.py measures the deviation.
+
+    Args:
+        frame_size: Processed frame width (the stationary distance is 1% of it)
+        track_max_age: Seconds a person must stay within the stationary distance
+            to count as standing still
+    """
+
+    def __init__(self, frame_size, track_max_age=3):
+        self.frame_size = frame_size
+        self.track_max_age = track_max_age
+        self.time_steps = None
+        self.n = 0
+        self.sums = [0, 0, 0, 0]
+        self.min = None
+        self.max = None
+        self.exact_counts = np.zeros(EXACT_ENERGY_LIMIT, dtype=np.int64)
+        # Log bucket -> {"count", "sums", "min", "max", "values": {energy: count} or None}
+        self.buckets = {}
+
+    @property
+    def started(self):
+        return self.time_steps is not None
+
+    def set_time_step(self, time_steps):
+        """Seconds between two recorded positions (DATA_RECORD_FRAME / VID_FPS); tracks are ignored until it is set."""
+        self.time_steps = time_steps
+        self.stationary_time = ceil(self.track_max_age / time_steps)
+        self.stationary_distance = self.frame_size * 0.01
+
+    def add_track(self, points):
+        """Fold the energies of an expired track's (x, y) points into the stats."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.add_tracks(points, np.array([0, len(points)]))
+
+    def add_tracks(self, points, offsets):
+        """Fold the energies of several tracks, as a ragged array (see ragged_points), into the stats."""
+        if not self.started:
+            return
+        self.add(track_set_energies(points, offsets, self.time_steps, self.stationary_time,
+                                    self.stationary_distance))
+
+    def add(self, energies):
+        energies = np.asarray(energies, dtype=np.int64)
+        if not len(energies):
+            return
+        values, counts = np.unique(energies, return_counts=True)
+        self.sums = [total + s for total, s in zip(self.sums, _power_sums(values, counts))]
+        self.n += len(energies)
+        self.min = int(values[0]) if self.min is None else min(self.min, int(values[0]))
+        self.max = int(values[-1]) if self.max is None else max(self.max, int(values[-1]))
+
+        exact = values < EXACT_ENERGY_LIMIT
+        self.exact_counts[values[exact]] += counts[exact]
+        for value, count in zip(values[~exact].tolist(), counts[~exact].tolist()):
+            bucket = int(log(value) / log(1 + ENERGY_BUCKET_ACCURACY))
+            _fold_bucket(self.buckets, bucket, count, [count * value ** k for k in (1, 2, 3, 4)], value, value,
+                         {value: count})
+
+    def merge(self, other):
+        """Add the energies counted by another accumulator (e.g. one restored from a checkpoint)."""
+        if other.n:
+            self.sums = [total + s for total, s in zip(self.sums, other.sums)]
+            self.n += other.n
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.exact_counts += other.exact_counts
+        for bucket, entry in other.buckets.items():
+            _fold_bucket(self.buckets, bucket, entry["count"], entry["sums"], entry["min"], entry["max"],
+                         entry["values"])
+        if other.started and not self.started:
+            self.set_time_step(other.time_steps)
+
+    def live(self):
+        """Running summary for progress updates."""
+        if not self.n:
+            return None
+        mean, m2, m3, m4 = _central_moments(self.n, self.sums)
+        return {
+            "count": self.n,
+            "mean": round(mean, 2),
+            "std": round(_std(self.n, m2), 2),
+            "skew": round(_skew(self.n, m2, m3), 4),
+            "kurtosis": round(_kurtosis(self.n, m2, m4), 4),
+            "acceptable_energy": int(mean ** 1.05)
+        }
+
+    def stats(self):
+        """(original_stats, cleaned_stats) as describe_energies returns them, or (None, None) without energies."""
+        if not self.n:
+            return None, None
+        values, counts, blocks = self._histogram()
+        mean, m2, m3, m4 = _central_moments(self.n, self.sums)
+        original_stats = {
+            "kurtosis": _kurtosis(self.n, m2, m4),
+            "skew": _skew(self.n, m2, m3),
+            "mean": mean,
+            "std": _std(self.n, m2),
+            "min": float(self.min),
+            "max": float(self.max),
+            **_quartiles(values, counts, blocks),
+            "acceptable_energy": int(mean ** 1.05)
+        }
+
+        # Cleaning outliers (replicates the while-loop of abnormal_data_process.py on the histogram)
+        n, sums = self.n, self.sums
+        skew, kurtosis = original_stats["skew"], original_stats["kurtosis"]
+        iter_count = 0
+        while skew > CLEAN_MAX_SKEW and iter_count < CLEAN_MAX_ITERATIONS:
+            cutoff = 3 * np.sqrt(m2 / n)
+            keep = np.abs(values - mean) < cutoff
+            values, counts = values[keep], counts[keep]
+            blocks = [block for block in blocks if _keep_block(block, mean, cutoff)]
+            iter_count += 1
+            n = int(counts.sum()) + sum(block["count"] for block in blocks)
+            if not n: break
+            sums = _power_sums(values, counts)
+            for block in blocks:
+                sums = [total + s for total, s in zip(sums, block["sums"])]
+            mean, m2, m3, m4 = _central_moments(n, sums)
+            skew, kurtosis = _skew(n, m2, m3), _kurtosis(n, m2, m4)
+
+        if n:
+            lows = ([int(values[0])] if len(values) else []) + [block["min"] for block in blocks]
+            highs = ([int(values[-1])] if len(values) else []) + [block["max"] for block in blocks]
+            cleaned_stats = {
+                "kurtosis": kurtosis,
+                "skew": skew,
+                "mean": mean,
+                "std": _std(n, m2),
+                "min": float(min(lows)),
+                "max": float(max(highs)),
+                **_quartiles(values, counts, blocks),
+                "acceptable_energy": int(mean ** 1.05),
+                "outliers_removed": int(self.n - n)
+            }
+        else:
+            cleaned_stats = {key: 0 for key in original_stats}
+            cleaned_stats["outliers_removed"] = int(self.n)
+        return original_stats, cleaned_stats
+
+    def _histogram(self):
+        """
+        Distinct energies in ascending order and their counts, plus the log
+        buckets that no longer hold their energies (kept as summaries).
+        """
+        exact = np.flatnonzero(self.exact_counts)
+        values, counts = [exact], [self.exact_counts[exact]]
+        blocks = []
+        for bucket in sorted(self.buckets):
+            entry = self.buckets[bucket]
+            if entry["values"] is None:
+                blocks.append({**entry, "bucket": bucket})
+            else:
+                energies = sorted(entry["values"])
+                values.append(energies)
+                counts.append([entry["values"][v] for v in energies])
+        return np.concatenate(values).astype(np.int64), np.concatenate(counts).astype(np.int64), blocks
+
+
+def _fold_bucket(buckets, bucket, count, sums, low, high, values):
+    """Add `count` energies with power sums `sums` between `low` and `high` to a log bucket."""
+    entry = buckets.get(bucket)
+    if entry is None:
+        entry = buckets[bucket] = {"count": 0, "sums": [0, 0, 0, 0], "min": low, "max": high, "values": {}}
+    entry["count"] += count
+    entry["sums"] = [total + s for total, s in zip(entry["sums"], sums)]
+    entry["min"], entry["max"] = min(entry["min"], low), max(entry["max"], high)
+    if entry["values"] is None or values is None:
+        entry["values"] = None
+        return
+    for value, value_count in values.items():
+        entry["values"][value] = entry["values"].get(value, 0) + value_count
+    if len(entry["values"]) > BUCKET_MAX_VALUES:
+        entry["values"] = None
+
+
+def _keep_block(block, mean, cutoff):
+    """Whether a summarized log bucket survives a trimming step (kept whole by its mean if it straddles a cutoff)."""
+    low_in, high_in = abs(block["min"] - mean) < cutoff, abs(block["max"] - mean) < cutoff
+    if low_in and high_in:
+        return True
+    if (not high_in and block["max"] < mean) or (not low_in and block["min"] > mean):
+        return False
+    return abs(block["sums"][0] / block["count"] - mean) < cutoff
+
+
+def _quartiles(values, counts, blocks):
+    """q1, q2 and q3 over exact energies and summarized log buckets (placed at their midpoint)."""
+    if blocks:
+        growth = log(1 + ENERGY_BUCKET_ACCURACY)
+        midpoints = [min(max(round(exp((block["bucket"] + 0.5) * growth)), block["min"]), block["max"])
+                     for block in blocks]
+        values = np.concatenate([values, midpoints]).astype(np.int64)
+        counts = np.concatenate([counts, [block["count"] for block in blocks]]).astype(np.int64)
+        order = np.argsort(values, kind="stable")
+        values, counts = values[order], counts[order]
+    return {
+        "q1": _quantile(values, counts, 0.25),
+        "q2": _quantile(values, counts, 0.50),
+        "q3": _quantile(values, counts, 0.75)
     }
-    
+
+
+def _power_sums(values, counts):
+    """Sums of the 1st to 4th powers of integer values with multiplicities, as exact Python integers."""
+    values, counts = values.tolist(), counts.tolist()
+    return [sum(c * v ** k for v, c in zip(values, counts)) for k in (1, 2, 3, 4)]
+
+
+def _central_moments(n, sums):
+    """Mean and the summed 2nd to 4th powers of the deviations, each rounded to float once."""
+    s1, s2, s3, s4 = sums
+    m2 = Fraction(n * s2 - s1 ** 2, n)
+    m3 = Fraction(n ** 2 * s3 - 3 * n * s1 * s2 + 2 * s1 ** 3, n ** 2)
+    m4 = Fraction(n ** 3 * s4 - 4 * n ** 2 * s1 * s3 + 6 * n * s1 ** 2 * s2 - 3 * s1 ** 4, n ** 3)
+    return s1 / n, float(m2), float(m3), float(m4)
+
+
+# Sample statistics with the bias corrections pandas applies
+def _std(n, m2):
+    return float(np.sqrt(m2 / (n - 1))) if n > 1 else float("nan")
+
+
+def _skew(n, m2, m3):
+    if n < 3:
+        return float("nan")
+    if m2 == 0:
+        return 0.0
+    return float(n * (n - 1) ** 0.5 / (n - 2) * (m3 / m2 ** 1.5))
+
+
+def _kurtosis(n, m2, m4):
+    if n < 4:
+        return float("nan")
+    if m2 == 0:
+        return 0.0
+    adjustment = 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+    return float(n * (n + 1) * (n - 1) * m4 / ((n - 2) * (n - 3) * m2 ** 2) - adjustment)
+
+
+def _quantile(values, counts, q):
+    """Quantile with linear interpolation between ranks (pandas' default) over a histogram."""
+    position = (int(counts.sum()) - 1) * q
+    cumulative = np.cumsum(counts)
+    low = int(np.floor(position))
+    lower = values[np.searchsorted(cumulative, low, side="right")]
+    upper = values[np.searchsorted(cumulative, min(low + 1, cumulative[-1] - 1), side="right")]
+    return float(lower + (upper - lower) * (position - low))
+
+
+def describe_energies(energies):
+    """(original_stats, cleaned_stats) of a list of energies, computed with pandas as abnormal_data_process.py does."""
+    def describe(df):
+        return {
+            "kurtosis": float(df.kurtosis().iloc[0]),
+            "skew": float(df.skew().iloc[0]),
+            "mean": float(df.Energy.mean()),
+            "std": float(df.Energy.std()),
+            "min": float(df.Energy.min()),
+            "max": float(df.Energy.max()),
+            "q1": float(df.Energy.quantile(0.25)),
+            "q2": float(df.Energy.quantile(0.50)),
+            "q3": float(df.Energy.quantile(0.75)),
+            "acceptable_energy": int(df.Energy.mean() ** 1.05)
+        }
+
+    df = pd.DataFrame({'Energy': pd.Series(energies)})
+    original_stats = describe(df)
+
     # Cleaning outliers (replicates while-loop logic)
     cleaned_df = df.copy()
     iter_count = 0
-    while cleaned_df.skew().iloc[0] > 7.5 and iter_count < 10:
+    while cleaned_df.skew().iloc[0] > CLEAN_MAX_SKEW and iter_count < CLEAN_MAX_ITERATIONS:
         energies_ser = cleaned_df.Energy
         cleaned_df = cleaned_df[abs(energies_ser - np.mean(energies_ser)) < 3 * np.std(energies_ser)]
         iter_count += 1
         if cleaned_df.empty: break
-        
-    cleaned_stats = {
-        "kurtosis": float(cleaned_df.kurtosis().iloc[0]) if not cleaned_df.empty else 0,
-        "skew": float(cleaned_df.skew().iloc[0]) if not cleaned_df.empty else 0,
-        "mean": float(cleaned_df.Energy.mean()) if not cleaned_df.empty else 0,
-        "std": float(cleaned_df.Energy.std()) if not cleaned_df.empty else 0,
-        "min": float(cleaned_df.Energy.min()) if not cleaned_df.empty else 0,
-        "max": float(cleaned_df.Energy.max()) if not cleaned_df.empty else 0,
-        "q1": float(cleaned_df.Energy.quantile(0.25)) if not cleaned_df.empty else 0,
-        "q2": float(cleaned_df.Energy.quantile(0.50)) if not cleaned_df.empty else 0,
-        "q3": float(cleaned_df.Energy.quantile(0.75)) if not cleaned_df.empty else 0,
-        "acceptable_energy": int(cleaned_df.Energy.mean() ** 1.05) if not cleaned_df.empty else 0,
-        "outliers_removed": int(len(df) - len(cleaned_df))
-    }
-    
+
+    cleaned_stats = {key: 0 for key in original_stats} if cleaned_df.empty else describe(cleaned_df)
+    cleaned_stats["outliers_removed"] = int(len(df) - len(cleaned_df))
     return original_stats, cleaned_stats
+
+
+def calculate_abnormal_stats(movement_data, vid_fps, data_record_frame, frame_size, track_max_age=3):
+    """
+    Computes abnormal activity statistics from movement data in memory.
+    Replicates logic from abnormal_data_process.py without writing to disk;
+    the energies come in the loop's order, so the stats are bit-identical to it.
+
+    Sessions processed in one pass get these stats online instead (AbnormalEnergyStats).
+    """
+    if not movement_data or vid_fps <= 0:
+        return None, None
+
+    time_steps = data_record_frame / vid_fps
+    # record format: {"track_id", "entry", "exit", "trajectory"} (see video_process._record_movement_data)
+    points, offsets = ragged_points([record_rows(record)[:, :2] for record in movement_data])
+    energies = track_set_energies(points, offsets, time_steps, ceil(track_max_age / time_steps), frame_size * 0.01)
+    if not len(energies):
+        return None, None
+    return describe_energies(energies)
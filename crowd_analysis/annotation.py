@@ -0,0 +1,67 @@
+import cv2
+from colors import RGB_COLORS
+from config import SHOW_DETECT, SHOW_VIOLATION_COUNT, SHOW_TRACKING_ID
+
+def render_frame(frame, record):
+	"""Draw the detection boxes and on-screen warnings of an analysed frame.
+
+	- frame: OpenCV image the record was computed on (drawn in place)
+	- record: frame analytics record built by video_process
+
+	Only called when something consumes the annotated image (live preview,
+	abnormal frame upload, output video or the local display window).
+	"""
+	restricted_entry = record["restricted_entry"]
+
+	for person in record["people"]:
+		[x, y, w, h] = person["bbox"]
+		# If restrited entry is on, draw red boxes around each detection
+		if restricted_entry:
+			cv2.rectangle(frame, (x + 5 , y + 5 ), (w - 5, h - 5), RGB_COLORS["red"], 5)
+
+		# Draw yellow boxes for detection with social distance violation, green boxes for no violation
+		# Place a number of violation count on top of the box
+		if person["violating"]:
+			cv2.rectangle(frame, (x, y), (w, h), RGB_COLORS["yellow"], 2)
+			if SHOW_VIOLATION_COUNT:
+				cv2.putText(frame, str(person["violations"]), (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, RGB_COLORS["yellow"], 2)
+		elif SHOW_DETECT and not restricted_entry:
+			cv2.rectangle(frame, (x, y), (w, h), RGB_COLORS["green"], 2)
+			if SHOW_VIOLATION_COUNT:
+				cv2.putText(frame, str(person["violations"]), (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, RGB_COLORS["green"], 2)
+
+		if SHOW_TRACKING_ID:
+			cv2.putText(frame, str(person["track_id"]), (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, RGB_COLORS["green"], 2)
+
+	warnings = record["warnings"]
+
+	# Display violation warning and count on screen
+	if warnings["violation"]:
+		text = "Violation count: {}".format(record["violate_count"])
+		cv2.putText(frame, text, (200, frame.shape[0] - 30),
+			cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
+
+	# Display restricted entry warning on screen
+	if warnings["restricted_entry"]:
+		cv2.putText(frame, "RESTRICTED ENTRY", (200, 100),
+			cv2.FONT_HERSHEY_SIMPLEX, 1, RGB_COLORS["red"], 3)
+
+	# Draw blue boxes over the the abnormally behave detection if abnormal activity detected
+	if record["abnormal_activity"]:
+		for person in record["people"]:
+			if person["abnormal"]:
+				[x, y, w, h] = person["bbox"]
+				cv2.rectangle(frame, (x , y ), (w, h), RGB_COLORS["blue"], 5)
+
+	# Display abnormal activity warning on screen
+	if warnings["abnormal"]:
+		cv2.putText(frame, "ABNORMAL ACTIVITY", (130, 250),
+			cv2.FONT_HERSHEY_SIMPLEX, 1.5, RGB_COLORS["blue"], 5)
+
+	# Display crowd count on screen
+	if SHOW_DETECT:
+		text = "Crowd count: {}".format(record["human_count"])
+		cv2.putText(frame, text, (10, 30),
+			cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 3)
+
+	return frame
@@ -0,0 +1,86 @@
+"""
+Processing checkpoints.
+
+While a video is processed, video_process periodically pickles everything
+it needs to continue: the capture position, the frame counter, the tracker
+(tracks with their Kalman state, the appearance gallery and the next track
+id), the movement data of expired tracks and the overlay and timing
+accumulators. When the job is run again after a crash, processing resumes
+from the checkpoint instead of frame 0.
+
+Frame documents are flushed to MongoDB before a checkpoint is written, and
+no checkpoint is written while some of them are only in the local spool.
+On resume every stored frame up to the checkpoint is kept and the frames
+after it (written before the crash) are deleted and recomputed, once the
+spool has been replayed.
+"""
+import os
+import pickle
+import time
+from config import CHECKPOINT_DIR, CHECKPOINT_INTERVAL
+
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def checkpoint_path(session_id):
+    """Checkpoint file of a session, or None when checkpoints are disabled."""
+    if not CHECKPOINT_DIR or not session_id:
+        return None
+    return os.path.join(_script_dir, CHECKPOINT_DIR, f"{session_id}.pkl")
+
+
+def remove_checkpoint(session_id):
+    path = checkpoint_path(session_id)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class Checkpointer:
+    """
+    Writes the checkpoints of one session every `interval` seconds.
+
+    Args:
+        path: Checkpoint file (from checkpoint_path())
+        interval: Seconds between checkpoints
+        before_save: Called before a checkpoint is written (flushes frame
+            writes); the checkpoint is skipped when it returns False
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL, before_save=None):
+        self.path = path
+        self.interval = interval
+        self.before_save = before_save
+        self._last = time.monotonic()
+
+    def load(self):
+        """The last checkpoint, or None if there is none (or it cannot be read)."""
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+
+    def due(self):
+        return time.monotonic() - self._last >= self.interval
+
+    def save(self, state):
+        """Write `state` as the session's checkpoint; returns False if before_save refused it."""
+        if self.before_save is not None and self.before_save() is False:
+            print(f"Skipping checkpoint {self.path}: frame writes are not stored yet")
+            self._last = time.monotonic()
+            return False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write then rename, so a crash while saving leaves the previous checkpoint intact
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+        self._last = time.monotonic()
+        return True
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -18,6 +18,14 @@ YOLO_CONFIG = {
 SHOW_PROCESSING_OUTPUT = False
 # Show individuals detected
 SHOW_DETECT = True
+# Save annotated output video to this path (None to disable)
+OUTPUT_VIDEO = None
+# Live preview frame rate (frames per second sent to viewers)
+PREVIEW_FPS = 5
+# Live preview max width (pixels)
+PREVIEW_WIDTH = 800
+# Live preview JPEG quality
+PREVIEW_JPEG_QUALITY = 85
 # Data record
 DATA_RECORD = True
 # Data record rate (data record per frame)
@@ -51,6 +59,25 @@ NMS_THRESH = 0.2
 FRAME_SIZE = 1080
 # Tracker max missing age before removing (seconds)
 TRACK_MAX_AGE = 3
+# Tracker max appearance (cosine) distance for matching a detection to a track
+MAX_COSINE_DISTANCE = 0.7
+# Continuous (live stream) mode: trail points kept in memory per track, older points are written out
+MAX_TRAIL_POINTS = 300
+# Continuous mode: appearance features the tracker keeps per track
+CONTINUOUS_NN_BUDGET = 100
+# Store stationary runs of a trajectory (points within this many pixels of the run's first point)
+# as one point with a dwell count when a track expires (None to store every point). 0 only collapses
+# exact repeats (lossless); a few pixels also drops standing jitter, which shrinks loiterer tracks
+# by an order of magnitude but lowers the low end of the abnormal energy stats computed from stored tracks
+# (segmented sessions); their stats document records the tolerance
+TRAJECTORY_SIMPLIFY_TOLERANCE = None
+# Keep per-frame detections and ReID features under this directory (e.g. "processed_data/detection_cache")
+# so sessions can be replayed with other thresholds without inference (None to disable)
+DETECTION_CACHE_DIR = None
+# Save processing checkpoints under this directory so a failed job resumes where it stopped (None to disable)
+CHECKPOINT_DIR = "processed_data/checkpoints"
+# Seconds of processing between two checkpoints
+CHECKPOINT_INTERVAL = 60
 # Speed threshold for fast motion detection (pixels per time step)
 # Normal walking speed is typically below this threshold
 SPEED_THRESHOLD = 10.0
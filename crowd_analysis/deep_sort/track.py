@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+from .trajectory import Trajectory
 
 
 class TrackState:
@@ -41,6 +42,8 @@ class Track:
     feature : Optional[ndarray]
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
+    frame : int
+        Frame number of the detection this track originates from.
 
     Attributes
     ----------
@@ -65,7 +68,7 @@ class Track:
     """
 
     def __init__(self, mean, covariance, track_id, entry, position, n_init, 
-        max_age, feature=None):
+        max_age, feature=None, frame=0):
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
@@ -81,8 +84,12 @@ class Track:
         self._n_init = n_init
         self._max_age = max_age
 
-        # Movement trails, recorded by centroids
-        self.positions = [position]
+        # Movement trails, recorded by centroids and the frames they were seen at
+        self.positions = Trajectory()
+        self.positions.append(position, frame)
+        # Older trail points already written out by a TrackSink (continuous mode)
+        self.spilled_points = 0
+        self.spilled_parts = 0
 
         # Initial detection
         self.entry = entry
@@ -131,7 +138,7 @@ class Track:
         self.age += 1
         self.time_since_update += 1
 
-    def update(self, kf, detection):
+    def update(self, kf, detection, frame=0):
         """Perform Kalman filter measurement update step and update the feature
         cache.
 
@@ -141,12 +148,14 @@ class Track:
             The Kalman filter.
         detection : Detection
             The associated detection.
+        frame : int
+            Frame number of the detection.
 
         """
         self.mean, self.covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
         self.features.append(detection.feature)
-        self.positions.append(detection.centroid)
+        self.positions.append(detection.centroid, frame)
 
         self.hits += 1
         self.time_since_update = 0
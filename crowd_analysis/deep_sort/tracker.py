@@ -55,13 +55,17 @@ class Tracker:
         for track in self.tracks:
             track.predict(self.kf)
 
-    def update(self, detections, time):
+    def update(self, detections, time, frame=0):
         """Perform measurement update and track management.
 
         Parameters
         ----------
         detections : List[deep_sort.detection.Detection]
             A list of detections at the current time step.
+        time
+            Timestamp recorded as the entry and exit time of tracks.
+        frame : int
+            Frame number stored with the trajectory points.
 
         """
         # Run matching cascade.
@@ -69,11 +73,11 @@ class Tracker:
 
         # Update track set.
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(self.kf, detections[detection_idx])
+            self.tracks[track_idx].update(self.kf, detections[detection_idx], frame)
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
         for detection_idx in unmatched_detections:
-            self._initiate_track(detections[detection_idx], time)
+            self._initiate_track(detections[detection_idx], time, frame)
         expired = []
         for t in self.tracks:
             if t.is_recorded():
@@ -135,9 +139,9 @@ class Tracker:
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
-    def _initiate_track(self, detection, time):
+    def _initiate_track(self, detection, time, frame=0):
         mean, covariance = self.kf.initiate(detection.to_xyah())
         self.tracks.append(Track(
             mean, covariance, self._next_id, time, detection.centroid, self.n_init, 
-            self.max_age, detection.feature))
+            self.max_age, detection.feature, frame))
         self._next_id += 1
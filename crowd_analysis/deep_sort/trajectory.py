@@ -0,0 +1,237 @@
+# vim: expandtab:ts=4:sw=4
+import zlib
+import numpy as np
+
+# Rows are (x, y, frame)
+TRAJECTORY_COLUMNS = 3
+INITIAL_CAPACITY = 16
+COMPRESSION_LEVEL = 6
+
+
+class Trajectory:
+    """
+    Movement trail of a track: a growable int32 array of centroid positions
+    and the frames they were observed at.
+
+    Indexing and len() work on the positions, so `trajectory[-1]` is the
+    latest (x, y) centroid. Capacity doubles as points are appended.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of points allocated up front.
+
+    """
+
+    __slots__ = ("_rows", "_size")
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._rows = np.empty((max(capacity, 1), TRAJECTORY_COLUMNS), dtype=np.int32)
+        self._size = 0
+
+    def append(self, position, frame):
+        if self._size == len(self._rows):
+            self._resize(2 * len(self._rows))
+        row = self._rows[self._size]
+        row[0], row[1] = position[0], position[1]
+        row[2] = frame
+        self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        return self.points[index]
+
+    @property
+    def rows(self):
+        """(N, 3) view of the (x, y, frame) rows."""
+        return self._rows[:self._size]
+
+    @property
+    def points(self):
+        """(N, 2) view of the centroid positions."""
+        return self._rows[:self._size, :2]
+
+    @property
+    def frames(self):
+        """(N,) view of the frame numbers."""
+        return self._rows[:self._size, 2]
+
+    @property
+    def nbytes(self):
+        return self._rows.nbytes
+
+    def spill(self, keep):
+        """Remove all but the last `keep` points and return the removed rows."""
+        split = max(self._size - keep, 0)
+        spilled = self._rows[:split].copy()
+        tail = self._rows[split:self._size].copy()
+        self._rows = np.empty((max(2 * len(tail), INITIAL_CAPACITY), TRAJECTORY_COLUMNS), dtype=np.int32)
+        self._rows[:len(tail)] = tail
+        self._size = len(tail)
+        return spilled
+
+    def _resize(self, capacity):
+        rows = np.empty((capacity, TRAJECTORY_COLUMNS), dtype=np.int32)
+        rows[:self._size] = self._rows[:self._size]
+        self._rows = rows
+
+
+def encode_trajectory(rows):
+    """
+    Serialize (x, y, frame) rows as zlib-compressed, delta-encoded int32 columns.
+
+    Consecutive points differ by a few pixels and frames, so the deltas are
+    mostly small numbers that compress to a byte or two per point.
+
+    Parameters
+    ----------
+    rows : array_like
+        (N, 3) integer array of (x, y, frame) rows, or (N, 4) with the dwell
+        counts of a simplified trajectory.
+
+    Returns
+    -------
+    bytes
+        The encoded trajectory.
+
+    """
+    rows = np.asarray(rows, dtype=np.int32)
+    deltas = np.diff(rows, axis=0, prepend=np.zeros((1, rows.shape[1]), dtype=np.int32))
+    # Column-major, so runs of similar deltas sit next to each other
+    return zlib.compress(deltas.T.astype("<i4").tobytes(), COMPRESSION_LEVEL)
+
+
+def simplify_trajectory(rows, tolerance):
+    """
+    Collapse the stationary runs of a trajectory.
+
+    A run is a stretch of at least three points that stay within `tolerance`
+    pixels of its first point and are evenly spaced in frames. It is stored as
+    its first point, with a dwell count of the points it stands for, followed
+    by its last point. `expand_trajectory` restores every point of the run at
+    its exact frame and at most `tolerance` pixels from its original position.
+
+    Parameters
+    ----------
+    rows : ndarray
+        (N, 3) int32 array of (x, y, frame) rows.
+    tolerance : float
+        Maximum distance in pixels between a dropped point and the point
+        that replaces it.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        The kept rows and their dwell counts (1 for points that stand for
+        themselves only). The counts sum to N.
+
+    """
+    n = len(rows)
+    points = rows[:, :2].astype(np.float64)
+    steps = np.diff(rows[:, 2])
+    keep, dwell = [], []
+    start = 0
+    while start < n:
+        end = start
+        while (end + 1 < n
+               and np.hypot(*(points[end + 1] - points[start])) <= tolerance
+               and (end == start or steps[end] == steps[start])):
+            end += 1
+        if end - start >= 2:
+            keep.append(start)
+            dwell.append(end - start)
+            start = end  # The last point of the run may start the next one
+        else:
+            keep.append(start)
+            dwell.append(1)
+            start += 1
+    return rows[keep], np.asarray(dwell, dtype=np.int32)
+
+
+def expand_trajectory(rows, dwell):
+    """Inverse of `simplify_trajectory`: repeat every kept point over the frames it stands for."""
+    index = np.repeat(np.arange(len(rows)), dwell)
+    offset = np.arange(len(index)) - np.repeat(np.cumsum(dwell) - dwell, dwell)
+    next_frame = np.append(rows[1:, 2], rows[-1, 2])
+    step = (next_frame - rows[:, 2]) // dwell
+    expanded = rows[index]
+    expanded[:, 2] += (offset * step[index]).astype(np.int32)
+    return expanded
+
+
+def trajectory_fields(rows, tolerance=None):
+    """
+    Encoded trajectory plus the fields tracks are queried by: frame range,
+    number of points and bounding box of the positions.
+
+    With a `tolerance`, stationary runs are collapsed (see `simplify_trajectory`);
+    when any run was, the dwell counts are encoded as a fourth column and
+    "simplified" is set. Read the rows back with `record_rows`.
+
+    Parameters
+    ----------
+    rows : array_like
+        (N, 3) integer array of (x, y, frame) rows, N > 0.
+    tolerance : Optional[float]
+        Simplification tolerance in pixels (0 collapses exact repeats only,
+        which is lossless), None to store every point.
+
+    Returns
+    -------
+    Dict
+        trajectory, simplified, point_count, start_frame, end_frame, x_min,
+        y_min, x_max, y_max.
+
+    """
+    rows = np.asarray(rows, dtype=np.int32).reshape(-1, TRAJECTORY_COLUMNS)
+    x_min, y_min = (int(v) for v in rows[:, :2].min(axis=0))
+    x_max, y_max = (int(v) for v in rows[:, :2].max(axis=0))
+    stored = rows
+    if tolerance is not None:
+        kept, dwell = simplify_trajectory(rows, tolerance)
+        if len(kept) < len(rows):
+            stored = np.column_stack((kept, dwell))
+    return {
+        "trajectory": encode_trajectory(stored),
+        "simplified": stored is not rows,
+        "point_count": len(rows),
+        "start_frame": int(rows[0, 2]),
+        "end_frame": int(rows[-1, 2]),
+        "x_min": x_min,
+        "y_min": y_min,
+        "x_max": x_max,
+        "y_max": y_max
+    }
+
+
+def decode_trajectory(data, columns=TRAJECTORY_COLUMNS):
+    """
+    Inverse of `encode_trajectory`.
+
+    Returns
+    -------
+    ndarray
+        (N, columns) int32 array of (x, y, frame[, dwell]) rows.
+
+    """
+    deltas = np.frombuffer(zlib.decompress(data), dtype="<i4").reshape(columns, -1)
+    return np.cumsum(deltas, axis=1, dtype=np.int32).T
+
+
+def stored_rows(record):
+    """
+    The rows of a track record as written by `trajectory_fields`: (x, y, frame)
+    and, for a simplified trajectory, the dwell counts (None otherwise).
+    """
+    if record.get("simplified"):
+        rows = decode_trajectory(record["trajectory"], TRAJECTORY_COLUMNS + 1)
+        return rows[:, :TRAJECTORY_COLUMNS], rows[:, TRAJECTORY_COLUMNS]
+    return decode_trajectory(record["trajectory"]), None
+
+
+def record_rows(record):
+    """Every (x, y, frame) row of a track record, with collapsed stationary runs expanded."""
+    rows, dwell = stored_rows(record)
+    return rows if dwell is None else expand_trajectory(rows, dwell)
@@ -0,0 +1,161 @@
+"""
+Per-frame detection cache for re-analysis without inference.
+
+While a video is processed, the detections of every analyzed frame (boxes
+after non-maxima suppression, confidences, centroids and ReID features) can
+be appended to a cache directory. Replaying the cache reruns only the tracker
+and the analytics, so thresholds such as ABNORMAL_ENERGY, SOCIAL_DISTANCE,
+SPEED_THRESHOLD or the tracker's max cosine distance can be re-tuned in
+seconds. Detector settings (MIN_CONF, NMS_THRESH, FRAME_SIZE) are baked into
+the cache.
+
+Layout: one raw little-endian file per column, appended to during processing
+and opened with np.memmap for replay, plus meta.json holding the row counts.
+
+    frames.bin       frame, start, count, height, width (one row per analyzed frame)
+    boxes.bin        int32 [x, y, w, h] per detection
+    confidences.bin  float32 per detection
+    centroids.bin    int32 [cx, cy] per detection
+    features.bin     float32 ReID feature per detection
+
+Segment jobs write one cache per segment into numbered subdirectories; the
+reader chains them and skips the frames a segment re-read during warm-up.
+"""
+import json
+import os
+import numpy as np
+from config import DETECTION_CACHE_DIR
+
+CACHE_VERSION = 1
+FEATURE_DIM = 128
+
+FRAME_DTYPE = np.dtype([
+    ("frame", "<i8"), ("start", "<i8"), ("count", "<i4"), ("height", "<i4"), ("width", "<i4")
+])
+# Column name -> (dtype, values per detection)
+DETECTION_COLUMNS = {
+    "boxes": (np.dtype("<i4"), 4),
+    "confidences": (np.dtype("<f4"), 1),
+    "centroids": (np.dtype("<i4"), 2),
+    "features": (np.dtype("<f4"), FEATURE_DIM)
+}
+
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def cache_path(session_id, segment_index=None):
+    """Cache directory of a session (or of one of its segments), or None when caching is disabled."""
+    if not DETECTION_CACHE_DIR:
+        return None
+    path = os.path.join(_script_dir, DETECTION_CACHE_DIR, session_id)
+    if segment_index is not None:
+        path = os.path.join(path, f"{segment_index:04d}")
+    return path
+
+
+class CachedDetections:
+    """Detections of one analyzed frame."""
+
+    def __init__(self, boxes, confidences, centroids, features):
+        self.boxes = boxes
+        self.confidences = confidences
+        self.centroids = centroids
+        self.features = features
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+class DetectionCacheWriter:
+    """
+    Appends the detections of analyzed frames to a cache directory.
+
+    Args:
+        path: Cache directory (created, any previous cache there is overwritten)
+        fps: FPS of the source video, needed to replay TIME_STEP
+    """
+
+    def __init__(self, path, fps=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta = {"version": CACHE_VERSION, "fps": fps, "frames": 0, "detections": 0, "complete": False}
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), "wb")
+                       for name in ("frames",) + tuple(DETECTION_COLUMNS)}
+        self._write_meta()
+
+    def append(self, frame_count, frame_shape, detections):
+        row = np.zeros(1, dtype=FRAME_DTYPE)
+        row["frame"] = frame_count
+        row["start"] = self.meta["detections"]
+        row["count"] = len(detections)
+        row["height"], row["width"] = frame_shape[:2]
+        self._files["frames"].write(row.tobytes())
+        if len(detections):
+            for name, (dtype, width) in DETECTION_COLUMNS.items():
+                values = np.asarray(getattr(detections, name), dtype=dtype).reshape(len(detections), width)
+                self._files[name].write(values.tobytes())
+        self.meta["frames"] += 1
+        self.meta["detections"] += len(detections)
+
+    def close(self, complete=True):
+        """Close the column files; `complete` is False when processing stopped early."""
+        for f in self._files.values():
+            f.close()
+        self.meta["complete"] = complete
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+
+class DetectionCache:
+    """
+    Read-only view of a cache written by DetectionCacheWriter.
+
+    Iterating yields (frame, (height, width), CachedDetections) in frame order;
+    the column arrays are memory-mapped slices, nothing is loaded up front.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        parts = [path] if os.path.exists(os.path.join(path, "meta.json")) else [
+            os.path.join(path, name) for name in sorted(os.listdir(path))
+            if os.path.exists(os.path.join(path, name, "meta.json"))
+        ]
+        if not parts:
+            raise FileNotFoundError(f"No detection cache in {path}")
+        self.parts = [self._open_part(part) for part in parts]
+        self.fps = self.parts[0]["meta"]["fps"]
+        self.complete = all(part["meta"]["complete"] for part in self.parts)
+
+    @staticmethod
+    def _open_part(path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        part = {"meta": meta, "frames": _memmap(os.path.join(path, "frames.bin"), FRAME_DTYPE, meta["frames"])}
+        for name, (dtype, width) in DETECTION_COLUMNS.items():
+            part[name] = _memmap(os.path.join(path, f"{name}.bin"), dtype, meta["detections"], width)
+        return part
+
+    def __len__(self):
+        return sum(part["meta"]["frames"] for part in self.parts)
+
+    def __iter__(self):
+        last_frame = 0
+        for part in self.parts:
+            for row in part["frames"]:
+                frame = int(row["frame"])
+                if frame <= last_frame:
+                    continue  # Warm-up frames of a segment, already yielded by the previous one
+                last_frame = frame
+                start, end = int(row["start"]), int(row["start"]) + int(row["count"])
+                detections = CachedDetections(*(part[name][start:end] for name in DETECTION_COLUMNS))
+                yield frame, (int(row["height"]), int(row["width"])), detections
+
+
+def _memmap(path, dtype, rows, width=1):
+    shape = (rows, width) if width > 1 else (rows,)
+    if rows == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
@@ -0,0 +1,141 @@
+"""
+Benchmark of the energy kernels of analysis_utils against the per-track loop
+they replaced, on synthetic track sets.
+
+Tracks are random walks with stationary pauses (people stopping to talk,
+queueing) so both the moving and the stationary branches of the filter run.
+For every set size the script checks that both produce the same energies in
+the same order, so calculate_abnormal_stats, which describes them with pandas
+(describe_energies), gives bit-identical stats. It also compares the online
+stats of AbnormalEnergyStats with those and prints the timings. Min, max,
+mean, quartiles and outlier counts must be identical. Std, skew and kurtosis
+come from exact moments rounded once there, while pandas accumulates them in
+floating point in the energies' order. They may differ in the last digits,
+up to STATS_TOLERANCE relative. The largest deviation is printed.
+
+    python energy_benchmark.py --tracks 1000 5000 20000 --points 200
+"""
+import argparse
+import time
+import numpy as np
+from math import ceil
+from scipy.spatial.distance import euclidean
+from analysis_utils import AbnormalEnergyStats, ragged_points, track_set_energies, describe_energies
+
+FRAME_SIZE = 1280
+TRACK_MAX_AGE = 3
+TIME_STEP = 10 / 30  # DATA_RECORD_FRAME / VID_FPS
+# Largest relative deviation of the online stats from pandas for the stats it accumulates in floating point
+STATS_TOLERANCE = 1e-12
+ROUNDED_STATS = ("std", "skew", "kurtosis")
+
+
+def loop_energies(tracks, time_steps, stationary_time, stationary_distance):
+    """The loop of abnormal_data_process.py before the kernels."""
+    useful_tracks = []
+    for movement in tracks:
+        movement = [list(p) for p in movement]
+        check_index = stationary_time
+        start_point = 0
+        track = movement[:check_index]
+        while check_index < len(movement):
+            for i in movement[check_index:]:
+                if euclidean(movement[start_point], i) > stationary_distance:
+                    track.append(i)
+                    start_point += 1
+                    check_index += 1
+                else:
+                    start_point += 1
+                    check_index += 1
+                    break
+            useful_tracks.append(track)
+            track = movement[start_point:check_index]
+
+    energies = []
+    for movement in useful_tracks:
+        for i in range(len(movement) - 1):
+            speed = round(euclidean(movement[i], movement[i+1]) / time_steps , 2)
+            energy = int(0.5 * speed ** 2)
+            energies.append(energy)
+    return energies
+
+
+def synthetic_tracks(count, mean_points, seed=0):
+    """Random walks of about `mean_points` points that pause now and then."""
+    rng = np.random.default_rng(seed)
+    tracks = []
+    for length in rng.poisson(mean_points, count):
+        moving = rng.random(length) > 0.25
+        steps = rng.normal(0, rng.choice([2, 8, 30]), (length, 2)) * moving[:, None]
+        start = rng.integers(0, FRAME_SIZE, 2)
+        tracks.append(np.clip(start + np.cumsum(steps, axis=0).round(), 0, FRAME_SIZE).astype(np.int64))
+    return tracks
+
+
+def stats_of(energies):
+    energy_stats = AbnormalEnergyStats(FRAME_SIZE, TRACK_MAX_AGE)
+    energy_stats.set_time_step(TIME_STEP)
+    energy_stats.add(energies)
+    return energy_stats.stats()
+
+
+def stats_deviation(stats, reference):
+    """
+    Largest relative deviation of the std, skew and kurtosis in `stats` from `reference`.
+
+    Raises:
+        ValueError: If any other stat differs
+    """
+    deviation = 0.0
+    for part, expected in zip(stats, reference):
+        for key, value in expected.items():
+            if key not in ROUNDED_STATS:
+                if part[key] != value:
+                    raise ValueError(f"{key} is {part[key]}, pandas gives {value}")
+            elif value != part[key]:
+                deviation = max(deviation, abs(part[key] - value) / abs(value))
+    return deviation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--points", type=int, default=200, help="Mean points per track")
+    parser.add_argument("--skip-loop-above", type=int, default=20000,
+                        help="Only time the kernels for larger sets (the loop takes minutes)")
+    args = parser.parse_args()
+
+    stationary_time = ceil(TRACK_MAX_AGE / TIME_STEP)
+    stationary_distance = FRAME_SIZE * 0.01
+    print(f"{'tracks':>8} {'points':>10} {'energies':>10} {'loop (s)':>10} {'kernels (s)':>12} {'speedup':>8} "
+          f"{'online dev':>10}")
+    for count in args.tracks:
+        tracks = synthetic_tracks(count, args.points)
+        start = time.perf_counter()
+        points, offsets = ragged_points(tracks)
+        kernel = track_set_energies(points, offsets, TIME_STEP, stationary_time, stationary_distance)
+        kernel_time = time.perf_counter() - start
+
+        loop_time, deviation = None, None
+        if count <= args.skip_loop_above:
+            start = time.perf_counter()
+            loop = loop_energies(tracks, TIME_STEP, stationary_time, stationary_distance)
+            loop_time = time.perf_counter() - start
+            if kernel.tolist() != loop:
+                raise SystemExit(f"Energies differ for {count} tracks")
+            try:
+                deviation = stats_deviation(stats_of(kernel), describe_energies(loop))
+            except ValueError as e:
+                raise SystemExit(f"Stats differ from pandas for {count} tracks: {e}")
+            if deviation > STATS_TOLERANCE:
+                raise SystemExit(f"Stats deviate {deviation:.2e} from pandas for {count} tracks")
+
+        loop_column = "-" if loop_time is None else f"{loop_time:.2f}"
+        speedup = "-" if loop_time is None else f"{loop_time / kernel_time:.0f}x"
+        deviation_column = "-" if deviation is None else f"{deviation:.1e}"
+        print(f"{count:>8} {len(points):>10} {len(kernel):>10} {loop_column:>10} {kernel_time:>12.3f} {speedup:>8} "
+              f"{deviation_column:>10}")
+
+
+if __name__ == "__main__":
+    main()
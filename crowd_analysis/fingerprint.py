@@ -0,0 +1,54 @@
+"""
+Fingerprints used to reuse the results of identical uploads.
+
+A session can stand in for another when the uploaded bytes have the same
+content hash and the processing configuration (analysis settings of config.py
+and the model files) has the same fingerprint.
+"""
+import hashlib
+import json
+import os
+import config
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Settings that do not change the stored results (display, caches, checkpoints)
+DISPLAY_ONLY_PREFIXES = ("SHOW_", "PREVIEW_")
+DISPLAY_ONLY_KEYS = ("OUTPUT_VIDEO", "DETECTION_CACHE_DIR", "CHECKPOINT_DIR", "CHECKPOINT_INTERVAL")
+
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILES = (
+    config.YOLO_CONFIG["WEIGHTS_PATH"],
+    config.YOLO_CONFIG["CONFIG_PATH"],
+    "model_data/mars-small128.pb"
+)
+
+_fingerprint = None
+
+
+def hash_file(path):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def processing_fingerprint():
+    """SHA-256 of the analysis settings and model files (computed once per process)."""
+    global _fingerprint
+    if _fingerprint is not None:
+        return _fingerprint
+
+    settings = {
+        key: value for key, value in vars(config).items()
+        if key.isupper() and not key.startswith(DISPLAY_ONLY_PREFIXES) and key not in DISPLAY_ONLY_KEYS
+    }
+    settings["VIDEO_CONFIG"] = {k: v for k, v in config.VIDEO_CONFIG.items() if k != "VIDEO_CAP"}
+
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode())
+    for relative_path in MODEL_FILES:
+        path = os.path.join(_script_dir, relative_path)
+        digest.update(hash_file(path).encode() if os.path.exists(path) else b"missing")
+    _fingerprint = digest.hexdigest()
+    return _fingerprint
@@ -1,4 +1,4 @@
-from config import YOLO_CONFIG, VIDEO_CONFIG, SHOW_PROCESSING_OUTPUT, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE
+from config import YOLO_CONFIG, VIDEO_CONFIG, SHOW_PROCESSING_OUTPUT, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE, OUTPUT_VIDEO, MAX_COSINE_DISTANCE
 
 if FRAME_SIZE > 1920:
 	print("Frame size is too large!")
@@ -15,7 +15,7 @@ import cv2
 import os
 import csv
 import json
-from video_process import video_process
+from video_process import video_process, RunHooks
 from deep_sort import nn_matching
 from deep_sort.detection import Detection
 from deep_sort.tracker import Tracker
@@ -41,7 +41,7 @@ ln = net.getLayerNames()
 ln = [ln[i - 1] for i in net.getUnconnectedOutLayers()]
 
 # Tracker parameters
-max_cosine_distance = 0.7
+max_cosine_distance = MAX_COSINE_DISTANCE
 nn_budget = None
 
 #initialize deep sort object
@@ -71,11 +71,35 @@ crowd_data_writer = csv.writer(crowd_data_file)
 movement_data_writer.writerow(['Track ID', 'Entry time', 'Exit Time', 'Movement Tracks'])
 crowd_data_writer.writerow(['Time', 'Human Count', 'Social Distance violate', 'Restricted Entry', 'Abnormal Activity'])
 
+# Annotated output video is only written (and drawn) when requested
+video_writer = None
+if OUTPUT_VIDEO:
+	# Only every DATA_RECORD_FRAME-th frame is processed, so the output plays at DATA_RECORD_RATE
+	output_fps = VIDEO_CONFIG["CAM_APPROX_FPS"] if IS_CAM else DATA_RECORD_RATE
+
+	class _LazyVideoWriter:
+		# Frame size is only known after the first resize in video_process
+		def __init__(self):
+			self.writer = None
+		def write(self, frame):
+			if self.writer is None:
+				h, w = frame.shape[:2]
+				self.writer = cv2.VideoWriter(OUTPUT_VIDEO, cv2.VideoWriter_fourcc(*"mp4v"), output_fps, (w, h))
+			self.writer.write(frame)
+		def release(self):
+			if self.writer is not None:
+				self.writer.release()
+
+	video_writer = _LazyVideoWriter()
+
 START_TIME_TS = time.time()
 
 # Run the process with local writers for standalone testing
-processing_FPS, _ = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, movement_data_writer, crowd_data_writer)
+processing_FPS, _ = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, movement_data_writer, crowd_data_writer,
+	hooks=RunHooks(video_writer=video_writer))
 cv2.destroyAllWindows()
+if video_writer is not None:
+	video_writer.release()
 
 movement_data_file.close()
 crowd_data_file.close()
@@ -11,13 +11,20 @@ import subprocess
 import pandas as pd
 from math import ceil
 from scipy.spatial.distance import euclidean
-from video_process import video_process
+from video_process import video_process, RunHooks
 from deep_sort import nn_matching
 from deep_sort.detection import Detection
 from deep_sort.tracker import Tracker
 from deep_sort import generate_detections as gdet
-from config import YOLO_CONFIG, VIDEO_CONFIG, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE
-from analysis_utils import calculate_abnormal_stats
+from config import YOLO_CONFIG, VIDEO_CONFIG, DATA_RECORD_RATE, FRAME_SIZE, TRACK_MAX_AGE, MAX_COSINE_DISTANCE, \
+    CONTINUOUS_NN_BUDGET, TRAJECTORY_SIMPLIFY_TOLERANCE
+from analysis_utils import calculate_abnormal_stats, AbnormalEnergyStats
+from preview_encoder import PreviewEncoder
+from segments import SegmentCapture, TrackSnapshotter, merge_segment_results
+from streaming_capture import open_capture
+from detection_cache import DetectionCache, DetectionCacheWriter, cache_path
+from checkpoint import Checkpointer, checkpoint_path
+from track_sink import TrackSink
 
 # Try to import db, but don't fail if we are running standalone
 try:
@@ -25,16 +32,19 @@ try:
     import os
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "apis")))
     from db import db
+    from frame_uploader import frame_uploader
 except ImportError:
     db = None
+    frame_uploader = None
 
-def run_processing(video_path, session_id=None, callback=None):
+# Longest wait for pending abnormal frame uploads when a video finishes (seconds)
+UPLOAD_DRAIN_TIMEOUT = 120
+
+def load_models():
+    """Load the YOLO network and the Deep SORT box encoder (done once per worker)."""
     # Get the directory of this script to resolve paths
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
-    # Override video path from config
-    cap = cv2.VideoCapture(video_path)
-    
     # Load YOLO weights and config using absolute paths
     WEIGHTS_PATH = os.path.join(script_dir, YOLO_CONFIG["WEIGHTS_PATH"])
     CONFIG_PATH = os.path.join(script_dir, YOLO_CONFIG["CONFIG_PATH"])
@@ -46,24 +56,149 @@ def run_processing(video_path, session_id=None, callback=None):
     ln = net.getLayerNames()
     ln = [ln[i - 1] for i in net.getUnconnectedOutLayers()]
     
-    max_cosine_distance = 0.7
-    nn_budget = None
-    
+    model_filename = os.path.join(script_dir, 'model_data/mars-small128.pb')
+    encoder = gdet.create_box_encoder(model_filename, batch_size=1)
+    return net, ln, encoder
+
+def create_tracker(max_cosine_distance=MAX_COSINE_DISTANCE, nn_budget=None):
+    """Create a fresh Deep SORT tracker for one video (nn_budget caps the ReID samples kept per track)."""
     max_age = DATA_RECORD_RATE * TRACK_MAX_AGE
     if max_age > 30:
         max_age = 30
         
-    model_filename = os.path.join(script_dir, 'model_data/mars-small128.pb')
-    encoder = gdet.create_box_encoder(model_filename, batch_size=1)
     metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-    tracker = Tracker(metric, max_age=max_age)
+    return Tracker(metric, max_age=max_age)
+
+def run_processing(video_path, session_id=None, callback=None, preview_sink=None, has_preview_subscribers=None,
+                   models=None, should_stop=None, continuous=False):
+    """
+    Process a video and store its results in MongoDB.
+
+    Args:
+        video_path: Path of the video to process
+        session_id: Session the frame data is stored under
+        callback: Receives per-frame metrics (JSON-serialisable dict)
+        preview_sink: Receives live preview JPEG bytes; no preview is encoded when None
+        has_preview_subscribers: Returns True while someone watches the preview
+        models: (net, ln, encoder) from load_models(); loaded here when None
+        should_stop: Returns True to stop processing early (job cancellation)
+        continuous: Process a live stream with bounded memory: tracks are
+            written to the tracks collection as they expire (see track_sink.py)
+            and no checkpoint or detection cache is kept
+
+    If an earlier run of the session left a checkpoint (see checkpoint.py),
+    processing resumes from it.
+
+    Returns:
+        Stage timings measured by video_process (frames_read, frames_analyzed,
+        decode_seconds, total_seconds)
+    """
+    # Override video path from config; a video still being uploaded is followed as it grows
+    cap = open_capture(video_path, should_stop)
+    
+    net, ln, encoder = models or load_models()
+    # Abnormal energy stats are kept up to date as tracks expire
+    energy_stats = AbnormalEnergyStats(FRAME_SIZE, TRACK_MAX_AGE)
+    if continuous:
+        tracker = create_tracker(nn_budget=CONTINUOUS_NN_BUDGET)
+        track_sink = TrackSink(_track_writer(session_id), energy_stats=energy_stats)
+        checkpointer, resume, detection_cache = None, None, None
+    else:
+        tracker = create_tracker()
+        track_sink = None
+        checkpointer, resume = _open_checkpoint(session_id)
+        # A resumed run would only cache the frames after the checkpoint
+        detection_cache = _open_detection_cache(cap, session_id) if resume is None else None
     
     # Stop creating local folders and CSVs. 
     # video_process now returns VID_FPS and collected_movement_data
-    vid_fps, movement_data = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, None, None, callback, session_id)
+    preview = PreviewEncoder(preview_sink, has_preview_subscribers) if preview_sink else None
+    timings = {}
+    hooks = RunHooks(preview=preview, should_stop=should_stop, timings=timings, detection_cache=detection_cache,
+        checkpointer=checkpointer, resume=resume, track_sink=track_sink, energy_stats=energy_stats)
+    try:
+        vid_fps, movement_data = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, None, None, callback, session_id, hooks)
+    except Exception:
+        _release_session_writes(session_id)
+        raise
+    finally:
+        if preview:
+            preview.close()
+        if detection_cache:
+            detection_cache.close(complete=not (should_stop and should_stop()))
     
     total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+
+    if db and session_id:
+        _flush_session_writes(session_id)
+    # Completed or cancelled: the checkpoint is only kept for a failed run (or frames that could not be stored)
+    if checkpointer:
+        checkpointer.remove()
+
+    if db and session_id:
+        _finalize_session(session_id, video_path, vid_fps, total_frames, None if continuous else movement_data,
+            energy_stats)
     
+    # No local folder returned anymore; the stage timings feed the scheduler's cost model
+    return timings
+
+def _track_writer(session_id):
+    # Batches of a continuous session go to the tracks collection (printed when running standalone)
+    if db and session_id:
+        return lambda records: db.insert_tracks(session_id, records)
+    return lambda records: print(f"Track batch: {len(records)} records")
+
+def _open_checkpoint(session_id):
+    """Checkpointer of a session and the state to resume from (None for a fresh start)."""
+    path = checkpoint_path(session_id)
+    if path is None:
+        return None, None
+    # A checkpoint is only written once the frames before it are in MongoDB, not just spooled
+    checkpointer = Checkpointer(path, before_save=db.commit_frames if db else None)
+    resume = checkpointer.load()
+    if db:
+        # Frames stored after the checkpoint (or by a run without one) are recomputed
+        db.delete_frames(session_id, after_frame=resume["frame_count"] if resume else 0)
+    if resume is not None:
+        print(f"Resuming session {session_id} from frame {resume['frame_count']}")
+        path = cache_path(session_id)
+        if path and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    return checkpointer, resume
+
+def _open_detection_cache(cap, session_id, segment_index=None):
+    # Detections are cached per session when DETECTION_CACHE_DIR is set, for run_replay()
+    path = cache_path(session_id, segment_index) if session_id else None
+    if path is None:
+        return None
+    return DetectionCacheWriter(path, cap.get(cv2.CAP_PROP_FPS))
+
+def _flush_session_writes(session_id):
+    # Results are read right after processing, so let queued uploads and frame writes land first
+    if frame_uploader and not frame_uploader.drain(session_id, timeout=UPLOAD_DRAIN_TIMEOUT):
+        print(f"Timed out waiting for abnormal frame uploads of session {session_id}")
+    # Frames the database refused are spooled; the results would miss them, so the job fails and its rerun
+    # replays them first
+    if not db.commit_frames():
+        _release_session_writes(session_id)
+        raise RuntimeError(f"Frames of session {session_id} could not be stored in MongoDB yet")
+
+def _release_session_writes(session_id):
+    # A failed run's spooled frames must be replayed before its rerun deletes them, wherever the rerun runs
+    if db and session_id:
+        try:
+            db.release_frames()
+        except Exception as e:
+            print(f"Could not release the frame writes of session {session_id}: {e}")
+
+def _finalize_session(session_id, video_path, vid_fps, total_frames, movement_data, energy_stats=None):
+    """
+    Store the video meta, the session's tracks and the abnormal stats computed from them.
+
+    movement_data is None when the tracks were already streamed to the track store (continuous mode).
+    The abnormal stats are taken from `energy_stats` when it was kept during processing.
+    """
     video_data = {
         "VIDEO_CAP": video_path,
         "IS_CAM": False,
@@ -74,11 +209,19 @@ def run_processing(video_path, session_id=None, callback=None):
         "START_TIME": datetime.datetime.now().strftime("%d/%m/%Y, %H:%M:%S"),
         "TOTAL_FRAMES": total_frames
     }
+    db.update_session_meta(session_id, video_data)
+    if movement_data is not None:
+        db.replace_tracks(session_id, movement_data)
     
-    if db and session_id:
-        db.update_session_meta(session_id, video_data)
-        
-        # Calculate and save abnormal stats to MongoDB
+    # Calculate and save abnormal stats to MongoDB
+    trajectory_tolerance = None
+    if energy_stats is not None and energy_stats.started:
+        orig_stats, clean_stats = energy_stats.stats()
+    else:
+        # Collapsed stationary runs are expanded at their first position, so unless the simplification was
+        # lossless these stats differ from those computed from the raw points; the stats record the tolerance
+        if TRAJECTORY_SIMPLIFY_TOLERANCE and any(record.get("simplified") for record in movement_data or ()):
+            trajectory_tolerance = TRAJECTORY_SIMPLIFY_TOLERANCE
         orig_stats, clean_stats = calculate_abnormal_stats(
             movement_data, 
             vid_fps, 
@@ -86,15 +229,115 @@ def run_processing(video_path, session_id=None, callback=None):
             FRAME_SIZE, 
             TRACK_MAX_AGE
         )
-        if orig_stats and clean_stats:
-            db.insert_abnormal_stats(session_id, orig_stats, clean_stats)
-            
-    cap.release()
+    if orig_stats and clean_stats:
+        db.insert_abnormal_stats(session_id, orig_stats, clean_stats, trajectory_tolerance)
+
+def run_segment(video_path, session_id, segment, callback=None, preview_sink=None, has_preview_subscribers=None,
+                models=None, should_stop=None):
+    """
+    Process one segment of a video (see segments.plan_segments) with its own tracker.
+
+    Frame data is stored under the session with global frame numbers. Movement
+    data and the boundary track snapshots are returned for finalize_segments().
+
+    Returns:
+        Dict with segment, vid_fps, movement_data, snapshots and timings
+    """
+    cap = SegmentCapture(open_capture(video_path, should_stop), segment)
+    if db and session_id:
+        # A retried segment starts over; drop the frames its failed run stored
+        db.delete_frames(session_id, after_frame=segment["start"] - 1, up_to_frame=segment["end"] - 1)
+    
+    net, ln, encoder = models or load_models()
+    tracker = create_tracker()
+    snapshotter = TrackSnapshotter(segment)
     
-    return None # No local folder returned anymore
+    preview = PreviewEncoder(preview_sink, has_preview_subscribers) if preview_sink else None
+    detection_cache = _open_detection_cache(cap, session_id, segment["index"])
+    timings = {}
+    hooks = RunHooks(preview=preview, should_stop=should_stop, timings=timings, frame_offset=segment["warmup"] - 1,
+        record_from=segment["start"], track_observer=snapshotter, detection_cache=detection_cache)
+    try:
+        vid_fps, movement_data = video_process(cap, FRAME_SIZE, net, ln, encoder, tracker, None, None, callback, session_id, hooks)
+    except Exception:
+        _release_session_writes(session_id)
+        raise
+    finally:
+        if preview:
+            preview.close()
+        if detection_cache:
+            detection_cache.close(complete=not (should_stop and should_stop()))
+    cap.release()
+
+    if db and session_id:
+        _flush_session_writes(session_id)
 
-def get_analysis_results(session_id):
-    """Fetches session results from MongoDB and returns a summary JSON."""
+    return {
+        "segment": segment,
+        "vid_fps": vid_fps,
+        "movement_data": movement_data,
+        "snapshots": snapshotter.snapshots,
+        "timings": timings
+    }
+
+def finalize_segments(video_path, session_id, results):
+    """
+    Stitch the tracks of processed segments and finalize the session like run_processing does.
+
+    Returns:
+        Number of tracks stitched across segment boundaries
+    """
+    results = sorted(results, key=lambda r: r["segment"]["index"])
+    movement_data, stitched = merge_segment_results(results)
+    total_frames = results[-1]["segment"]["end"] - 1
+    if db and session_id:
+        _finalize_session(session_id, video_path, results[0]["vid_fps"], total_frames, movement_data)
+    return stitched
+
+def run_replay(source_session_id, session_id, thresholds=None, callback=None):
+    """
+    Re-analyze a processed session from its detection cache into a new session.
+
+    Only the tracker and the analytics run again, so this takes seconds. The
+    new session has no abnormal frame images (there is no video to take them from).
+
+    Args:
+        source_session_id: Session whose detection cache is replayed
+        session_id: Session the results are stored under
+        thresholds: Overrides of video_process.DEFAULT_THRESHOLDS, plus
+            MAX_COSINE_DISTANCE for the tracker
+        callback: Receives per-frame metrics
+
+    Returns:
+        Stage timings measured by video_process
+
+    Raises:
+        FileNotFoundError: If the source session has no detection cache
+    """
+    thresholds = dict(thresholds or {})
+    max_cosine_distance = thresholds.pop("MAX_COSINE_DISTANCE", MAX_COSINE_DISTANCE)
+    path = cache_path(source_session_id)
+    if path is None:
+        raise FileNotFoundError("Detection cache is disabled (DETECTION_CACHE_DIR)")
+    cache = DetectionCache(path)
+    if not cache.complete:
+        raise FileNotFoundError("The detection cache of this session is incomplete")
+
+    tracker = create_tracker(max_cosine_distance)
+    energy_stats = AbnormalEnergyStats(FRAME_SIZE, TRACK_MAX_AGE)
+    timings = {}
+    vid_fps, movement_data = video_process(None, FRAME_SIZE, None, None, None, tracker, None, None, callback, session_id,
+        RunHooks(timings=timings, thresholds=thresholds, replay=cache, energy_stats=energy_stats))
+
+    if db and session_id:
+        source_meta = (db.get_session(source_session_id) or {}).get("video_meta", {})
+        _flush_session_writes(session_id)
+        _finalize_session(session_id, source_meta.get("VIDEO_CAP"), vid_fps, source_meta.get("TOTAL_FRAMES", 0),
+            movement_data, energy_stats)
+    return timings
+
+def get_analysis_results(session_id, include_trends=True):
+    """Fetches session results from MongoDB and returns a summary JSON (with every frame as trends unless include_trends is False)."""
     if not db:
         return {"error": "Database not initialized"}
         
@@ -102,47 +345,14 @@ def get_analysis_results(session_id):
     if not session:
         return {"error": "Session not found"}
         
-    # Get trends (frame-by-frame data)
-    trends = db.get_session_trends(session_id)
-    
-    # Calculate summary statistics from trends
-    if trends:
-        human_counts = [t.get("human_count", 0) for t in trends]
-        violate_counts = [t.get("violate_count", 0) for t in trends]
-        abnormal_flags = [1 if t.get("abnormal_activity", False) else 0 for t in trends]
-        abnormal_frames = sum(abnormal_flags)
-        
-        peak_count = max(human_counts) if human_counts else 0
-        avg_count = round(sum(human_counts) / len(human_counts), 1) if human_counts else 0
-        total_violations = sum(violate_counts)
-        
-        summary = {
-            "peak_count": peak_count,
-            "avg_count": avg_count,
-            "total_abnormal_frames": abnormal_frames,
-            "total_violations": total_violations
-        }
-    else:
-        summary = session.get("summary", {})
-
-    # Reconstruct the analysis format used by the UI
-    # The UI prepares chart data by mapping:
-    # count: item.human_count, violations: item.violate_count, abnormal: item.abnormal
-    # We ensure these keys exist in the trends array.
-    processed_trends = []
-    for t in trends:
-        processed_trends.append({
-            **t,
-            "count": t.get("human_count", 0),
-            "violations": t.get("violate_count", 0),
-            "abnormal": t.get("abnormal_activity", False)
-        })
+    # Summary statistics are computed by MongoDB; the trends carry the keys the UI charts read
+    summary = db.get_session_summary(session_id) or session.get("summary", {})
+    trends = db.get_session_trends(session_id, chart_keys=True) if include_trends else []
 
     analysis = {
         "meta": session.get("video_meta", {}),
         "summary": summary,
-        "movement_data": session.get("movement_data", []),
-        "trends": processed_trends,
+        "trends": trends,
         "images": {
             "crowd_statistics_time": "" # No local images anymore
         }
@@ -0,0 +1,92 @@
+"""
+Throttled live-preview encoder.
+
+Frames are offered by the analysis loop and JPEG-encoded on a background
+thread at no more than PREVIEW_FPS. Only the most recent frame is kept, so a
+slow consumer never queues work on the analysis thread.
+"""
+import threading
+import time
+import cv2
+from config import PREVIEW_FPS, PREVIEW_WIDTH, PREVIEW_JPEG_QUALITY
+
+
+class PreviewEncoder:
+    """
+    Encode preview frames off the analysis thread and hand JPEG bytes to a sink.
+
+    Args:
+        sink: Callable receiving the encoded JPEG bytes of each preview frame
+        has_subscribers: Callable returning True while someone watches the preview
+        fps: Target preview frame rate
+        width: Maximum preview width in pixels
+        quality: JPEG quality
+    """
+
+    def __init__(self, sink, has_subscribers=None, fps=PREVIEW_FPS, width=PREVIEW_WIDTH, quality=PREVIEW_JPEG_QUALITY):
+        self.sink = sink
+        self.has_subscribers = has_subscribers
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.width = width
+        self.quality = quality
+
+        self.frames_offered = 0
+        self.frames_encoded = 0
+
+        self._last_offer = 0.0
+        self._pending = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="preview-encoder", daemon=True)
+        self._thread.start()
+
+    def wants_frame(self):
+        """Whether the next frame should be annotated and offered.
+
+        Cheap enough to call for every processed frame: no subscribers or a
+        frame offered less than one preview interval ago both return False.
+        """
+        if self._closed:
+            return False
+        if self.has_subscribers is not None and not self.has_subscribers():
+            return False
+        return time.monotonic() - self._last_offer >= self.interval
+
+    def offer(self, frame):
+        """Hand a frame to the encoder thread, replacing any frame not yet encoded.
+
+        The frame is not copied; callers must not draw on it afterwards.
+        """
+        with self._cond:
+            self._last_offer = time.monotonic()
+            self._pending = frame
+            self.frames_offered += 1
+            self._cond.notify()
+
+    def close(self, timeout=2.0):
+        """Stop the encoder thread, encoding the last pending frame first."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                frame = self._pending
+                self._pending = None
+                if frame is None and self._closed:
+                    return
+
+            try:
+                h, w = frame.shape[:2]
+                if w > self.width:
+                    frame = cv2.resize(frame, (self.width, int(h * self.width / w)))
+                ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if ok:
+                    self.frames_encoded += 1
+                    self.sink(buffer.tobytes())
+            except Exception as e:
+                print(f"Error encoding preview frame: {e}")
@@ -0,0 +1,214 @@
+"""
+Parallel segment processing of one long video.
+
+The video is split into consecutive time segments that are processed by
+separate workers, each with its own tracker. Every segment except the first
+starts a little earlier than the frames it records (the overlap) so its
+tracker is warmed up when recording starts. At the last analyzed frame before
+a segment boundary both neighbouring trackers take a snapshot of their
+confirmed tracks; tracks are stitched across the boundary by matching these
+snapshots on bounding box IoU and mean appearance feature.
+
+Frame numbers are global (1-based, as in video_process), so frame metrics of
+all segments land in the session as if one process had produced them.
+"""
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from config import DATA_RECORD_RATE, TRAJECTORY_SIMPLIFY_TOLERANCE
+from deep_sort.trajectory import record_rows, trajectory_fields
+
+# Seconds of video each segment processes before the frames it records
+SEGMENT_OVERLAP_SECONDS = 5
+# Minimum analyzed frames in the overlap (Deep SORT confirms tracks after 3 hits)
+SEGMENT_MIN_OVERLAP_FRAMES = 5
+# A track pair is stitched when its boxes overlap at least this much...
+STITCH_MIN_IOU = 0.5
+# ...and its mean appearance features are at most this cosine distance apart
+STITCH_MAX_COSINE = 0.3
+# Appearance samples per track averaged into the snapshot feature
+STITCH_FEATURE_SAMPLES = 10
+
+
+def data_record_frame(fps):
+    """Frame skipping step used by video_process for a given FPS."""
+    if fps <= 0:
+        fps = 30
+    return max(1, int(fps / DATA_RECORD_RATE))
+
+
+def plan_segments(probe, count, overlap_seconds=SEGMENT_OVERLAP_SECONDS):
+    """
+    Split a probed video into `count` segments.
+
+    Returns:
+        List of dicts with index, warmup (first frame read), start (first frame
+        recorded), end (first frame of the next segment), head_boundary and
+        tail_boundary (frames the stitching snapshots are taken at, or None)
+    """
+    frame_count = probe["frame_count"]
+    step = data_record_frame(probe["fps"])
+    overlap = max(int(overlap_seconds * probe["fps"]), SEGMENT_MIN_OVERLAP_FRAMES * step)
+
+    starts = [1 + (frame_count * i) // count for i in range(count)] + [frame_count + 1]
+    segments = []
+    for i in range(count):
+        start, end = starts[i], starts[i + 1]
+        segments.append({
+            "index": i,
+            "warmup": max(1, start - overlap),
+            "start": start,
+            "end": end,
+            # Last analyzed frame before the boundary, seen by both neighbouring segments
+            "head_boundary": ((start - 1) // step) * step if i > 0 else None,
+            "tail_boundary": ((end - 1) // step) * step if i < count - 1 else None
+        })
+    return segments
+
+
+class SegmentCapture:
+    """Wraps a cv2.VideoCapture positioned at a segment's warm-up frame and ends it at the segment end."""
+
+    def __init__(self, cap, segment):
+        self.cap = cap
+        self.remaining = segment["end"] - segment["warmup"]
+        cap.set(cv2.CAP_PROP_POS_FRAMES, segment["warmup"] - 1)
+
+    def read(self):
+        if self.remaining <= 0:
+            return False, None
+        self.remaining -= 1
+        return self.cap.read()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+
+class TrackSnapshotter:
+    """
+    Track observer for video_process that records the confirmed tracks at the
+    segment's boundary frames.
+    """
+
+    def __init__(self, segment):
+        self.frames = {}
+        if segment["head_boundary"] is not None:
+            self.frames[segment["head_boundary"]] = "head"
+        if segment["tail_boundary"] is not None:
+            self.frames[segment["tail_boundary"]] = "tail"
+        self.snapshots = {"head": None, "tail": None}
+
+    def __call__(self, frame_count, tracker):
+        side = self.frames.get(frame_count)
+        if side is None:
+            return
+        snapshot = []
+        for track in tracker.tracks:
+            if not track.is_confirmed():
+                continue
+            samples = tracker.metric.samples.get(track.track_id)
+            if not samples:
+                continue
+            feature = np.mean(samples[-STITCH_FEATURE_SAMPLES:], axis=0)
+            feature /= np.linalg.norm(feature) or 1.0
+            snapshot.append({
+                "track_id": int(track.track_id),
+                "tlbr": [float(v) for v in track.to_tlbr()],
+                "feature": feature.astype(np.float32).tolist(),
+                "positions": len(track.positions)
+            })
+        self.snapshots[side] = snapshot
+
+
+def _iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def match_snapshots(tail, head, min_iou=STITCH_MIN_IOU, max_cosine=STITCH_MAX_COSINE):
+    """
+    Match the tail snapshot of one segment with the head snapshot of the next.
+
+    Returns:
+        Dict mapping track ids of the next segment to track ids of the previous one
+    """
+    if not tail or not head:
+        return {}
+    iou = np.array([[_iou(t["tlbr"], h["tlbr"]) for h in head] for t in tail])
+    features_tail = np.array([t["feature"] for t in tail])
+    features_head = np.array([h["feature"] for h in head])
+    cosine = 1.0 - features_tail @ features_head.T
+
+    cost = (1.0 - iou) + cosine
+    gated = (iou < min_iou) | (cosine > max_cosine)
+    cost[gated] = 1e5
+    rows, cols = linear_sum_assignment(cost)
+    return {head[c]["track_id"]: tail[r]["track_id"] for r, c in zip(rows, cols) if not gated[r, c]}
+
+
+def merge_segment_results(results):
+    """
+    Merge the movement data of processed segments into one set of tracks.
+
+    Track ids are renumbered globally; a track continuing across a boundary
+    keeps the id of its first segment and its positions are concatenated,
+    dropping the positions the next segment recorded during its warm-up.
+
+    Args:
+        results: Segment results ordered by index, each with segment, movement_data
+            (records {track_id, entry, exit, trajectory}) and snapshots
+
+    Returns:
+        (movement_data, number of stitched tracks)
+    """
+    merged = []
+    next_id = 1
+    stitched = 0
+    previous_tracks = {}
+    previous_tail = None
+
+    for result in results:
+        segment = result["segment"]
+        head = result["snapshots"]["head"] or []
+        head_positions = {h["track_id"]: h["positions"] for h in head}
+        continues = match_snapshots(previous_tail, head)
+
+        tracks = {}
+        for record in result["movement_data"]:
+            track_id, entry = record["track_id"], record["entry"]
+            rows = record_rows(record)
+            previous_id = continues.get(track_id)
+            if previous_id is not None and previous_id in previous_tracks:
+                # Continuation: skip the positions the previous segment already has
+                target = previous_tracks[previous_id]
+                target["exit"] = record["exit"]
+                target["parts"].append(rows[head_positions[track_id]:])
+                stitched += 1
+            else:
+                if track_id in head_positions:
+                    # Warm-up duplicate of a track the previous segment could not match
+                    rows = rows[head_positions[track_id]:]
+                    entry = segment["start"]
+                    if not len(rows):
+                        continue
+                target = {"track_id": next_id, "entry": entry, "exit": record["exit"], "parts": [rows]}
+                next_id += 1
+                merged.append(target)
+            tracks[track_id] = target
+
+        previous_tracks = tracks
+        previous_tail = result["snapshots"]["tail"]
+
+    movement_data = [{
+        "track_id": track["track_id"],
+        "entry": track["entry"],
+        "exit": track["exit"],
+        **trajectory_fields(np.concatenate(track["parts"]), TRAJECTORY_SIMPLIFY_TOLERANCE)
+    } for track in merged]
+    return movement_data, stitched
@@ -0,0 +1,100 @@
+"""
+Video capture for files that are still being uploaded.
+
+While an upload is in progress the API keeps a marker file next to the video
+(`<video>.uploading`). OpenCV stops at the current end of a growing file, so
+when a read fails and the marker still exists, GrowingFileCapture waits for
+more data, reopens the file and seeks back to the next frame.
+"""
+import os
+import time
+import cv2
+
+UPLOAD_MARKER_SUFFIX = ".uploading"
+# Seconds between checks for more data
+GROWING_POLL_INTERVAL = 1.0
+# Give up waiting when the file has not grown for this long (client went away)
+GROWING_STALL_TIMEOUT = 300.0
+
+
+def upload_marker(video_path):
+    return video_path + UPLOAD_MARKER_SUFFIX
+
+
+def is_uploading(video_path):
+    return os.path.exists(upload_marker(video_path))
+
+
+class GrowingFileCapture:
+    """
+    cv2.VideoCapture look-alike that follows a file until its upload completes.
+
+    Args:
+        video_path: Video being uploaded
+        should_stop: Returns True to stop waiting (job cancellation)
+    """
+
+    def __init__(self, video_path, should_stop=None, poll_interval=GROWING_POLL_INTERVAL,
+                 stall_timeout=GROWING_STALL_TIMEOUT):
+        self.video_path = video_path
+        self.should_stop = should_stop
+        self.poll_interval = poll_interval
+        self.stall_timeout = stall_timeout
+        self.cap = cv2.VideoCapture(video_path)
+        self.position = 0  # Index of the next frame to read
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            ret, frame = self._wait_and_read()
+        if ret:
+            self.position += 1
+        return ret, frame
+
+    def _wait_and_read(self):
+        size = os.path.getsize(self.video_path)
+        last_growth = time.monotonic()
+        while is_uploading(self.video_path):
+            if self.should_stop is not None and self.should_stop():
+                return False, None
+            time.sleep(self.poll_interval)
+            new_size = os.path.getsize(self.video_path)
+            if new_size == size:
+                if time.monotonic() - last_growth > self.stall_timeout:
+                    print(f"Upload of {self.video_path} stalled, processing what has arrived")
+                    return False, None
+                continue
+            size, last_growth = new_size, time.monotonic()
+            ret, frame = self._reopen_and_read()
+            if ret:
+                return ret, frame
+        # Upload finished while we were waiting: the rest of the file is there
+        return self._reopen_and_read()
+
+    def _reopen_and_read(self):
+        self.cap.release()
+        self.cap = cv2.VideoCapture(self.video_path)
+        if self.position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+        return self.cap.read()
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+
+def open_capture(video_path, should_stop=None):
+    """Open a video, following it while it is still being uploaded."""
+    if is_uploading(video_path):
+        return GrowingFileCapture(video_path, should_stop)
+    return cv2.VideoCapture(video_path)
@@ -0,0 +1,103 @@
+"""
+Streaming track persistence for continuous (live stream) processing.
+
+A file-based session collects the movement data of every track in memory and
+stores it when the video ends. A live feed never ends, so in continuous mode
+video_process hands tracks to a TrackSink instead:
+
+- expired tracks are written out in batches as they expire
+- the trail of a long-lived track (a loiterer) is capped at MAX_TRAIL_POINTS;
+  older points are written out as partial records and dropped from memory
+
+Records are the track records of file sessions (see
+deep_sort.trajectory.trajectory_fields) plus "part" and "first_point": the
+trajectory holds the points first_point.. of the track, and `final` marks
+the record written at expiry.
+"""
+import time
+from config import MAX_TRAIL_POINTS, TRAJECTORY_SIMPLIFY_TOLERANCE
+from deep_sort.trajectory import trajectory_fields
+
+TRACK_BATCH_SIZE = 100
+TRACK_FLUSH_INTERVAL = 5.0
+# Points left in memory after a spill (the speed and energy analytics need the last two)
+TRAIL_KEEP_POINTS = 2
+
+
+class TrackSink:
+    """
+    Batches track records for `write_batch(records)`.
+
+    Args:
+        write_batch: Stores a list of records (e.g. db.insert_tracks bound to a session)
+        max_trail: Trail points kept in memory per track
+        energy_stats: analysis_utils.AbnormalEnergyStats fed the points of every record
+    """
+
+    def __init__(self, write_batch, max_trail=MAX_TRAIL_POINTS, batch_size=TRACK_BATCH_SIZE,
+                 flush_interval=TRACK_FLUSH_INTERVAL, energy_stats=None):
+        self.write_batch = write_batch
+        self.energy_stats = energy_stats
+        self.max_trail = max(max_trail, TRAIL_KEEP_POINTS + 1)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self.counters = {"tracks_written": 0, "points_spilled": 0, "records_written": 0, "batches": 0}
+        self.memory = {"active_tracks": 0, "trail_points": 0, "gallery_samples": 0, "pending_records": 0}
+
+    def add_track(self, track):
+        """Write out a track that expired (or was still active when processing ended)."""
+        self._pending.append(self._record(track, track.positions.rows, final=True))
+        self.counters["tracks_written"] += 1
+        self._maybe_flush()
+
+    def trim(self, track):
+        """Spill the older trail points of a track once it exceeds max_trail."""
+        if len(track.positions) <= self.max_trail:
+            return
+        spilled = track.positions.spill(TRAIL_KEEP_POINTS)
+        self._pending.append(self._record(track, spilled, final=False))
+        track.spilled_points += len(spilled)
+        track.spilled_parts += 1
+        self.counters["points_spilled"] += len(spilled)
+        self._maybe_flush()
+
+    def observe(self, tracker):
+        """Trim the trails of the tracker's tracks and refresh the memory counters."""
+        for track in tracker.tracks:
+            self.trim(track)
+        self.memory = {
+            "active_tracks": len(tracker.tracks),
+            "trail_points": sum(len(track.positions) for track in tracker.tracks),
+            "gallery_samples": sum(len(samples) for samples in tracker.metric.samples.values()),
+            "pending_records": len(self._pending)
+        }
+
+    def stats(self):
+        return {**self.memory, **self.counters}
+
+    def flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self.write_batch(batch)
+            self.counters["records_written"] += len(batch)
+            self.counters["batches"] += 1
+        self._last_flush = time.monotonic()
+
+    def _maybe_flush(self):
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _record(self, track, rows, final):
+        if self.energy_stats is not None:
+            self.energy_stats.add_track(rows[:, :2])
+        return {
+            "track_id": int(track.track_id),
+            "entry": track.entry,
+            "exit": track.exit if final else None,
+            "part": track.spilled_parts,
+            "first_point": track.spilled_points,
+            "final": final,
+            **trajectory_fields(rows, TRAJECTORY_SIMPLIFY_TOLERANCE)
+        }
@@ -6,9 +6,15 @@ from deep_sort import nn_matching
 from deep_sort.detection import Detection
 from deep_sort.tracker import Tracker
 from deep_sort import generate_detections as gdet
+from detection_cache import CachedDetections, FEATURE_DIM
 
-def detect_human (net, ln, frame, encoder, tracker, time):
-# Get the dimension of the frame
+def detect_people(net, ln, frame, encoder):
+	"""Run YOLO, non-maxima suppression and the ReID encoder on one frame.
+
+	Returns a CachedDetections (empty when nobody is detected), which is also
+	what the detection cache stores and replays.
+	"""
+	# Get the dimension of the frame
 	(frame_height, frame_width) = frame.shape[:2]
 	# Initialize lists needed for detection
 	boxes = []
@@ -48,26 +54,26 @@ def detect_human (net, ln, frame, encoder, tracker, time):
 	# Output will be indexs of useful boxes
 	idxs = cv2.dnn.NMSBoxes(boxes, confidences, MIN_CONF, NMS_THRESH)
 
+	if len(idxs) == 0:
+		return CachedDetections(np.empty((0, 4), dtype=int), np.empty(0), np.empty((0, 2), dtype=int), np.empty((0, FEATURE_DIM)))
+
+	keep = sorted(int(i) for i in np.array(idxs).flatten())
+	boxes = np.array([boxes[i] for i in keep])
+	centroids = np.array([centroids[i] for i in keep])
+	confidences = np.array([confidences[i] for i in keep])
+	features = np.array(encoder(frame, boxes))
+	return CachedDetections(boxes, confidences, centroids, features)
+
+def track_people(detections, tracker, time, frame=0):
+	"""Update the tracker with one frame's detections (fresh or replayed from the cache)."""
 	tracked_bboxes = []
 	expired = []
-	if len(idxs) > 0:
-		del_idxs = []
-		for i in range(len(boxes)):
-			if i not in idxs:
-				del_idxs.append(i)
-		for i in sorted(del_idxs, reverse=True):
-			del boxes[i]
-			del centroids[i]
-			del confidences[i]
-
-		boxes = np.array(boxes)
-		centroids = np.array(centroids)
-		confidences = np.array(confidences)
-		features = np.array(encoder(frame, boxes))
-		detections = [Detection(bbox, score, centroid, feature) for bbox, score, centroid, feature in zip(boxes, scores, centroids, features)]
+	if len(detections) > 0:
+		detections = [Detection(bbox, score, centroid, feature) for bbox, score, centroid, feature in
+			zip(detections.boxes, detections.confidences, detections.centroids, detections.features)]
 
 		tracker.predict()
-		expired = tracker.update(detections, time)
+		expired = tracker.update(detections, time, frame)
 
 
 		# Obtain info from the tracks
@@ -78,3 +84,5 @@ def detect_human (net, ln, frame, encoder, tracker, time):
 
 	return [tracked_bboxes, expired]
 
+def detect_human (net, ln, frame, encoder, tracker, time, frame_count=0):
+	return track_people(detect_people(net, ln, frame, encoder), tracker, time, frame_count)
@@ -0,0 +1,45 @@
+"""
+Cheap pre-flight probe of a video file.
+
+Reads container metadata only (no decoding beyond the header), so it can run
+at upload time to estimate how much work processing the video will be.
+"""
+import cv2
+from config import DATA_RECORD_RATE
+
+
+def probe_video(video_path):
+    """
+    Read frame count, FPS and resolution of a video.
+
+    Returns:
+        Dict with frame_count, fps, width, height, duration (seconds) and
+        analyzed_frames (frames video_process runs detection on), or None
+        if the file cannot be opened
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return None
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+
+    if frame_count <= 0 or width <= 0 or height <= 0:
+        return None
+    # Same fallback and frame skipping as video_process
+    if fps <= 0:
+        fps = 30
+    data_record_frame = max(1, int(fps / DATA_RECORD_RATE))
+
+    return {
+        "frame_count": frame_count,
+        "fps": fps,
+        "width": width,
+        "height": height,
+        "duration": frame_count / fps,
+        "analyzed_frames": frame_count // data_record_frame
+    }
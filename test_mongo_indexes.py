@@ -0,0 +1,84 @@
+"""
+Test script to check that the hot MongoDB queries use indexes
+Creates the managed indexes (apis/indexes.py), explains every query of
+HOT_QUERIES for the latest session and reports the ones that scan a whole
+collection. Exits with status 1 if any does.
+"""
+import os
+import sys
+from pathlib import Path
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+import certifi
+
+sys.path.append(str(Path(__file__).parent / "apis"))
+from indexes import INDEXES, HOT_QUERIES, ensure_indexes, explain_query
+
+# Load environment variables
+env_path = Path(__file__).parent / '.env'
+load_dotenv(dotenv_path=env_path)
+
+MONGO_URI = os.getenv("MONGO_URI")
+DB_NAME = os.getenv("DB_NAME", "video_output")
+FRAME_STORAGE = os.getenv("FRAME_STORAGE", "documents").lower()
+FRAME_COLLECTION = os.getenv("FRAME_TIMESERIES_COLLECTION", "frame_metrics") if FRAME_STORAGE == "timeseries" else "yolov"
+
+if not MONGO_URI:
+    print("ERROR: MONGO_URI not found in .env file")
+    exit(1)
+
+print("=" * 60)
+print("MongoDB Index Test")
+print("=" * 60)
+print(f"DB_NAME: {DB_NAME}")
+print(f"Frame collection: {FRAME_COLLECTION} ({FRAME_STORAGE})")
+print("=" * 60)
+
+try:
+    client = MongoClient(
+        MONGO_URI,
+        server_api=ServerApi('1'),
+        tls=True,
+        tlsCAFile=certifi.where(),
+        connectTimeoutMS=30000,
+        serverSelectionTimeoutMS=30000
+    )
+    client.admin.command('ping')
+except Exception as e:
+    print(f"✗ Could not connect: {str(e)[:300]}")
+    print("Run test_mongo_connection.py to diagnose the connection")
+    exit(1)
+
+db = client[DB_NAME]
+
+print("\nCreating indexes...")
+created = ensure_indexes(db, FRAME_COLLECTION, timeseries=FRAME_STORAGE == "timeseries")
+for collection in INDEXES:
+    collection = FRAME_COLLECTION if collection == "yolov" else collection
+    if collection in created:
+        print(f"✓ {collection}: {', '.join(created[collection])}")
+    else:
+        print(f"✗ {collection}: indexes could not be created (see above)")
+
+latest = db["session"].find_one({}, {"session_id": 1}, sort=[("start_time", -1)])
+session_id = latest["session_id"] if latest else "no-session"
+print(f"\nExplaining hot queries for session {session_id}...")
+
+scans = []
+for description, collection, query, sort in HOT_QUERIES:
+    stages = explain_query(db, collection, query, sort, session_id, FRAME_COLLECTION)
+    if "COLLSCAN" in stages:
+        scans.append(description)
+        print(f"✗ {description} ({collection}): {' <- '.join(stages)}")
+    else:
+        print(f"✓ {description} ({collection}): {' <- '.join(stages)}")
+
+client.close()
+print("\n" + "=" * 60)
+if scans:
+    print(f"{len(scans)} queries scan a whole collection: {', '.join(scans)}")
+    print("=" * 60)
+    exit(1)
+print("Every hot query uses an index")
+print("=" * 60)
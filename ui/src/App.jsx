@@ -26,9 +26,9 @@ function App() {
     violations: 0,
     abnormal: false,
     restricted: false,
-    frame: 0,
-    frameImage: null  // Base64 encoded frame image
+    frame: 0
   });
+  const [previewUrl, setPreviewUrl] = useState(null); // Object URL of the latest binary preview frame
   const [chartData, setChartData] = useState([]);
   const [sessions, setSessions] = useState([]);
   const [selectedSession, setSelectedSession] = useState(null);
@@ -70,13 +70,14 @@ function App() {
               setProcessingStatus('idle');
               alert(`Processing failed: ${msg.error || 'Unknown error'}`);
             } else if (msg.type === 'realtime') {
-              setRealtimeData({
+              // Upload notifications only carry the URL of an earlier abnormal frame
+              const isUploadEvent = msg.data.event === 'frame_uploaded';
+              if (!isUploadEvent) setRealtimeData({
                 count: msg.data.human_count || 0,
                 violations: msg.data.violate_count || 0,
                 abnormal: msg.data.abnormal || false,
                 restricted: msg.data.restricted_entry || false,
-                frame: msg.data.frame || 0,
-                frameImage: msg.data.frame_image || null  // Base64 encoded frame image
+                frame: msg.data.frame || 0
               });
               
               // Track abnormal frames with Cloudinary URL
@@ -96,7 +97,7 @@ function App() {
                   return prev;
                 });
               }
-              setChartData(prev => {
+              if (!isUploadEvent) setChartData(prev => {
                 const newData = [...prev.slice(-99), {
                   time: msg.data.frame || 0,
                   count: msg.data.human_count || 0,
@@ -143,6 +144,25 @@ function App() {
     };
   }, [fileId]);
 
+  // Live preview arrives as binary JPEG messages on a per-session socket
+  useEffect(() => {
+    if (!fileId || processingStatus !== 'processing') return;
+    const previewWs = new WebSocket(`${WS_URL}/preview/${fileId}`);
+    previewWs.binaryType = 'blob';
+    let currentUrl = null;
+    previewWs.onmessage = (event) => {
+      const url = URL.createObjectURL(event.data);
+      setPreviewUrl(url);
+      if (currentUrl) URL.revokeObjectURL(currentUrl);
+      currentUrl = url;
+    };
+    return () => {
+      previewWs.close();
+      if (currentUrl) URL.revokeObjectURL(currentUrl);
+      setPreviewUrl(null);
+    };
+  }, [fileId, processingStatus]);
+
   const fetchSessions = async () => {
     setLoadingSessions(true);
     try {
@@ -159,7 +179,7 @@ function App() {
     if (!file) return;
     setProcessingStatus('uploading');
     setChartData([]);
-    setRealtimeData({ count: 0, violations: 0, abnormal: false, restricted: false, frame: 0, frameImage: null });
+    setRealtimeData({ count: 0, violations: 0, abnormal: false, restricted: false, frame: 0 });
     setAbnormalFrames([]); // Reset abnormal frames
     setRemarks([]); // Reset remarks
     setCurrentSession(null);
@@ -172,6 +192,18 @@ function App() {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
       setFileId(res.data.file_id);
+      if (res.data.status === 'completed') {
+        // Identical video was analyzed before: results are returned right away
+        setProcessingStatus('completed');
+        fetchSessions();
+        setCurrentSession({
+          file_id: res.data.file_id,
+          filename: res.data.filename,
+          analysis: res.data.analysis,
+          status: 'completed'
+        });
+        return;
+      }
       setProcessingStatus('processing');
       setCurrentSession({
         file_id: res.data.file_id,
@@ -288,8 +320,12 @@ function App() {
   // Calculate statistics for pie chart
   const getAbnormalStats = (session) => {
     if (!session || !session.trends) return null;
-    const total = session.trends.length;
-    const abnormal = session.trends.filter(t => t.abnormal !== undefined ? t.abnormal : t.abnormal_activity).length;
+    // Trends of stored sessions are downsampled; count frames from the summary
+    const summary = session.session?.summary;
+    const total = summary?.frame_count ?? session.trends.length;
+    const abnormal = summary?.frame_count !== undefined
+      ? summary.total_abnormal_frames
+      : session.trends.filter(t => t.abnormal !== undefined ? t.abnormal : t.abnormal_activity).length;
     return [
       { name: 'Normal', value: total - abnormal },
       { name: 'Abnormal', value: abnormal }
@@ -512,9 +548,9 @@ function App() {
                   {/* Video Frame Display */}
                   <div className="lg:col-span-2">
                     <div className="relative bg-black rounded-lg overflow-hidden" style={{ aspectRatio: '16/9' }}>
-                      {realtimeData.frameImage ? (
+                      {previewUrl ? (
                         <img
-                          src={`data:image/jpeg;base64,${realtimeData.frameImage}`}
+                          src={previewUrl}
                           alt="Processing frame"
                           className="w-full h-full object-contain"
                         />
@@ -527,7 +563,7 @@ function App() {
                         </div>
                       )}
                       {/* Overlay with frame info */}
-                      {realtimeData.frameImage && (
+                      {previewUrl && (
                         <div className="absolute top-4 left-4 bg-black bg-opacity-70 text-white px-3 py-2 rounded-lg text-sm font-semibold">
                           Frame #{realtimeData.frame}
                         </div>